@@ -0,0 +1,233 @@
+"""
+Agent公共部分 - 同步版本AIAgent和异步版本AsyncAIAgent共用的配置、消息构建和结果处理
+两个版本只在发出请求的方式上不同（线程或协程），其余逻辑都在这里，修改时只需改一处
+"""
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from prompts import (
+    build_style_draft_messages,
+    build_style_draft_from_card_messages,
+    build_one_shot_messages,
+    build_rule_repair_messages,
+)
+from llm_backend import LLMBackend, create_backend
+from response_cache import ResponseCache
+from metrics import MetricsRegistry, usage_tokens
+from reference_budget import ReferenceBudget, BudgetResult
+from style_cards import StyleCardStore
+from patches import PatchMode, parse_patches, apply_patches
+from chunking import ChunkingPolicy, Chunk
+from rule_engine import RuleEngine, MechanicalRule, RuleViolation
+from model_routing import ModelRouter, StepRoute
+from single_flight import SingleFlight
+from resilience import Deadline, RetryPolicy, CircuitBreaker
+from rate_limit import RateLimiter
+
+# 各生成步骤的名称，用于错误信息
+STEP_LABELS = {
+    "style_draft": "生成风格化初稿",
+    "style_card": "提炼风格卡片",
+    "preferences": "应用偏好",
+    "restrictions": "应用限制规则",
+    "instruction_edit": "根据指令修改文案",
+    "restrictions_patch": "局部应用限制规则",
+    "preferences_chunk": "分段应用偏好",
+    "restrictions_chunk": "分段应用限制规则",
+    "consistency": "衔接检查",
+    "rule_repair": "修正违反规则之处",
+    "instruction_patch": "根据指令局部修改文案",
+    "one_shot": "一步生成终稿",
+    "learn_preferences": "学习偏好",
+    "learn_rules": "学习规则",
+}
+
+class BaseAgent:
+    """
+    AIAgent和AsyncAIAgent的公共基类：请求前的消息构建、缓存键和路由，请求后的补丁应用、分段拼接、规则检查、记录指标和写入缓存都是纯本地计算，由两个版本共用；
+    子类只负责真正发出请求（_chat等），以及按顺序调用这些步骤
+    """
+    
+    def __init__(self, cache: Optional[ResponseCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 step_timeout: Optional[float] = None, backend: Optional[LLMBackend] = None,
+                 metrics: Optional[MetricsRegistry] = None, reference_budget: Optional[ReferenceBudget] = None,
+                 style_cards: Optional[StyleCardStore] = None, patch_mode: Optional[PatchMode] = None,
+                 chunking: Optional[ChunkingPolicy] = None, rule_engine: Optional[RuleEngine] = None,
+                 router: Optional[ModelRouter] = None, single_flight: Optional[SingleFlight] = None):
+        # 大模型后端，默认按环境变量AI_BACKEND选择（ark或local）
+        self.backend = backend or create_backend()
+        self.model = self.backend.model
+        self.completion_params = self.backend.completion_params
+        
+        # 按步骤选择模型、超时和最大输出长度，AI_MODEL_ROUTES指定路由表，未配置的步骤使用默认模型
+        self.router = router or ModelRouter.from_env()
+        for step in self.router.routes:
+            if step != "default" and step not in STEP_LABELS:
+                print(f"模型路由表中的步骤{step}不存在，已忽略（可选: {', '.join(STEP_LABELS)}）")
+        
+        # 响应缓存，默认使用进程内共享的缓存，设置环境变量AI_CACHE_DISABLED=1可关闭
+        self.cache = cache if cache is not None else ResponseCache.default()
+        
+        # 相同的请求同时在进行时只调用一次模型，AI_SINGLE_FLIGHT=0关闭
+        self.single_flight = single_flight or SingleFlight.default()
+        
+        # 每一步调用的token用量和耗时
+        self.metrics = metrics or MetricsRegistry.default()
+        
+        # 参考文案的token预算，AI_REFERENCE_TOKEN_BUDGET=0表示不限制
+        self.reference_budget = reference_budget or ReferenceBudget.from_env()
+        
+        # 风格卡片：AI_STYLE_CARDS=on（默认）使用已保存的卡片，auto还会在后台为新的参考文案提炼卡片，off关闭
+        self.style_card_mode = os.getenv("AI_STYLE_CARDS", "on")
+        if style_cards is None and self.style_card_mode != "off":
+            style_cards = StyleCardStore.default()
+        self.style_cards = style_cards
+        
+        # 补丁模式：局部修改时模型只输出替换列表，AI_PATCH_MODE=on/auto开启
+        self.patch_mode = patch_mode or PatchMode.from_env()
+        
+        # 分段处理：AI_CHUNKED=1时长文案按段落切块并发应用偏好和规则
+        self.chunking = chunking or ChunkingPolicy.from_env()
+        
+        # 本地规则引擎：标点数量、禁用字词等机械规则不调用大模型
+        self.rule_engine = rule_engine or RuleEngine.default()
+        
+        # 容错：每一步的默认超时、重试策略和按模型端点共享的熔断器
+        self.step_timeout = step_timeout or float(os.getenv("AI_STEP_TIMEOUT", "120"))
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = CircuitBreaker.for_endpoint(self.model)
+        
+        # 客户端限流和自适应并发控制，按模型端点在进程内共享，线程和协程发出的请求一起计入配额
+        self.limiter = RateLimiter.for_endpoint(self.model)
+    
+    def _request_key(self, messages: List[Dict[str, str]], route: Optional[StepRoute] = None) -> str:
+        """请求的唯一标识（包含本步骤路由到的模型和最大输出长度），用作缓存键和合并相同请求的键"""
+        params = self.completion_params
+        if route is not None and route.max_tokens:
+            params = {**params, "max_tokens": route.max_tokens}
+        return ResponseCache.make_key(route.model if route and route.model else self.model, messages, params)
+    
+    def _cache_key(self, messages: List[Dict[str, str]], use_cache: bool,
+                   route: Optional[StepRoute] = None) -> Optional[str]:
+        """计算缓存键，不使用缓存时返回None"""
+        if self.cache is None or not use_cache:
+            return None
+        return self._request_key(messages, route)
+    
+    def _cached(self, step: str, cache_key: Optional[str], started: float, streaming: bool = False) -> Optional[str]:
+        """缓存中已有的结果，命中时记录指标；未命中或不使用缓存时返回None"""
+        if not cache_key:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            elapsed = time.monotonic() - started
+            self.metrics.record(step, wall_time=elapsed, ttft=elapsed if streaming else None, cached=True)
+        return cached
+    
+    def _route(self, step: str, context_id: Optional[str] = None) -> StepRoute:
+        """本步骤的路由；服务端上下文绑定了创建时的模型，在上下文中的请求不做路由"""
+        if context_id:
+            return StepRoute()
+        return self.router.route(step)
+    
+    def _endpoint(self, model: Optional[str]):
+        """模型对应的熔断器和限流器（按模型端点在进程内共享）"""
+        if not model or model == self.model:
+            return self.breaker, self.limiter
+        return CircuitBreaker.for_endpoint(model), RateLimiter.for_endpoint(model)
+    
+    def _step_deadline(self, deadline: Optional[Deadline], timeout: Optional[float] = None) -> Deadline:
+        """本步骤的截止时间：取调用方传入的截止时间与步骤超时（路由表中配置的或默认的）中较早的一个"""
+        timeout = timeout or self.step_timeout
+        if deadline is None:
+            return Deadline(timeout)
+        return deadline.earliest(timeout)
+    
+    def _fallback_model(self, step: str, route: StepRoute, deadline: Optional[Deadline]) -> Optional[str]:
+        """本步骤超时后可以改用的备用模型；没有配置或调用方的截止时间已到时返回None"""
+        if not route.fallback_model or (deadline is not None and deadline.expired()):
+            return None
+        self.router.record_fallback(step)
+        print(f"{STEP_LABELS[step]}超时，改用备用模型{route.fallback_model}重试")
+        return route.fallback_model
+    
+    def fit_references(self, reference_texts: List[str]) -> BudgetResult:
+        """按token预算挑选参考文案段落；调用方可用返回结果向用户说明删去了哪些段落"""
+        if self.reference_budget is None:
+            return BudgetResult(list(reference_texts), 0, 0)
+        return self.reference_budget.fit(reference_texts)
+    
+    def find_style_card(self, reference_texts: List[str]) -> Optional[str]:
+        """这组参考文案已保存的风格卡片，没有则返回None"""
+        if self.style_cards is None:
+            return None
+        return self.style_cards.get(reference_texts)
+    
+    def _auto_distill(self, reference_texts: List[str]):
+        """没有风格卡片时的后台提炼，默认不做；同步版本在auto模式下覆盖"""
+    
+    def _style_draft_messages(self, user_input_text: str, reference_texts: List[str]) -> List[Dict[str, str]]:
+        """有风格卡片时用卡片代替完整参考文案，否则按预算挑选参考文案"""
+        style_card = self.find_style_card(reference_texts)
+        if style_card:
+            return build_style_draft_from_card_messages(user_input_text, style_card)
+        self._auto_distill(reference_texts)
+        return build_style_draft_messages(user_input_text, self.fit_references(reference_texts).texts)
+    
+    def _one_shot_messages(self, user_input_text: str, reference_texts: List[str],
+                           selected_preferences: List[Dict[str, Any]],
+                           selected_rules: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        style_card = self.find_style_card(reference_texts)
+        if not style_card:
+            self._auto_distill(reference_texts)
+            reference_texts = self.fit_references(reference_texts).texts
+        return build_one_shot_messages(user_input_text, reference_texts, selected_preferences, selected_rules,
+                                       style_card=style_card)
+    
+    def _patched(self, draft: str, content: str) -> Optional[str]:
+        """在本地应用模型输出的替换列表；格式不对或原片段匹配不上时返回None，由调用方整篇重写"""
+        patches = parse_patches(content)
+        result = apply_patches(draft, patches) if patches is not None else None
+        self.patch_mode.record(result is not None)
+        return result
+    
+    def _chunk_requests(self, build_messages, draft: str,
+                        items: List[Dict[str, Any]]) -> List[Tuple[Chunk, List[Dict[str, str]]]]:
+        """把文案切成块，返回每一块和处理它的请求消息（附带前后文）"""
+        return [(chunk, build_messages(chunk.text, items, chunk.before, chunk.after))
+                for chunk in self.chunking.split(draft)]
+    
+    def _check_rules(self, draft: str, checks: List[MechanicalRule]) -> Tuple[str, List[RuleViolation]]:
+        """
+        生成后检查可检查的规则：违反时先在本地修正，
+        返回修正后的文案和仍然违反的规则（如字数超限、必须出现的内容缺失），为空时不需要请求大模型
+        """
+        if not checks or not self.rule_engine.verify(checks, draft):
+            return draft, []
+        draft = self.rule_engine.apply(checks, draft)
+        violations = self.rule_engine.verify(checks, draft)
+        if violations:
+            self.rule_engine.record_repair()
+        return draft, violations
+    
+    def _rule_repair_messages(self, draft: str, violations: List[RuleViolation]) -> List[Dict[str, str]]:
+        """请求大模型只修改违反规则之处（补丁形式）"""
+        return build_rule_repair_messages(draft, [violation.to_dict() for violation in violations])
+    
+    def _repaired(self, draft: str, repaired: Optional[str], checks: List[MechanicalRule],
+                  violations: List[RuleViolation]) -> str:
+        """大模型修正后的结果再按规则在本地整理一遍；修正失败时保留原结果"""
+        if repaired is None:
+            print(f"修正违反规则之处失败，保留原结果: {'；'.join(v.message for v in violations)}")
+            return draft
+        return self.rule_engine.apply(checks, repaired)
+    
+    def _finish_response(self, step: str, response, cache_key: Optional[str], started: float) -> str:
+        """取出完整响应的文本，记录耗时和token用量并写入缓存"""
+        content = response.choices[0].message.content.strip()
+        self.metrics.record(step, wall_time=time.monotonic() - started,
+                            **usage_tokens(getattr(response, "usage", None)))
+        if cache_key:
+            self.cache.set(cache_key, content)
+        return content
@@ -2,220 +2,781 @@
 AI Agent模块 - 处理与火山方舟大模型的交互和文案生成
 """
 import os
-import re
-from typing import List, Dict, Any
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except ImportError:
     pass
 
-try:
-    from volcenginesdkarkruntime import Ark
-except ImportError:
-    print("请安装火山方舟SDK: pip install -U 'volcengine-python-sdk[ark]'")
-    raise
+from prompts import (
+    build_style_card_messages,
+    build_preferences_messages,
+    build_restrictions_messages,
+    build_preferences_chunk_messages,
+    build_restrictions_chunk_messages,
+    build_consistency_messages,
+    build_instruction_messages,
+    build_patch_instruction_messages,
+    build_patch_restrictions_messages,
+    build_edit_session_turn,
+    EDIT_SESSION_SYSTEM_PROMPT,
+    build_learn_preferences_messages,
+    build_learn_rules_messages,
+    parse_numbered_list,
+)
+from agent_base import BaseAgent, STEP_LABELS
+from llm_backend import LLMBackend
+from response_cache import ResponseCache
+from metrics import MetricsRegistry, usage_tokens
+from reference_budget import ReferenceBudget, estimate_text_tokens
+from style_cards import StyleCardStore
+from patches import PatchMode
+from chunking import ChunkingPolicy, stitch_chunks
+from rule_engine import RuleEngine, MechanicalRule
+from model_routing import ModelRouter, StepRoute
+from single_flight import SingleFlight, FlightAbortedError
+from hedging import HedgingPolicy, HedgeLeg, HedgeAbortedError, StreamedCompletion
+from rate_limit import RateLimitTimeoutError, estimate_tokens
+from resilience import (
+    Deadline,
+    RetryPolicy,
+    DeadlineExceededError,
+    LLMCallError,
+    call_with_resilience,
+    is_retryable,
+    is_timeout,
+)
 
-class AIAgent:
-    """AI Agent，负责与火山方舟大模型API交互"""
+class AIAgent(BaseAgent):
+    """AI Agent，负责与大模型API交互（默认火山方舟）；缓存和结果处理见BaseAgent，这里只负责以线程发出请求"""
     
-    def __init__(self):
-        self.client = Ark(
-            api_key=os.getenv("VOLCANO_API_KEY"),
-            timeout=1800,  # 30分钟超时
-        )
-        self.model = "doubao-seed-1.6-250615"  # 您提供的模型ID
+    def __init__(self, cache: Optional[ResponseCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 step_timeout: Optional[float] = None, hedging: Optional[HedgingPolicy] = None,
+                 backend: Optional[LLMBackend] = None, metrics: Optional[MetricsRegistry] = None,
+                 reference_budget: Optional[ReferenceBudget] = None,
+                 style_cards: Optional[StyleCardStore] = None, patch_mode: Optional[PatchMode] = None,
+                 chunking: Optional[ChunkingPolicy] = None, rule_engine: Optional[RuleEngine] = None,
+                 router: Optional[ModelRouter] = None, single_flight: Optional[SingleFlight] = None):
+        super().__init__(cache=cache, retry_policy=retry_policy, step_timeout=step_timeout, backend=backend,
+                         metrics=metrics, reference_budget=reference_budget, style_cards=style_cards,
+                         patch_mode=patch_mode, chunking=chunking, rule_engine=rule_engine, router=router,
+                         single_flight=single_flight)
+        
+        # auto模式下后台提炼风格卡片的状态
+        self._distilling = set()
+        self._distill_lock = threading.Lock()
+        self._distill_executor = None
+        
+        # 对冲请求（可选）：AI_HEDGING=1按历史p90延迟对冲，AI_HEDGE_DELAY指定固定等待秒数
+        if hedging is None and (os.getenv("AI_HEDGING") == "1" or os.getenv("AI_HEDGE_DELAY")):
+            hedge_delay = os.getenv("AI_HEDGE_DELAY")
+            hedging = HedgingPolicy(delay=float(hedge_delay) if hedge_delay else None)
+        self.hedging = hedging
     
-    def generate_style_draft(self, user_input_text: str, reference_texts: List[str]) -> str:
+    def _flight_key(self, messages: List[Dict[str, str]], route: StepRoute, use_cache: bool,
+                    context_id: Optional[str] = None) -> Optional[str]:
         """
-        Step 1: 根据参考文案生成风格化初稿
+        合并相同请求的键；不参与合并时返回None：
+        服务端上下文中的请求依赖会话状态，use_cache=False表示调用方要求重新生成，不共享其他请求的结果
         """
-        reference_texts_str = "\n\n".join(reference_texts)
+        if context_id or not use_cache or not self.single_flight.enabled:
+            return None
+        return self._request_key(messages, route)
+    
+    def _wait_coalesced(self, step: str, future, deadline: Optional[Deadline], started: float,
+                        streaming: bool = False) -> str:
+        """等待相同的进行中请求的结果，共享它的输出或异常；不超过本次调用的截止时间"""
+        step_label = STEP_LABELS[step]
+        try:
+            try:
+                content = self.single_flight.wait(future, deadline.remaining() if deadline is not None else None)
+            except TimeoutError as e:
+                raise DeadlineExceededError(step_label, "等待相同请求的结果超时", e) from e
+            except FlightAbortedError as e:
+                raise LLMCallError(step_label, str(e), e) from e
+        except LLMCallError:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise
+        elapsed = time.monotonic() - started
+        self.metrics.record(step, wall_time=elapsed, ttft=elapsed if streaming else None, coalesced=True)
+        return content
+    
+    def _auto_distill(self, reference_texts: List[str]):
+        """auto模式下在后台为这组参考文案提炼风格卡片，供之后的会话使用"""
+        if self.style_cards is None or self.style_card_mode != "auto":
+            return
+        reference_hash = StyleCardStore.reference_hash(reference_texts)
+        with self._distill_lock:
+            if reference_hash in self._distilling:
+                return
+            self._distilling.add(reference_hash)
+            if self._distill_executor is None:
+                self._distill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="style-card")
         
-        prompt = f"""请结合示例的整体节奏、语气，优化所给文案。
-
-文案：{user_input_text}
-
-示例：{reference_texts_str}
-
-请生成一篇风格化的初稿，保持示例的写作风格和语调。"""
+        def distill():
+            try:
+                self.distill_style_card(reference_texts)
+            except LLMCallError as e:
+                print(f"后台提炼风格卡片失败: {e}")
+            finally:
+                with self._distill_lock:
+                    self._distilling.discard(reference_hash)
         
+        self._distill_executor.submit(distill)
+    
+    def _create(self, step: str, messages: List[Dict[str, str]], deadline: Deadline,
+                context_id: Optional[str] = None, model: Optional[str] = None,
+                max_tokens: Optional[int] = None, **kwargs):
+        """
+        取得限流配额后发出请求；非流式请求结束后按实际token用量交还配额
+        指定context_id时在服务端会话上下文中发出，messages只包含本轮新增的消息
+        """
+        _, limiter = self._endpoint(model)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的文案优化助手，擅长学习和模仿不同的写作风格。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}  # 不使用深度思考能力
-            )
-            return response.choices[0].message.content.strip()
+            permit = limiter.acquire(estimate_tokens(messages), deadline)
+        except RateLimitTimeoutError as e:
+            raise DeadlineExceededError(STEP_LABELS[step], str(e), e) from e
+        
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        try:
+            if context_id:
+                response = self.backend.context_chat(context_id, messages, deadline.remaining(), **kwargs)
+            else:
+                response = self.backend.chat(messages, deadline.remaining(), model=model, **kwargs)
         except Exception as e:
-            print(f"生成风格化初稿时出错: {e}")
-            return user_input_text
+            limiter.release(permit, error=e)
+            raise
+        
+        if kwargs.get("stream"):
+            # 流式请求的配额在读完流之后交还
+            return response, permit
+        usage = getattr(response, "usage", None)
+        limiter.release(permit, total_tokens=getattr(usage, "total_tokens", None))
+        return response
     
-    def apply_preferences(self, draft: str, selected_preferences: List[Dict[str, Any]]) -> str:
+    def _try_patch(self, step: str, messages: List[Dict[str, str]], draft: str, use_cache: bool,
+                   deadline: Optional[Deadline]) -> Optional[str]:
+        """补丁模式：请求替换列表并在本地应用；格式不对或原片段匹配不上时返回None，由调用方整篇重写"""
+        return self._patched(draft, self._chat(step, messages, use_cache, deadline))
+    
+    def _enforce_rules(self, draft: str, checks: List[MechanicalRule], use_cache: bool,
+                       deadline: Optional[Deadline]) -> str:
+        """生成后检查可检查的规则，本地修正后仍有违反才请求大模型只修改有问题的地方"""
+        draft, violations = self._check_rules(draft, checks)
+        if not violations:
+            return draft
+        repaired = self._try_patch("rule_repair", self._rule_repair_messages(draft, violations), draft,
+                                   use_cache, deadline)
+        return self._repaired(draft, repaired, checks, violations)
+    
+    def _chunked(self, step: str, build_messages, draft: str, items: List[Dict[str, Any]], use_cache: bool,
+                 deadline: Optional[Deadline]) -> Iterator[str]:
+        """分段并发处理，按原顺序逐块产出修改结果（含原来的段落分隔）"""
+        requests = self._chunk_requests(build_messages, draft, items)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.chunking.workers, len(requests))),
+                                      thread_name_prefix="chunk")
+        try:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._chat, step, messages, use_cache, deadline)
+                for _, messages in requests
+            ]
+            for (chunk, _), future in zip(requests, futures):
+                yield stitch_chunks([chunk], [future.result()])
+        finally:
+            # 调用方中途放弃（如流式请求断开）时取消尚未开始的块
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _apply_chunked(self, step: str, build_messages, draft: str, items: List[Dict[str, Any]], use_cache: bool,
+                       deadline: Optional[Deadline]) -> str:
+        """分段处理并拼接；开启衔接检查时再以补丁形式修正各块之间的衔接"""
+        result = "".join(self._chunked(step, build_messages, draft, items, use_cache, deadline)).strip()
+        if self.chunking.consistency:
+            fixed = self._try_patch("consistency", build_consistency_messages(result), result, use_cache, deadline)
+            if fixed is not None:
+                result = fixed
+        return result
+    
+    def _create_hedged(self, step: str, messages: List[Dict[str, str]], deadline: Deadline,
+                       model: Optional[str], max_tokens: Optional[int], leg: HedgeLeg) -> StreamedCompletion:
         """
-        Step 2: 应用用户选择的写作偏好
+        对冲中的一路请求：以流式发出并拼成完整响应，落败时leg.abort()关闭响应流，
+        服务端停止生成，不再为落败的一路继续消耗token
         """
-        if not selected_preferences:
-            return draft
+        stream, permit = self._create(step, messages, deadline, None, model, max_tokens,
+                                      stream=True, stream_options={"include_usage": True})
+        leg.attach(getattr(stream, "close", lambda: None))
+        parts = []
+        usage = None
+        error = None
+        try:
+            try:
+                for chunk in stream:
+                    if leg.aborted:
+                        break
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+            except Exception as e:
+                # 被中断时关闭流引起的读取错误也视为中断
+                if not leg.aborted:
+                    error = e
+                    raise
+            if leg.aborted:
+                error = HedgeAbortedError()
+                raise error
+        finally:
+            self._endpoint(model)[1].release(permit, total_tokens=getattr(usage, "total_tokens", None),
+                                             error=error)
+        return StreamedCompletion("".join(parts), usage)
+    
+    def _call(self, step: str, messages: List[Dict[str, str]], deadline: Optional[Deadline],
+              context_id: Optional[str], route: StepRoute, model: Optional[str]):
+        """用指定模型发出一次完整请求（含重试、熔断和对冲）"""
+        step_deadline = self._step_deadline(deadline, route.timeout)
+        breaker, _ = self._endpoint(model)
         
-        preferences_text = "\n".join([f"- {pref['description']}" for pref in selected_preferences])
+        def call(timeout: float):
+            # 服务端上下文中重复发出的请求会重复写入会话历史，不做对冲
+            if self.hedging is not None and self.hedging.applies_to(step) and not context_id:
+                return self.hedging.run(step, lambda leg: self._create_hedged(
+                    step, messages, step_deadline, model, route.max_tokens, leg))
+            return self._create(step, messages, step_deadline, context_id, model, route.max_tokens)
         
-        prompt = f"""根据文本修改要求，帮我修改所给文案。
-
-文案：{draft}
-
-文本修改要求：
-{preferences_text}
-
-请根据这些要求修改文案，保持内容的完整性。"""
+        return call_with_resilience(STEP_LABELS[step], call, step_deadline, self.retry_policy, breaker)
+    
+    def _chat(self, step: str, messages: List[Dict[str, str]], use_cache: bool = True,
+              deadline: Optional[Deadline] = None, context_id: Optional[str] = None) -> str:
+        """
+        发送一次完整的对话请求，返回模型输出文本，失败时抛出LLMCallError
+        使用路由表中本步骤的模型；超时且配置了备用模型时改用备用模型再试一次（备用模型的结果不写入缓存）
+        """
+        started = time.monotonic()
+        route = self._route(step, context_id)
+        cache_key = self._cache_key(messages, use_cache, route)
+        cached = self._cached(step, cache_key, started)
+        if cached is not None:
+            return cached
         
+        # 相同的请求正在进行时等待它的结果，不再调用模型
+        flight_key = self._flight_key(messages, route, use_cache, context_id)
+        if flight_key is None:
+            return self._fetch(step, messages, deadline, context_id, route, cache_key, started)
+        leader, future = self.single_flight.join(flight_key)
+        if not leader:
+            return self._wait_coalesced(step, future, deadline, started)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的写作偏好调整文案风格。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}
-            )
-            return response.choices[0].message.content.strip()
+            content = self._fetch(step, messages, deadline, context_id, route, cache_key, started)
+        except BaseException as e:
+            self.single_flight.finish(flight_key, future, error=e)
+            raise
+        self.single_flight.finish(flight_key, future, content)
+        return content
+    
+    def _fetch(self, step: str, messages: List[Dict[str, str]], deadline: Optional[Deadline],
+               context_id: Optional[str], route: StepRoute, cache_key: Optional[str], started: float) -> str:
+        """真正调用模型：超时且配置了备用模型时改用备用模型再试一次，记录指标并写入缓存"""
+        try:
+            try:
+                response = self._call(step, messages, deadline, context_id, route, route.model)
+            except LLMCallError as e:
+                fallback_model = self._fallback_model(step, route, deadline) if is_timeout(e) else None
+                if fallback_model is None:
+                    raise
+                cache_key = None
+                response = self._call(step, messages, deadline, context_id, route, fallback_model)
+        except LLMCallError:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise
+        return self._finish_response(step, response, cache_key, started)
+    
+    def _chat_stream(self, step: str, messages: List[Dict[str, str]], use_cache: bool = True,
+                     deadline: Optional[Deadline] = None, context_id: Optional[str] = None) -> Iterator[str]:
+        """
+        以流式模式发送对话请求，逐段产出模型输出的增量文本
+        只在建立连接阶段重试；开始输出后出错或超过截止时间则抛出LLMCallError
+        """
+        started = time.monotonic()
+        route = self._route(step, context_id)
+        cache_key = self._cache_key(messages, use_cache, route)
+        cached = self._cached(step, cache_key, started, streaming=True)
+        if cached is not None:
+            yield cached
+            return
+        
+        # 相同的请求正在进行时等待它的完整结果一次性产出；leader边产出边收集，结束后交给follower
+        flight_key = self._flight_key(messages, route, use_cache, context_id)
+        if flight_key is None:
+            yield from self._stream(step, messages, deadline, context_id, route, cache_key, started)
+            return
+        leader, future = self.single_flight.join(flight_key)
+        if not leader:
+            yield self._wait_coalesced(step, future, deadline, started, streaming=True)
+            return
+        parts = []
+        try:
+            for delta in self._stream(step, messages, deadline, context_id, route, cache_key, started):
+                parts.append(delta)
+                yield delta
+        except BaseException as e:
+            # 调用方提前关闭生成器（GeneratorExit）时follower拿不到完整结果
+            error = e if isinstance(e, Exception) else FlightAbortedError("相同的请求已中断")
+            self.single_flight.finish(flight_key, future, error=error)
+            raise
+        self.single_flight.finish(flight_key, future, "".join(parts).strip())
+    
+    def _stream(self, step: str, messages: List[Dict[str, str]], deadline: Optional[Deadline],
+                context_id: Optional[str], route: StepRoute, cache_key: Optional[str],
+                started: float) -> Iterator[str]:
+        """真正发起流式请求：只在建立连接阶段重试和改用备用模型，完整读完的流写入缓存"""
+        step_label = STEP_LABELS[step]
+        
+        def connect(model: Optional[str]):
+            step_deadline = self._step_deadline(deadline, route.timeout)
+            breaker, _ = self._endpoint(model)
+            
+            def call(timeout: float):
+                return self._create(step, messages, step_deadline, context_id, model, route.max_tokens,
+                                    stream=True, stream_options={"include_usage": True})
+            
+            stream, permit = call_with_resilience(step_label, call, step_deadline, self.retry_policy, breaker)
+            return stream, permit, step_deadline, model
+        
+        # 建立连接阶段超时可以改用备用模型；开始输出后不再切换
+        try:
+            try:
+                stream, permit, step_deadline, model = connect(route.model)
+            except LLMCallError as e:
+                fallback_model = self._fallback_model(step, route, deadline) if is_timeout(e) else None
+                if fallback_model is None:
+                    raise
+                cache_key = None
+                stream, permit, step_deadline, model = connect(fallback_model)
+        except LLMCallError:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise
+        parts = []
+        usage = None
+        ttft = None
+        stream_error = None
+        try:
+            for chunk in stream:
+                if step_deadline.expired():
+                    raise DeadlineExceededError(step_label, "超过截止时间")
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    parts.append(delta)
+                    yield delta
+        except LLMCallError as e:
+            stream_error = e.cause or e
+            raise
         except Exception as e:
-            print(f"应用偏好时出错: {e}")
+            stream_error = e
+            raise LLMCallError(step_label, str(e), e) from e
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            self._endpoint(model)[1].release(permit, total_tokens=getattr(usage, "total_tokens", None),
+                                             error=stream_error)
+            self.metrics.record(step, wall_time=time.monotonic() - started, ttft=ttft,
+                                error=stream_error is not None, **usage_tokens(usage))
+        
+        # 只有完整读完的流才写入缓存
+        if cache_key:
+            self.cache.set(cache_key, "".join(parts).strip())
+    
+    def generate_style_draft(self, user_input_text: str, reference_texts: List[str], use_cache: bool = True,
+                             deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 1: 根据参考文案生成风格化初稿
+        """
+        messages = self._style_draft_messages(user_input_text, reference_texts)
+        return self._chat("style_draft", messages, use_cache, deadline)
+    
+    def apply_preferences(self, draft: str, selected_preferences: List[Dict[str, Any]], use_cache: bool = True,
+                          deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 2: 应用用户选择的写作偏好
+        """
+        if not selected_preferences:
             return draft
+        
+        if self.chunking.applies_to(draft):
+            return self._apply_chunked("preferences_chunk", build_preferences_chunk_messages, draft,
+                                       selected_preferences, use_cache, deadline)
+        
+        messages = build_preferences_messages(draft, selected_preferences)
+        return self._chat("preferences", messages, use_cache, deadline)
     
-    def apply_restrictions(self, draft: str, selected_rules: List[Dict[str, Any]]) -> str:
+    def apply_restrictions(self, draft: str, selected_rules: List[Dict[str, Any]], use_cache: bool = True,
+                           deadline: Optional[Deadline] = None) -> str:
         """
         Step 3: 应用用户选择的限制规则
         """
         if not selected_rules:
             return draft
         
-        rules_text = "\n".join([f"- {rule['instruction']}" for rule in selected_rules])
+        # 可以机械执行的规则直接在本地应用，文案已经符合的规则不再交给大模型
+        draft, model_rules, checks = self.rule_engine.prepare(draft, selected_rules)
+        if model_rules:
+            draft = self._restrict_with_model(draft, model_rules, use_cache, deadline)
+        return self._enforce_rules(draft, checks, use_cache, deadline)
+    
+    def _restrict_with_model(self, draft: str, selected_rules: List[Dict[str, Any]], use_cache: bool,
+                             deadline: Optional[Deadline]) -> str:
+        if self.patch_mode.applies_to(draft):
+            patched = self._try_patch("restrictions_patch", build_patch_restrictions_messages(draft, selected_rules),
+                                      draft, use_cache, deadline)
+            if patched is not None:
+                return patched
         
-        prompt = f"""根据要求，帮我修改所给文案。
-
-文案：{draft}
-
-要求：
-{rules_text}
-
-请严格按照这些要求修改文案。"""
+        if self.chunking.applies_to(draft):
+            return self._apply_chunked("restrictions_chunk", build_restrictions_chunk_messages, draft,
+                                       selected_rules, use_cache, deadline)
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的文案修改助手，能够严格按照用户的要求调整文案。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"应用限制规则时出错: {e}")
-            return draft
+        messages = build_restrictions_messages(draft, selected_rules)
+        return self._chat("restrictions", messages, use_cache, deadline)
     
-    def modify_with_instruction(self, draft: str, instruction: str) -> str:
+    def modify_with_instruction(self, draft: str, instruction: str, use_cache: bool = True,
+                                deadline: Optional[Deadline] = None) -> str:
         """
         Step 4: 根据用户指令修改文案
         """
-        prompt = f"""请根据以下指令修改文案：
-
-文案：{draft}
-
-指令：{instruction}
-
-请根据指令修改文案。"""
+        if self.patch_mode.applies_to(draft):
+            patched = self._try_patch("instruction_patch", build_patch_instruction_messages(draft, instruction),
+                                      draft, use_cache, deadline)
+            if patched is not None:
+                return patched
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的详细指令调整文案。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"根据指令修改文案时出错: {e}")
-            return draft
+        messages = build_instruction_messages(draft, instruction)
+        return self._chat("instruction_edit", messages, use_cache, deadline)
+    
+    def generate_final_draft(self, user_input_text: str, reference_texts: List[str],
+                             selected_preferences: List[Dict[str, Any]],
+                             selected_rules: List[Dict[str, Any]], use_cache: bool = True,
+                             deadline: Optional[Deadline] = None) -> str:
+        """
+        融合模式: 一次请求完成风格化、应用偏好和应用限制规则，直接生成AI终稿
+        """
+        messages = self._one_shot_messages(user_input_text, reference_texts, selected_preferences, selected_rules)
+        draft = self._chat("one_shot", messages, use_cache, deadline)
+        return self._enforce_rules(draft, self.rule_engine.checks(selected_rules), use_cache, deadline)
+    
+    def stream_style_draft(self, user_input_text: str, reference_texts: List[str],
+                           use_cache: bool = True, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Step 1（流式）: 逐段产出风格化初稿，拼接所有片段即为完整初稿
+        """
+        messages = self._style_draft_messages(user_input_text, reference_texts)
+        yield from self._chat_stream("style_draft", messages, use_cache, deadline)
+    
+    def stream_preferences(self, draft: str, selected_preferences: List[Dict[str, Any]],
+                           use_cache: bool = True, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Step 2（流式）: 逐段产出应用偏好后的文案
+        """
+        if not selected_preferences:
+            yield draft
+            return
+        
+        # 分段处理时按顺序逐块产出；开启衔接检查时需要等全部完成后一次性产出
+        if self.chunking.applies_to(draft):
+            if self.chunking.consistency:
+                yield self._apply_chunked("preferences_chunk", build_preferences_chunk_messages, draft,
+                                          selected_preferences, use_cache, deadline)
+            else:
+                yield from self._chunked("preferences_chunk", build_preferences_chunk_messages, draft,
+                                         selected_preferences, use_cache, deadline)
+            return
+        
+        messages = build_preferences_messages(draft, selected_preferences)
+        yield from self._chat_stream("preferences", messages, use_cache, deadline)
+    
+    def stream_restrictions(self, draft: str, selected_rules: List[Dict[str, Any]],
+                            use_cache: bool = True, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Step 3（流式）: 逐段产出应用限制规则后的文案
+        """
+        if not selected_rules:
+            yield draft
+            return
+        
+        # 有可检查的规则时结果可能还要修正，等全部完成后一次性产出
+        draft, selected_rules, checks = self.rule_engine.prepare(draft, selected_rules)
+        if checks or not selected_rules:
+            if selected_rules:
+                draft = self._restrict_with_model(draft, selected_rules, use_cache, deadline)
+            yield self._enforce_rules(draft, checks, use_cache, deadline)
+            return
+        
+        # 补丁模式下替换列表无法边生成边展示，应用后一次性产出
+        if self.patch_mode.applies_to(draft):
+            patched = self._try_patch("restrictions_patch", build_patch_restrictions_messages(draft, selected_rules),
+                                      draft, use_cache, deadline)
+            if patched is not None:
+                yield patched
+                return
+        
+        if self.chunking.applies_to(draft):
+            if self.chunking.consistency:
+                yield self._apply_chunked("restrictions_chunk", build_restrictions_chunk_messages, draft,
+                                          selected_rules, use_cache, deadline)
+            else:
+                yield from self._chunked("restrictions_chunk", build_restrictions_chunk_messages, draft,
+                                         selected_rules, use_cache, deadline)
+            return
+        
+        messages = build_restrictions_messages(draft, selected_rules)
+        yield from self._chat_stream("restrictions", messages, use_cache, deadline)
+    
+    def stream_instruction_edit(self, draft: str, instruction: str, use_cache: bool = True,
+                                deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Step 4（流式）: 逐段产出根据指令修改后的文案
+        """
+        if self.patch_mode.applies_to(draft):
+            patched = self._try_patch("instruction_patch", build_patch_instruction_messages(draft, instruction),
+                                      draft, use_cache, deadline)
+            if patched is not None:
+                yield patched
+                return
+        
+        messages = build_instruction_messages(draft, instruction)
+        yield from self._chat_stream("instruction_edit", messages, use_cache, deadline)
     
-    def learn_preferences(self, original_draft: str, user_modified_draft: str) -> List[str]:
+    def warm_up(self, connections: Optional[int] = None, background: bool = True):
+        """
+        预先建立到模型服务的连接，避免启动后第一个请求承担连接建立的耗时
+        connections未指定时读取环境变量AI_HTTP_WARMUP（默认0，不预热）；background为True时在后台线程中进行，不阻塞启动
+        """
+        if connections is None:
+            connections = int(os.getenv("AI_HTTP_WARMUP", "0"))
+        if connections <= 0:
+            return
+        if background:
+            threading.Thread(target=self.backend.warm_up, args=(connections,), name="http-warm-up", daemon=True).start()
+        else:
+            self.backend.warm_up(connections)
+    
+    def start_edit_session(self) -> "EditSession":
+        """开始一个多轮修改会话，之后每轮只发送新的指令，见EditSession"""
+        return EditSession.from_env(self)
+    
+    def stream_final_draft(self, user_input_text: str, reference_texts: List[str],
+                           selected_preferences: List[Dict[str, Any]],
+                           selected_rules: List[Dict[str, Any]], use_cache: bool = True,
+                           deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        融合模式（流式）: 逐段产出一步生成的AI终稿
+        """
+        messages = self._one_shot_messages(user_input_text, reference_texts, selected_preferences, selected_rules)
+        yield from self._chat_stream("one_shot", messages, use_cache, deadline)
+    
+    def distill_style_card(self, reference_texts: List[str], name: Optional[str] = None, use_cache: bool = True,
+                           deadline: Optional[Deadline] = None) -> str:
+        """
+        将一组参考文案提炼为风格卡片并保存，之后使用同一组参考文案时不再发送完整原文
+        """
+        messages = build_style_card_messages(self.fit_references(reference_texts).texts)
+        card = self._chat("style_card", messages, use_cache, deadline)
+        if self.style_cards is not None:
+            self.style_cards.save(reference_texts, card, name)
+        return card
+    
+    def learn_preferences(self, original_draft: str, user_modified_draft: str, use_cache: bool = True,
+                          deadline: Optional[Deadline] = None) -> List[str]:
         """
         Step 5: 学习用户的写作偏好
         """
-        prompt = f"""分析"原文本"和"作者改动后的文本"的差异。
-
-请总结出1-3条作者的写作风格偏好。你的输出必须是清晰的序号分点列表（如：1. ... 2. ...）。每一条都应是独立、可执行的描述。
-
-原文本：{original_draft}
-
-作者改动后的文本：{user_modified_draft}"""
+        messages = build_learn_preferences_messages(original_draft, user_modified_draft)
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的写作风格分析师，能够从文本修改中识别出作者的写作偏好。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}
-            )
-            
-            # 解析输出，提取偏好描述
-            content = response.choices[0].message.content.strip()
-            preferences = self._extract_preferences(content)
-            return preferences
-        except Exception as e:
-            print(f"学习偏好时出错: {e}")
-            return []
+        # 解析输出，提取偏好描述
+        content = self._chat("learn_preferences", messages, use_cache, deadline)
+        return self._extract_preferences(content)
     
-    def learn_rules(self, user_instructions: List[str]) -> List[str]:
+    def learn_rules(self, user_instructions: List[str], use_cache: bool = True,
+                    deadline: Optional[Deadline] = None) -> List[str]:
         """
         Step 5: 学习用户的通用规则
         """
         if not user_instructions:
             return []
         
-        instructions_text = "\n".join([f"- {instruction}" for instruction in user_instructions])
-        
-        prompt = f"""以下是用户对文案的修改意见。判断其中哪些是通用规则，而非对内容细节的意见。总结并分点输出其中通用规则，要求语言精简。
-
-用户意见：
-{instructions_text}"""
+        messages = build_learn_rules_messages(user_instructions)
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的规则提取器，能够从用户的修改意见中识别出通用的写作规则。"},
-                    {"role": "user", "content": prompt}
-                ],
-                thinking={"type": "disabled"}
-            )
-            
-            # 解析输出，提取规则描述
-            content = response.choices[0].message.content.strip()
-            rules = self._extract_rules(content)
-            return rules
-        except Exception as e:
-            print(f"学习规则时出错: {e}")
-            return []
+        # 解析输出，提取规则描述
+        content = self._chat("learn_rules", messages, use_cache, deadline)
+        return self._extract_rules(content)
     
     def _extract_preferences(self, content: str) -> List[str]:
         """从AI输出中提取偏好描述"""
-        # 使用正则表达式提取序号列表
-        pattern = r'\d+\.\s*(.+?)(?=\n\d+\.|\n\n|$)'
-        matches = re.findall(pattern, content, re.DOTALL)
-        return [match.strip() for match in matches if match.strip()]
+        return parse_numbered_list(content)
     
     def _extract_rules(self, content: str) -> List[str]:
         """从AI输出中提取规则描述"""
-        # 使用正则表达式提取序号列表
-        pattern = r'\d+\.\s*(.+?)(?=\n\d+\.|\n\n|$)'
-        matches = re.findall(pattern, content, re.DOTALL)
-        return [match.strip() for match in matches if match.strip()]
+        return parse_numbered_list(content)
+
+
+class EditSession:
+    """
+    多轮修改会话：第一轮发送完整文案和指令，之后每轮只发送新的指令，用户在两轮之间手动改过文案时附上新文案
+    后端支持服务端上下文缓存（火山方舟）时会话历史保存在服务端，每轮请求只包含新增的消息；
+    否则在本地保存消息历史，超过max_history_tokens时从最早的轮次开始丢弃（最近一轮始终保留，其中已包含当前文案）
+    """
+    
+    def __init__(self, ai_agent: AIAgent, max_history_tokens: int = 4000, use_context: Optional[bool] = None,
+                 ttl: int = 3600):
+        self.ai_agent = ai_agent
+        self.max_history_tokens = max_history_tokens
+        self.use_context = ai_agent.backend.supports_context if use_context is None else use_context
+        self.ttl = ttl
+        self.context_id = None
+        self.messages = [{"role": "system", "content": EDIT_SESSION_SYSTEM_PROMPT}]
+        self.current_draft = None
+        self.turns = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_env(cls, ai_agent: AIAgent) -> "EditSession":
+        """
+        读取环境变量：AI_EDIT_HISTORY_TOKENS为本地保存的会话历史上限（默认4000），
+        AI_EDIT_CONTEXT_CACHE=off时不使用服务端上下文缓存
+        """
+        return cls(
+            ai_agent,
+            max_history_tokens=int(os.getenv("AI_EDIT_HISTORY_TOKENS", "4000")),
+            use_context=False if os.getenv("AI_EDIT_CONTEXT_CACHE") == "off" else None,
+        )
+    
+    def _turn(self, draft: str, instruction: str) -> Dict[str, str]:
+        """文案与上一轮输出一致时只发送指令"""
+        if self.current_draft is not None and draft.strip() == self.current_draft.strip():
+            return build_edit_session_turn(instruction)
+        return build_edit_session_turn(instruction, draft)
+    
+    def _ensure_context(self, deadline: Optional[Deadline]):
+        """第一次使用时创建服务端上下文；创建失败则改为在本地保存会话历史"""
+        if not self.use_context or self.context_id is not None:
+            return
+        try:
+            self.context_id = self.ai_agent.backend.create_context(
+                self.messages[:1], self.ttl, self.ai_agent._step_deadline(deadline).remaining()
+            )
+        except Exception as e:
+            print(f"创建服务端上下文失败，改为在本地保存会话历史: {e}")
+            self.use_context = False
+    
+    def _fallback_to_local(self, error: LLMCallError) -> bool:
+        """服务端上下文不可用（如已过期）时改为本地会话历史；限流、超时等可重试的错误照常抛出"""
+        if self.context_id is None or (error.cause is not None and is_retryable(error.cause)):
+            return False
+        print(f"服务端上下文不可用，改为在本地保存会话历史: {error}")
+        self.use_context = False
+        self.context_id = None
+        return True
+    
+    def _local_messages(self, draft: str, instruction: str) -> List[Dict[str, str]]:
+        # 本地历史为空（如刚从服务端上下文切换过来）时必须附上完整文案
+        if len(self.messages) == 1:
+            return self.messages + [build_edit_session_turn(instruction, draft)]
+        return self.messages + [self._turn(draft, instruction)]
+    
+    def _history_tokens(self) -> int:
+        return sum(estimate_text_tokens(message["content"]) for message in self.messages)
+    
+    def _finish_turn(self, messages: Optional[List[Dict[str, str]]], result: str) -> str:
+        if messages is not None:
+            self.messages = messages + [{"role": "assistant", "content": result}]
+            # 丢弃最早的一轮（用户消息和回复），直到不超过预算；最近一轮始终保留
+            while len(self.messages) > 3 and self._history_tokens() > self.max_history_tokens:
+                del self.messages[1:3]
+        self.current_draft = result
+        self.turns += 1
+        return result
+    
+    def _try_patch(self, draft: str, instruction: str, deadline: Optional[Deadline]) -> Optional[str]:
+        """
+        补丁模式开启时先单独请求替换列表；成功后把这一轮以完整文案的形式记入本地历史，
+        服务端上下文没有这一轮，下一轮的文案与上一轮输出不同，会自动附上完整文案
+        """
+        if not self.ai_agent.patch_mode.applies_to(draft):
+            return None
+        patched = self.ai_agent._try_patch("instruction_patch", build_patch_instruction_messages(draft, instruction),
+                                           draft, True, deadline)
+        if patched is None:
+            return None
+        if self.context_id is None:
+            return self._finish_turn(self.messages + [build_edit_session_turn(instruction, draft)], patched)
+        self.turns += 1
+        return patched
+    
+    def edit(self, draft: str, instruction: str, deadline: Optional[Deadline] = None) -> str:
+        """根据指令修改文案，返回修改后的完整文案"""
+        with self._lock:
+            patched = self._try_patch(draft, instruction, deadline)
+            if patched is not None:
+                return patched
+            self._ensure_context(deadline)
+            if self.context_id is not None:
+                try:
+                    # 服务端上下文中的消息只发送一次，不使用响应缓存
+                    result = self.ai_agent._chat("instruction_edit", [self._turn(draft, instruction)],
+                                                 use_cache=False, deadline=deadline, context_id=self.context_id)
+                    return self._finish_turn(None, result)
+                except LLMCallError as e:
+                    if not self._fallback_to_local(e):
+                        raise
+            
+            messages = self._local_messages(draft, instruction)
+            result = self.ai_agent._chat("instruction_edit", messages, deadline=deadline)
+            return self._finish_turn(messages, result)
+    
+    def stream_edit(self, draft: str, instruction: str, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """流式版本的edit，拼接所有片段即为修改后的完整文案"""
+        with self._lock:
+            patched = self._try_patch(draft, instruction, deadline)
+            if patched is not None:
+                yield patched
+                return
+            self._ensure_context(deadline)
+            if self.context_id is not None:
+                parts = []
+                try:
+                    for delta in self.ai_agent._chat_stream("instruction_edit", [self._turn(draft, instruction)],
+                                                            use_cache=False, deadline=deadline,
+                                                            context_id=self.context_id):
+                        parts.append(delta)
+                        yield delta
+                    self._finish_turn(None, "".join(parts).strip())
+                    return
+                except LLMCallError as e:
+                    # 已经输出过内容就无法改用本地历史重来
+                    if parts or not self._fallback_to_local(e):
+                        raise
+            
+            messages = self._local_messages(draft, instruction)
+            parts = []
+            for delta in self.ai_agent._chat_stream("instruction_edit", messages, deadline=deadline):
+                parts.append(delta)
+                yield delta
+            self._finish_turn(messages, "".join(parts).strip())
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "context" if self.context_id is not None else "local",
+            "turns": self.turns,
+            "history_tokens": self._history_tokens() if self.context_id is None else None,
+        }
@@ -0,0 +1,278 @@
+"""
+异步AI Agent模块 - 基于火山方舟异步客户端的AIAgent协程版本
+"""
+import time
+import asyncio
+from typing import List, Dict, Any, Optional
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+from prompts import (
+    build_style_card_messages,
+    build_preferences_messages,
+    build_restrictions_messages,
+    build_preferences_chunk_messages,
+    build_restrictions_chunk_messages,
+    build_consistency_messages,
+    build_instruction_messages,
+    build_patch_instruction_messages,
+    build_patch_restrictions_messages,
+    build_learn_preferences_messages,
+    build_learn_rules_messages,
+    parse_numbered_list,
+)
+from agent_base import BaseAgent, STEP_LABELS
+from llm_backend import LLMBackend
+from response_cache import ResponseCache
+from metrics import MetricsRegistry
+from reference_budget import ReferenceBudget
+from style_cards import StyleCardStore
+from patches import PatchMode
+from chunking import ChunkingPolicy, stitch_chunks
+from rule_engine import RuleEngine, MechanicalRule
+from model_routing import ModelRouter, StepRoute
+from single_flight import SingleFlight, FlightAbortedError
+from resilience import (
+    Deadline,
+    RetryPolicy,
+    DeadlineExceededError,
+    LLMCallError,
+    async_call_with_resilience,
+    is_timeout,
+)
+from rate_limit import RateLimitTimeoutError, estimate_tokens
+
+class AsyncAIAgent(BaseAgent):
+    """
+    AIAgent的异步版本，方法签名和返回值与AIAgent一致，只是需要await
+    单个事件循环即可同时承载大量并发生成请求，不再为每个请求占用一个线程
+    缓存和结果处理与同步版本共用BaseAgent（包括同一个进程内缓存），这里只负责以协程发出请求
+    """
+    
+    def __init__(self, cache: Optional[ResponseCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 step_timeout: Optional[float] = None, backend: Optional[LLMBackend] = None,
+                 metrics: Optional[MetricsRegistry] = None, reference_budget: Optional[ReferenceBudget] = None,
+                 style_cards: Optional[StyleCardStore] = None, patch_mode: Optional[PatchMode] = None,
+                 chunking: Optional[ChunkingPolicy] = None, rule_engine: Optional[RuleEngine] = None,
+                 router: Optional[ModelRouter] = None, single_flight: Optional[SingleFlight] = None):
+        super().__init__(cache=cache, retry_policy=retry_policy, step_timeout=step_timeout, backend=backend,
+                         metrics=metrics, reference_budget=reference_budget, style_cards=style_cards,
+                         patch_mode=patch_mode, chunking=chunking, rule_engine=rule_engine, router=router,
+                         single_flight=single_flight)
+    
+    async def _try_patch(self, step: str, messages: List[Dict[str, str]], draft: str, use_cache: bool,
+                         deadline: Optional[Deadline]) -> Optional[str]:
+        """补丁模式：请求替换列表并在本地应用；格式不对或原片段匹配不上时返回None，由调用方整篇重写"""
+        return self._patched(draft, await self._chat(step, messages, use_cache, deadline))
+    
+    async def _enforce_rules(self, draft: str, checks: List[MechanicalRule], use_cache: bool,
+                             deadline: Optional[Deadline]) -> str:
+        """生成后检查可检查的规则，本地修正后仍有违反才请求大模型只修改有问题的地方"""
+        draft, violations = self._check_rules(draft, checks)
+        if not violations:
+            return draft
+        repaired = await self._try_patch("rule_repair", self._rule_repair_messages(draft, violations), draft,
+                                         use_cache, deadline)
+        return self._repaired(draft, repaired, checks, violations)
+    
+    async def _apply_chunked(self, step: str, build_messages, draft: str, items: List[Dict[str, Any]],
+                             use_cache: bool, deadline: Optional[Deadline]) -> str:
+        """分段并发处理并按原顺序拼接；并发数由共享的限流器控制，开启衔接检查时再以补丁形式修正衔接"""
+        requests = self._chunk_requests(build_messages, draft, items)
+        results = await asyncio.gather(*[self._chat(step, messages, use_cache, deadline) for _, messages in requests])
+        result = stitch_chunks([chunk for chunk, _ in requests], results).strip()
+        if self.chunking.consistency:
+            fixed = await self._try_patch("consistency", build_consistency_messages(result), result,
+                                          use_cache, deadline)
+            if fixed is not None:
+                result = fixed
+        return result
+    
+    async def _chat(self, step: str, messages: List[Dict[str, str]], use_cache: bool = True,
+                    deadline: Optional[Deadline] = None) -> str:
+        """
+        发送一次完整的对话请求，返回模型输出文本，失败时抛出LLMCallError
+        使用路由表中本步骤的模型；超时且配置了备用模型时改用备用模型再试一次（备用模型的结果不写入缓存）
+        """
+        started = time.monotonic()
+        route = self._route(step)
+        cache_key = self._cache_key(messages, use_cache, route)
+        cached = self._cached(step, cache_key, started)
+        if cached is not None:
+            return cached
+        
+        # 相同的请求正在进行时等待它的结果，不再调用模型；use_cache=False表示要求重新生成，不参与合并
+        # 超时和中断只会发生在等待的一方，leader自己的失败已在_fetch中记录
+        try:
+            content, coalesced = await self.single_flight.do_async(
+                self._request_key(messages, route) if use_cache else None,
+                lambda: self._fetch(step, messages, deadline, route, cache_key, started),
+                timeout=deadline.remaining() if deadline is not None else None)
+        except asyncio.TimeoutError as e:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise DeadlineExceededError(STEP_LABELS[step], "等待相同请求的结果超时", e) from e
+        except FlightAbortedError as e:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise LLMCallError(STEP_LABELS[step], str(e), e) from e
+        if coalesced:
+            self.metrics.record(step, wall_time=time.monotonic() - started, coalesced=True)
+        return content
+    
+    async def _fetch(self, step: str, messages: List[Dict[str, str]], deadline: Optional[Deadline],
+                     route: StepRoute, cache_key: Optional[str], started: float) -> str:
+        """真正调用模型：超时且配置了备用模型时改用备用模型再试一次，记录指标并写入缓存"""
+        try:
+            try:
+                response = await self._call(step, messages, deadline, route, route.model)
+            except LLMCallError as e:
+                fallback_model = self._fallback_model(step, route, deadline) if is_timeout(e) else None
+                if fallback_model is None:
+                    raise
+                cache_key = None
+                response = await self._call(step, messages, deadline, route, fallback_model)
+        except LLMCallError:
+            self.metrics.record(step, wall_time=time.monotonic() - started, error=True)
+            raise
+        return self._finish_response(step, response, cache_key, started)
+    
+    async def _call(self, step: str, messages: List[Dict[str, str]], deadline: Optional[Deadline],
+                    route: StepRoute, model: Optional[str]):
+        """用指定模型发出一次完整请求（含重试和熔断）"""
+        step_deadline = self._step_deadline(deadline, route.timeout)
+        breaker, limiter = self._endpoint(model)
+        kwargs = {"max_tokens": route.max_tokens} if route.max_tokens else {}
+        
+        async def call(timeout: float):
+            try:
+                permit = await limiter.acquire_async(estimate_tokens(messages), step_deadline)
+            except RateLimitTimeoutError as e:
+                raise DeadlineExceededError(STEP_LABELS[step], str(e), e) from e
+            
+            try:
+                response = await self.backend.achat(messages, step_deadline.remaining(), model=model, **kwargs)
+            except BaseException as e:
+                # 超过截止时间时wait_for取消本协程，按超时交还配额（并发上限减半），不能当作成功
+                limiter.release(permit, error=TimeoutError() if isinstance(e, asyncio.CancelledError) else e)
+                raise
+            usage = getattr(response, "usage", None)
+            limiter.release(permit, total_tokens=getattr(usage, "total_tokens", None))
+            return response
+        
+        return await async_call_with_resilience(STEP_LABELS[step], call, step_deadline, self.retry_policy, breaker)
+    
+    async def close(self):
+        """关闭底层HTTP连接"""
+        await self.backend.aclose()
+    
+    async def generate_style_draft(self, user_input_text: str, reference_texts: List[str], use_cache: bool = True,
+                                   deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 1: 根据参考文案生成风格化初稿
+        """
+        messages = self._style_draft_messages(user_input_text, reference_texts)
+        return await self._chat("style_draft", messages, use_cache, deadline)
+    
+    async def apply_preferences(self, draft: str, selected_preferences: List[Dict[str, Any]], use_cache: bool = True,
+                                deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 2: 应用用户选择的写作偏好
+        """
+        if not selected_preferences:
+            return draft
+        
+        if self.chunking.applies_to(draft):
+            return await self._apply_chunked("preferences_chunk", build_preferences_chunk_messages, draft,
+                                             selected_preferences, use_cache, deadline)
+        
+        messages = build_preferences_messages(draft, selected_preferences)
+        return await self._chat("preferences", messages, use_cache, deadline)
+    
+    async def apply_restrictions(self, draft: str, selected_rules: List[Dict[str, Any]], use_cache: bool = True,
+                                 deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 3: 应用用户选择的限制规则
+        """
+        if not selected_rules:
+            return draft
+        
+        # 可以机械执行的规则直接在本地应用，文案已经符合的规则不再交给大模型
+        draft, model_rules, checks = self.rule_engine.prepare(draft, selected_rules)
+        if model_rules:
+            draft = await self._restrict_with_model(draft, model_rules, use_cache, deadline)
+        return await self._enforce_rules(draft, checks, use_cache, deadline)
+    
+    async def _restrict_with_model(self, draft: str, selected_rules: List[Dict[str, Any]], use_cache: bool,
+                                   deadline: Optional[Deadline]) -> str:
+        if self.patch_mode.applies_to(draft):
+            patched = await self._try_patch("restrictions_patch",
+                                            build_patch_restrictions_messages(draft, selected_rules),
+                                            draft, use_cache, deadline)
+            if patched is not None:
+                return patched
+        
+        if self.chunking.applies_to(draft):
+            return await self._apply_chunked("restrictions_chunk", build_restrictions_chunk_messages, draft,
+                                             selected_rules, use_cache, deadline)
+        
+        messages = build_restrictions_messages(draft, selected_rules)
+        return await self._chat("restrictions", messages, use_cache, deadline)
+    
+    async def modify_with_instruction(self, draft: str, instruction: str, use_cache: bool = True,
+                                      deadline: Optional[Deadline] = None) -> str:
+        """
+        Step 4: 根据用户指令修改文案
+        """
+        if self.patch_mode.applies_to(draft):
+            patched = await self._try_patch("instruction_patch", build_patch_instruction_messages(draft, instruction),
+                                            draft, use_cache, deadline)
+            if patched is not None:
+                return patched
+        
+        messages = build_instruction_messages(draft, instruction)
+        return await self._chat("instruction_edit", messages, use_cache, deadline)
+    
+    async def generate_final_draft(self, user_input_text: str, reference_texts: List[str],
+                                   selected_preferences: List[Dict[str, Any]],
+                                   selected_rules: List[Dict[str, Any]], use_cache: bool = True,
+                                   deadline: Optional[Deadline] = None) -> str:
+        """
+        融合模式: 一次请求完成风格化、应用偏好和应用限制规则，直接生成AI终稿
+        """
+        messages = self._one_shot_messages(user_input_text, reference_texts, selected_preferences, selected_rules)
+        draft = await self._chat("one_shot", messages, use_cache, deadline)
+        return await self._enforce_rules(draft, self.rule_engine.checks(selected_rules), use_cache, deadline)
+    
+    async def distill_style_card(self, reference_texts: List[str], name: Optional[str] = None,
+                                 use_cache: bool = True, deadline: Optional[Deadline] = None) -> str:
+        """
+        将一组参考文案提炼为风格卡片并保存
+        """
+        messages = build_style_card_messages(self.fit_references(reference_texts).texts)
+        card = await self._chat("style_card", messages, use_cache, deadline)
+        if self.style_cards is not None:
+            self.style_cards.save(reference_texts, card, name)
+        return card
+    
+    async def learn_preferences(self, original_draft: str, user_modified_draft: str, use_cache: bool = True,
+                                deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Step 5: 学习用户的写作偏好
+        """
+        messages = build_learn_preferences_messages(original_draft, user_modified_draft)
+        content = await self._chat("learn_preferences", messages, use_cache, deadline)
+        return parse_numbered_list(content)
+    
+    async def learn_rules(self, user_instructions: List[str], use_cache: bool = True,
+                          deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Step 5: 学习用户的通用规则
+        """
+        if not user_instructions:
+            return []
+        
+        messages = build_learn_rules_messages(user_instructions)
+        content = await self._chat("learn_rules", messages, use_cache, deadline)
+        return parse_numbered_list(content)
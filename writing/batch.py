@@ -0,0 +1,220 @@
+"""
+批量生成模块 - 从JSONL读取文案和参考文案，用有限并发跑完风格化流程，结果按完成顺序写入JSONL
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional, Iterator, Set
+
+from ai_agent import AIAgent
+from data_manager import DataManager
+
+# 支持的步骤；one_shot为融合模式，不能与其他步骤同时使用
+BATCH_STEPS = ("style", "preferences", "rules", "one_shot")
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取JSONL文件，跳过空行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过第{line_no}行（JSON格式错误）: {e}")
+
+
+def load_reference_sets(path: Optional[str]) -> Dict[str, List[str]]:
+    """读取参考文案集合文件，每行形如 {"name": "品牌A", "texts": ["...", "..."]}"""
+    if not path:
+        return {}
+    return {item["name"]: item["texts"] for item in read_jsonl(path)}
+
+
+def truncate_partial_line(output_path: str):
+    """
+    上次运行中断时输出文件的最后一行可能只写了一半：截掉这半行，
+    续跑追加的结果从新的一行开始，不会和它拼成一行无法解析的JSON（被截掉的条目会重新处理）
+    """
+    with open(output_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # 从末尾向前按块查找最后一个换行
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+    print("输出文件最后一行不完整（上次运行中断），已截掉，该条目将重新处理")
+
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """读取已有输出文件中成功完成的条目id，用于断点续跑"""
+    if not os.path.exists(output_path):
+        return set()
+    return {str(item["id"]) for item in read_jsonl(output_path) if not item.get("error")}
+
+
+def select_items(items: List[Dict[str, Any]], spec: Optional[str]) -> List[Dict[str, Any]]:
+    """按"all"或逗号分隔的id列表选择偏好/规则"""
+    if not spec:
+        return []
+    if spec == "all":
+        return items
+    wanted = {item_id.strip() for item_id in spec.split(",") if item_id.strip()}
+    return [item for item in items if item["id"] in wanted]
+
+
+class BatchRunner:
+    """批量运行器：有限并发执行每条文案的生成步骤，并增量写出结果"""
+    
+    def __init__(self, ai_agent: AIAgent, steps: List[str], preferences: List[Dict[str, Any]],
+                 rules: List[Dict[str, Any]], reference_sets: Dict[str, List[str]], workers: int = 8,
+                 all_preferences: Optional[List[Dict[str, Any]]] = None,
+                 all_rules: Optional[List[Dict[str, Any]]] = None):
+        unknown = [step for step in steps if step not in BATCH_STEPS]
+        if unknown:
+            raise ValueError(f"未知的步骤: {', '.join(unknown)}")
+        if "one_shot" in steps and len(steps) > 1:
+            raise ValueError("one_shot 不能与其他步骤同时使用")
+        
+        self.ai_agent = ai_agent
+        self.steps = steps
+        self.preferences = preferences
+        self.rules = rules
+        self.reference_sets = reference_sets
+        self.workers = workers
+        # 条目中的preference_ids/rule_ids从全部偏好和规则中选择
+        self.all_preferences = all_preferences if all_preferences is not None else preferences
+        self.all_rules = all_rules if all_rules is not None else rules
+    
+    def _resolve(self, item: Dict[str, Any]):
+        """解析条目的参考文案、偏好和规则，条目中的字段优先于命令行默认值"""
+        references = item.get("references")
+        if references is None and item.get("reference_set"):
+            references = self.reference_sets[item["reference_set"]]
+        if not references:
+            raise ValueError("缺少参考文案（references 或 reference_set）")
+        
+        preferences = self.preferences
+        if "preference_ids" in item:
+            preferences = [p for p in self.all_preferences if p["id"] in set(item["preference_ids"])]
+        rules = self.rules
+        if "rule_ids" in item:
+            rules = [r for r in self.all_rules if r["id"] in set(item["rule_ids"])]
+        return references, preferences, rules
+    
+    def process_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """处理单条文案，返回包含各步骤耗时的结果；出错时记录错误信息而不中断整个批次"""
+        result = {"id": item["id"], "timings": {}}
+        started = time.monotonic()
+        try:
+            references, preferences, rules = self._resolve(item)
+            draft = item["text"]
+            
+            for step in self.steps:
+                step_started = time.monotonic()
+                if step == "one_shot":
+                    draft = self.ai_agent.generate_final_draft(draft, references, preferences, rules)
+                elif step == "style":
+                    draft = self.ai_agent.generate_style_draft(draft, references)
+                elif step == "preferences":
+                    draft = self.ai_agent.apply_preferences(draft, preferences)
+                elif step == "rules":
+                    draft = self.ai_agent.apply_restrictions(draft, rules)
+                result["timings"][step] = round(time.monotonic() - step_started, 3)
+            
+            result["draft"] = draft
+        except Exception as e:
+            result["error"] = str(e)
+        result["elapsed"] = round(time.monotonic() - started, 3)
+        return result
+    
+    def run(self, input_path: str, output_path: str, resume: bool = True) -> Dict[str, int]:
+        """
+        运行批次，结果按完成顺序追加写入output_path
+        resume为True时跳过输出文件中已成功的条目，失败的条目会重新处理
+        """
+        if resume and os.path.exists(output_path):
+            truncate_partial_line(output_path)
+        completed = load_completed_ids(output_path) if resume else set()
+        mode = 'a' if resume else 'w'
+        summary = {"submitted": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+        write_lock = threading.Lock()
+        batch_started = time.monotonic()
+        
+        def pending_items():
+            for index, item in enumerate(read_jsonl(input_path)):
+                item.setdefault("id", str(index))
+                item["id"] = str(item["id"])
+                if item["id"] in completed:
+                    summary["skipped"] += 1
+                    continue
+                yield item
+        
+        with open(output_path, mode, encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as executor:
+            
+            def write(result):
+                with write_lock:
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    summary["failed" if result.get("error") else "succeeded"] += 1
+                    done_count = summary["succeeded"] + summary["failed"]
+                    if done_count % 50 == 0:
+                        elapsed = time.monotonic() - batch_started
+                        print(f"已完成 {done_count} 条（失败 {summary['failed']} 条），用时 {elapsed:.0f} 秒")
+            
+            # 最多同时保留workers*2个待处理任务，避免一次性把上万条都塞进队列
+            in_flight = set()
+            for item in pending_items():
+                if len(in_flight) >= self.workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future.result())
+                in_flight.add(executor.submit(self.process_item, item))
+                summary["submitted"] += 1
+            
+            for future in wait(in_flight).done:
+                write(future.result())
+        
+        return summary
+
+
+def run_batch(input_path: str, output_path: str, steps: List[str], workers: int = 8,
+              references_path: Optional[str] = None, preferences: Optional[str] = None,
+              rules: Optional[str] = None, resume: bool = True,
+              ai_agent: Optional[AIAgent] = None, data_manager: Optional[DataManager] = None) -> Dict[str, int]:
+    """
+    批量生成入口
+    输入文件每行形如 {"id": "sku-1", "text": "原始文案", "references": ["..."]}，
+    也可以用 "reference_set" 引用references_path中的参考文案集合，
+    用 "preference_ids" / "rule_ids" 覆盖命令行指定的偏好和规则
+    """
+    data_manager = data_manager or DataManager()
+    all_preferences = data_manager.get_user_preferences()
+    all_rules = data_manager.get_restriction_rules()
+    runner = BatchRunner(
+        ai_agent=ai_agent or AIAgent(),
+        steps=steps,
+        preferences=select_items(all_preferences, preferences),
+        rules=select_items(all_rules, rules),
+        reference_sets=load_reference_sets(references_path),
+        workers=workers,
+        all_preferences=all_preferences,
+        all_rules=all_rules,
+    )
+    return runner.run(input_path, output_path, resume=resume)
@@ -0,0 +1,95 @@
+"""
+分段处理模块 - 长文案按段落切成若干块，各块带着相同的偏好/规则和少量前后文并发修改，再按原顺序拼接
+"""
+import os
+import re
+from typing import List, Tuple
+
+_PARAGRAPH_SEPARATOR = re.compile(r"(\n\s*\n|\n)")
+
+
+class Chunk:
+    """一块文案：正文、与下一块之间的分隔符，以及供模型参考的前后文"""
+    
+    def __init__(self, text: str, separator: str, before: str = "", after: str = ""):
+        self.text = text
+        self.separator = separator
+        self.before = before
+        self.after = after
+
+
+def _paragraphs(draft: str) -> List[Tuple[str, str]]:
+    """切分为 (段落, 段落后的分隔符)，分隔符原样保留，拼接时不改变段落间距"""
+    parts = _PARAGRAPH_SEPARATOR.split(draft)
+    paragraphs = []
+    for i in range(0, len(parts), 2):
+        separator = parts[i + 1] if i + 1 < len(parts) else ""
+        if parts[i].strip():
+            paragraphs.append((parts[i], separator))
+        elif paragraphs:
+            # 空段落并入上一段的分隔符
+            paragraphs[-1] = (paragraphs[-1][0], paragraphs[-1][1] + parts[i] + separator)
+    return paragraphs
+
+
+def split_chunks(draft: str, max_chars: int = 1500, context_chars: int = 100) -> List[Chunk]:
+    """
+    按段落边界切块，每块不超过max_chars个字（单个段落超长时单独成块，不在段落中间切开）
+    每块附带前一块末尾和后一块开头各context_chars个字作为参考上下文
+    """
+    groups = []
+    for paragraph, separator in _paragraphs(draft):
+        if groups and len(groups[-1][0]) + len(groups[-1][1]) + len(paragraph) <= max_chars:
+            text, previous_separator = groups[-1]
+            groups[-1] = (text + previous_separator + paragraph, separator)
+        else:
+            groups.append((paragraph, separator))
+    
+    chunks = []
+    for i, (text, separator) in enumerate(groups):
+        before = groups[i - 1][0][-context_chars:] if i > 0 else ""
+        after = groups[i + 1][0][:context_chars] if i + 1 < len(groups) else ""
+        chunks.append(Chunk(text, separator, before, after))
+    return chunks
+
+
+def stitch_chunks(chunks: List[Chunk], results: List[str]) -> str:
+    """按原顺序拼接各块的修改结果，保留原来的段落分隔"""
+    return "".join(result.strip() + chunk.separator for chunk, result in zip(chunks, results))
+
+
+class ChunkingPolicy:
+    """
+    分段处理的开关
+    文案不少于min_chars个字时按max_chars切块并发处理，最多workers个请求同时进行；
+    consistency为True时拼接后再做一次衔接检查（只输出需要修改的地方）
+    """
+    
+    def __init__(self, enabled: bool = False, min_chars: int = 3000, max_chars: int = 1500,
+                 context_chars: int = 100, workers: int = 4, consistency: bool = False):
+        self.enabled = enabled
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.context_chars = context_chars
+        self.workers = workers
+        self.consistency = consistency
+    
+    @classmethod
+    def from_env(cls) -> "ChunkingPolicy":
+        """
+        AI_CHUNKED=1开启；AI_CHUNK_MIN_CHARS（默认3000）为启用分段的最短文案，AI_CHUNK_CHARS（默认1500）为每块上限，
+        AI_CHUNK_WORKERS（默认4）为并发数，AI_CHUNK_CONSISTENCY=1开启衔接检查
+        """
+        return cls(
+            enabled=os.getenv("AI_CHUNKED") == "1",
+            min_chars=int(os.getenv("AI_CHUNK_MIN_CHARS", "3000")),
+            max_chars=int(os.getenv("AI_CHUNK_CHARS", "1500")),
+            workers=int(os.getenv("AI_CHUNK_WORKERS", "4")),
+            consistency=os.getenv("AI_CHUNK_CONSISTENCY") == "1",
+        )
+    
+    def applies_to(self, draft: str) -> bool:
+        return self.enabled and len(draft) >= self.min_chars
+    
+    def split(self, draft: str) -> List[Chunk]:
+        return split_chunks(draft, self.max_chars, self.context_chars)
@@ -3,15 +3,34 @@
 """
 import json
 import os
+import threading
+import tempfile
 from typing import List, Dict, Any
 from datetime import datetime
 
+# 上一次的选择是"读取-修改-写回"（偏好和规则分两次记录），同一进程内串行写入
+_selection_lock = threading.Lock()
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]):
+    """先写临时文件再替换，读取方不会读到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 class DataManager:
     """管理用户偏好和规则的数据存储"""
     
     def __init__(self, data_file_path: str = "data/user_profile.json"):
         self.data_file_path = data_file_path
+        # 上一次的选择单独存放，频繁记录时不必重写整个用户配置
+        self.selection_file_path = os.path.join(os.path.dirname(data_file_path), "last_selection.json")
         self.ensure_data_file_exists()
     
     def ensure_data_file_exists(self):
@@ -34,8 +53,7 @@ class DataManager:
     
     def save_data(self, data: Dict[str, Any]):
         """保存用户数据"""
-        with open(self.data_file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        _write_json_atomic(self.data_file_path, data)
     
     def get_user_preferences(self) -> List[Dict[str, Any]]:
         """获取用户偏好列表"""
@@ -92,3 +110,28 @@ class DataManager:
             if rule["id"] == rule_id:
                 return rule
         return {}
+    
+    def _load_selection(self) -> Dict[str, Any]:
+        try:
+            with open(self.selection_file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def get_last_selection(self) -> Dict[str, List[str]]:
+        """获取用户上一次选择的偏好和规则ID"""
+        last_selection = self._load_selection()
+        return {
+            "preference_ids": last_selection.get("preference_ids", []),
+            "rule_ids": last_selection.get("rule_ids", [])
+        }
+    
+    def save_last_selection(self, preference_ids: List[str] = None, rule_ids: List[str] = None):
+        """记录用户本次选择的偏好或规则ID，用于推测下一次的选择（写入单独的文件，不改动用户配置）"""
+        with _selection_lock:
+            last_selection = self._load_selection()
+            if preference_ids is not None:
+                last_selection["preference_ids"] = preference_ids
+            if rule_ids is not None:
+                last_selection["rule_ids"] = rule_ids
+            _write_json_atomic(self.selection_file_path, last_selection)
@@ -175,12 +175,11 @@ def test_ai_capabilities():
         print(f"测试提示: {test_prompt}")
         
         # 模拟API调用
-        response = ai_agent.client.chat.completions.create(
-            model=ai_agent.model,
+        response = ai_agent.backend.chat(
             messages=[
                 {"role": "user", "content": test_prompt}
             ],
-            thinking={"type": "disabled"}
+            timeout=ai_agent.step_timeout
         )
         
         result = response.choices[0].message.content.strip()
@@ -0,0 +1,219 @@
+"""
+对冲请求模块 - 主请求迟迟未返回时再发一个相同请求，取先完成者以压低长尾延迟
+"""
+import time
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any, Iterable
+
+
+class HedgeAbortedError(Exception):
+    """这一路请求已落败并被中断"""
+
+
+class HedgeLeg:
+    """
+    对冲中一路请求的中断句柄
+    请求拿到响应流后用attach登记关闭方法；abort()标记中断并关闭响应流（连接断开后服务端停止生成），
+    读取流的一方在每个分片之间检查aborted
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aborted = False
+        self._close = None
+    
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+    
+    def attach(self, close: Callable[[], Any]):
+        with self._lock:
+            if not self._aborted:
+                self._close = close
+                return
+        self._safe_close(close)
+    
+    def abort(self):
+        with self._lock:
+            if self._aborted:
+                return
+            self._aborted = True
+            close = self._close
+        if close is not None:
+            self._safe_close(close)
+    
+    @staticmethod
+    def _safe_close(close: Callable[[], Any]):
+        try:
+            close()
+        except Exception:
+            # 关闭正在另一线程读取的流时可能抛出异常，读取方会在下一个分片处发现已中断
+            pass
+
+
+class StreamedCompletion:
+    """把流式响应拼成与非流式响应相同的形状（choices[0].message.content和usage）"""
+    
+    class _Message:
+        def __init__(self, content: str):
+            self.content = content
+    
+    class _Choice:
+        def __init__(self, content: str):
+            self.message = StreamedCompletion._Message(content)
+    
+    def __init__(self, content: str, usage: Any = None):
+        self.choices = [self._Choice(content)]
+        self.usage = usage
+
+
+class HedgingPolicy:
+    """
+    对冲策略（可选开启）
+    主请求发出后等待hedge_delay秒，若仍未返回则发出一个完全相同的对冲请求，
+    两者谁先成功就用谁的结果，另一个被中断（关闭响应流），来不及中断而完成的其token消耗计为额外开销。
+    未指定固定延迟时，使用该步骤历史延迟的percentile分位数作为等待时间
+    """
+    
+    def __init__(self, delay: Optional[float] = None, percentile: float = 0.9, min_samples: int = 20,
+                 steps: Optional[Iterable[str]] = None, max_workers: int = 16):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.steps = set(steps) if steps else None
+        
+        self._latencies = defaultdict(lambda: deque(maxlen=200))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "hedges_issued": 0,
+            "hedges_won": 0,
+            "losers_aborted": 0,
+            "extra_prompt_tokens": 0,
+            "extra_completion_tokens": 0,
+        }
+    
+    def applies_to(self, step: str) -> bool:
+        return self.steps is None or step in self.steps
+    
+    def record_latency(self, step: str, seconds: float):
+        with self._lock:
+            self._latencies[step].append(seconds)
+    
+    def hedge_delay(self, step: str) -> Optional[float]:
+        """对冲前的等待秒数；历史样本不足时返回None，表示本次不对冲"""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            samples = sorted(self._latencies[step])
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return samples[index]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_win_rate"] = stats["hedges_won"] / stats["hedges_issued"] if stats["hedges_issued"] else 0.0
+        return stats
+    
+    def run(self, step: str, call: Callable[[HedgeLeg], Any]) -> Any:
+        """
+        执行call(leg)，必要时发出对冲请求，返回先成功完成的结果
+        主请求在调用方线程上执行，线程池只用于对冲请求，主请求不会排在其他请求的对冲之后；
+        落败的一路通过leg.abort()关闭其响应流，服务端随即停止生成
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._stats["requests"] += 1
+        
+        primary_leg = HedgeLeg()
+        delay = self.hedge_delay(step)
+        if delay is None:
+            result = call(primary_leg)
+            self.record_latency(step, time.monotonic() - started)
+            return result
+        
+        hedge_leg = HedgeLeg()
+        state = {"finished": False, "hedge": None}
+        state_lock = threading.Lock()
+        
+        def on_hedge_done(future):
+            # 对冲请求先成功时中断仍在进行的主请求
+            if not future.cancelled() and future.exception() is None:
+                primary_leg.abort()
+        
+        def launch_hedge():
+            with state_lock:
+                if state["finished"]:
+                    return
+                state["hedge"] = self._executor.submit(call, hedge_leg)
+            with self._lock:
+                self._stats["hedges_issued"] += 1
+            state["hedge"].add_done_callback(on_hedge_done)
+        
+        timer = threading.Timer(delay, launch_hedge)
+        timer.daemon = True
+        timer.start()
+        
+        def finish():
+            timer.cancel()
+            with state_lock:
+                state["finished"] = True
+                return state["hedge"]
+        
+        try:
+            result = call(primary_leg)
+        except HedgeAbortedError:
+            # 只有对冲请求成功后主请求才会被中断
+            hedge = finish()
+            with self._lock:
+                self._stats["hedges_won"] += 1
+                self._stats["losers_aborted"] += 1
+            self.record_latency(step, time.monotonic() - started)
+            return hedge.result()
+        except Exception as primary_error:
+            hedge = finish()
+            if hedge is None:
+                raise
+            try:
+                result = hedge.result()
+            except Exception:
+                raise primary_error
+            with self._lock:
+                self._stats["hedges_won"] += 1
+            self.record_latency(step, time.monotonic() - started)
+            return result
+        
+        hedge = finish()
+        if hedge is not None:
+            self._discard(hedge, hedge_leg)
+        self.record_latency(step, time.monotonic() - started)
+        return result
+    
+    def _discard(self, future, leg: HedgeLeg):
+        """中断落败的请求：尚未开始的直接取消，已在执行的关闭其响应流；来不及中断而完成的，其token消耗记为额外开销"""
+        leg.abort()
+        if future.cancel():
+            return
+        
+        def account(f):
+            if f.cancelled():
+                return
+            if isinstance(f.exception(), HedgeAbortedError):
+                with self._lock:
+                    self._stats["losers_aborted"] += 1
+                return
+            if f.exception() is not None:
+                return
+            usage = getattr(f.result(), "usage", None)
+            if usage is None:
+                return
+            with self._lock:
+                self._stats["extra_prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                self._stats["extra_completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        
+        future.add_done_callback(account)
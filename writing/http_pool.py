@@ -0,0 +1,117 @@
+"""
+连接池模块 - 进程内所有火山方舟客户端共享的HTTP连接池（长连接、可配置连接数、可选HTTP/2），
+以及启动时的连接预热，避免每个进程的第一个请求承担TLS握手的耗时
+"""
+import os
+import time
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+import httpx
+
+
+class HTTPPool:
+    """
+    共享的HTTP连接池
+    同步客户端在进程内共享一个；异步客户端的连接绑定在事件循环上，每个后端各自创建，使用相同的连接池配置
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, pool_size: int = 64, keepalive: int = 32, keepalive_expiry: float = 60.0,
+                 http2: bool = False):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.keepalive_expiry = keepalive_expiry
+        # HTTP/2需要安装h2（pip install 'httpx[http2]'），没有安装时使用HTTP/1.1长连接
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("未安装h2，HTTP/2不可用，使用HTTP/1.1长连接（pip install 'httpx[http2]'）")
+            http2 = False
+        self.http2 = http2
+        self._client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        self._warm_up: Dict[str, Any] = {}
+    
+    @classmethod
+    def default(cls) -> "HTTPPool":
+        """
+        进程内共享的连接池，配置从环境变量读取：AI_HTTP_POOL_SIZE（最大连接数，默认64）、
+        AI_HTTP_KEEPALIVE（保持的空闲连接数，默认32）、AI_HTTP_KEEPALIVE_EXPIRY（空闲连接保持秒数，默认60）、
+        AI_HTTP2=1开启HTTP/2
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(
+                    pool_size=int(os.getenv("AI_HTTP_POOL_SIZE", "64")),
+                    keepalive=int(os.getenv("AI_HTTP_KEEPALIVE", "32")),
+                    keepalive_expiry=float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "60")),
+                    http2=os.getenv("AI_HTTP2") == "1",
+                )
+            return cls._default
+    
+    def _options(self) -> Dict[str, Any]:
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": self.http2,
+            "follow_redirects": True,
+        }
+    
+    def client(self) -> httpx.Client:
+        """进程内共享的同步客户端"""
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._options())
+            return self._client
+    
+    def new_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(**self._options())
+    
+    def warm_up(self, url: str, connections: int = 1, timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        向url并发发出connections个轻量请求，预先建立连接（DNS、TCP、TLS）并留在连接池中
+        响应状态码不重要（未鉴权的请求通常返回4xx），只要连接建立即可；HTTP/2下一个连接即可多路复用
+        """
+        if self.http2:
+            connections = 1
+        client = self.client()
+        started = time.monotonic()
+        
+        def connect(_):
+            try:
+                client.get(url, timeout=timeout)
+                return None
+            except httpx.HTTPError as e:
+                return str(e)
+        
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="http-warm-up") as executor:
+            errors = [error for error in executor.map(connect, range(connections)) if error]
+        
+        result = {
+            "url": url,
+            "connections": connections - len(errors),
+            "errors": errors,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        if errors:
+            print(f"连接预热失败 {len(errors)}/{connections}: {errors[0]}")
+        with self._lock:
+            self._warm_up = result
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            warm_up = dict(self._warm_up)
+        return {
+            "pool_size": self.pool_size,
+            "keepalive": self.keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+            "warm_up": warm_up or None,
+        }
@@ -0,0 +1,280 @@
+"""
+任务队列模块 - 基于SQLite的本地持久化任务队列，不依赖外部消息中间件
+任务写入数据库后由后台工作线程执行，进程重启后未完成的任务会被重新领取；
+多个Web工作进程可以共用同一个数据库文件
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after);
+"""
+
+
+class PartialJobError(Exception):
+    """
+    任务只完成了一部分时由处理函数抛出：payload为记录了已完成部分的新payload，
+    队列保存它后按正常的失败重试，重试时处理函数收到新的payload，只执行剩下的部分
+    """
+    
+    def __init__(self, message: str, payload: Dict[str, Any]):
+        super().__init__(message)
+        self.payload = payload
+
+
+class JobQueue:
+    """
+    持久化任务队列
+    任务状态：pending（等待执行）、running（执行中）、done（完成）、failed（重试用尽后失败）
+    工作线程领取任务时写入租约到期时间，执行期间由心跳线程定期续约，租约可以设得很短；
+    进程崩溃或重启后心跳停止，租约很快过期，running任务会被重新领取。
+    执行出错时按指数退避重新排队；尝试次数达到max_attempts后标记为failed，
+    租约过期的任务同样计入尝试次数（反复使工作进程崩溃或卡死的任务不会无限重试）
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, path: str = "data/jobs.sqlite3", workers: int = 2, max_attempts: int = 3,
+                 retry_delay: float = 2.0, lease_seconds: float = 30.0, poll_interval: float = 1.0):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._running: set = set()  # 本进程正在执行、需要心跳续约的任务ID
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+    
+    @classmethod
+    def default(cls) -> "JobQueue":
+        """进程内共享的任务队列，数据库路径和工作线程数可用环境变量AI_JOB_DB、AI_JOB_WORKERS指定"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(
+                    os.getenv("AI_JOB_DB", "data/jobs.sqlite3"),
+                    workers=int(os.getenv("AI_JOB_WORKERS", "2")),
+                )
+            return cls._default
+    
+    @contextmanager
+    def _connect(self):
+        """每次操作使用独立连接，避免跨线程共享；自动提交模式，需要事务时手动BEGIN"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        """注册任务类型的处理函数，处理函数接收payload，返回值需可JSON序列化"""
+        self._handlers[kind] = handler
+    
+    def start(self):
+        """启动工作线程（重复调用无副作用）"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def stop(self, timeout: Optional[float] = None):
+        """停止工作线程；正在执行的任务会执行完，未领取的任务留在数据库中"""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+    
+    def submit(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> str:
+        """提交任务，返回任务ID"""
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, max_attempts, created_at, updated_at, run_after) "
+                "VALUES (?, ?, ?, 'pending', ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False),
+                 max_attempts or self.max_attempts, now, now, now)
+            )
+        self._wakeup.set()
+        return job_id
+    
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        领取一个到期的pending任务或租约已过期的running任务
+        租约过期且尝试次数已用尽的running任务不再领取，直接标记为failed
+        """
+        now = time.time()
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        placeholders = ",".join("?" * len(kinds))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated_at = ? "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                    ("执行中断（工作进程崩溃或超过租约未续约），重试次数已用尽", now, now)
+                )
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({placeholders}) AND "
+                    "((status = 'pending' AND run_after <= ?) OR "
+                    "(status = 'running' AND lease_until < ? AND attempts < max_attempts)) "
+                    "ORDER BY created_at LIMIT 1",
+                    (*kinds, now, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (now + self.lease_seconds, now, row["id"])
+                    )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        return row
+    
+    def _finish(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+    
+    def run_once(self) -> bool:
+        """
+        领取并执行一个任务，没有可执行的任务时返回False（工作线程循环调用，也便于在脚本中同步执行；
+        未调用start()时没有心跳续约，执行时间超过租约的任务可能被其他进程重新领取）
+        """
+        row = self._claim()
+        if row is None:
+            return False
+        
+        attempts = row["attempts"] + 1
+        with self._lock:
+            self._running.add(row["id"])
+        try:
+            result = self._handlers[row["kind"]](json.loads(row["payload"]))
+        except Exception as e:
+            fields = {"error": str(e), "lease_until": None}
+            if isinstance(e, PartialJobError):
+                fields["payload"] = json.dumps(e.payload, ensure_ascii=False)
+            if attempts < row["max_attempts"]:
+                self._finish(row["id"], status="pending",
+                             run_after=time.time() + self.retry_delay * (2 ** (attempts - 1)), **fields)
+            else:
+                self._finish(row["id"], status="failed", **fields)
+            return True
+        finally:
+            with self._lock:
+                self._running.discard(row["id"])
+        
+        self._finish(row["id"], status="done", error=None, lease_until=None,
+                     result=json.dumps(result, ensure_ascii=False))
+        return True
+    
+    def _heartbeat(self):
+        """每隔租约的三分之一续约一次本进程正在执行的任务"""
+        while not self._stopping.wait(self.lease_seconds / 3):
+            with self._lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            now = time.time()
+            try:
+                with self._connect() as conn:
+                    conn.executemany(
+                        "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                        [(now + self.lease_seconds, now, job_id) for job_id in job_ids]
+                    )
+            except sqlite3.Error as e:
+                print(f"任务续约失败: {e}")
+    
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except sqlite3.Error as e:
+                print(f"任务队列数据库错误: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的任务，按创建时间倒序"""
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+    
+    def stats(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
@@ -0,0 +1,196 @@
+"""
+学习模块 - 偏好学习和规则学习并发执行，去重后写入用户配置；也可以作为任务队列中的后台任务执行，不阻塞用户拿到终稿
+"""
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from ai_agent import AIAgent
+from data_manager import DataManager
+from deduplication import DeduplicationEngine
+from job_queue import JobQueue, PartialJobError
+from resilience import Deadline, LLMCallError
+from text_diff import text_diff, strip_formatting
+
+# 写入用户配置是"读取-修改-写回"，同一进程内的学习结果需要串行合并
+_merge_lock = threading.Lock()
+
+
+# 跳过偏好学习的原因
+SKIP_REASONS = {
+    "identical": "用户未做修改",
+    "formatting_only": "只改动了标点或空白",
+    "below_threshold": "改动很小",
+}
+
+
+class LearningGate:
+    """
+    学习前的本地检查，不值得学习的修改直接跳过偏好学习的大模型调用：
+    定稿与AI终稿完全相同、只改了标点和空白、或编辑距离不超过原文长度的min_change_ratio（如修正错别字）
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, min_change_ratio: float = 0.02):
+        self.min_change_ratio = min_change_ratio
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "learned": 0, **{reason: 0 for reason in SKIP_REASONS}}
+    
+    @classmethod
+    def default(cls) -> "LearningGate":
+        """进程内共享的检查器，阈值可用环境变量AI_LEARN_MIN_CHANGE指定（默认0.02，0表示只跳过无实质改动的情况）"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(float(os.getenv("AI_LEARN_MIN_CHANGE", "0.02")))
+            return cls._default
+    
+    def _reason(self, original: str, modified: str) -> Optional[str]:
+        if original.strip() == modified.strip():
+            return "identical"
+        if strip_formatting(original) == strip_formatting(modified):
+            return "formatting_only"
+        limit = int(len(original) * self.min_change_ratio)
+        # 对比结果会在构建学习提示词时复用；长度差超过上限时不做对比
+        if limit > 0 and text_diff(original, modified).within_distance(limit):
+            return "below_threshold"
+        return None
+    
+    def check(self, original: str, modified: str) -> Optional[str]:
+        """返回跳过偏好学习的原因，需要学习时返回None"""
+        reason = self._reason(original, modified)
+        with self._lock:
+            self._stats["checked"] += 1
+            self._stats[reason or "learned"] += 1
+        return reason
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["skipped"] = stats["checked"] - stats["learned"]
+        return stats
+
+
+class LearningResult:
+    """一次学习的结果：新增的偏好和规则，各自的调用错误和失败的步骤（preferences/rules），以及跳过偏好学习的原因"""
+    
+    def __init__(self, new_preferences: List[str], new_rules: List[str], errors: Optional[List[str]] = None,
+                 skipped: Optional[str] = None, failed_steps: Optional[List[str]] = None):
+        self.new_preferences = new_preferences
+        self.new_rules = new_rules
+        self.errors = errors or []
+        self.skipped = skipped
+        self.failed_steps = failed_steps or []
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "new_preferences": len(self.new_preferences),
+            "new_rules": len(self.new_rules),
+            "preferences": self.new_preferences,
+            "rules": self.new_rules,
+            "errors": self.errors,
+            "preferences_skipped": self.skipped,
+        }
+
+
+def learn_concurrently(ai_agent: AIAgent, ai_final_draft: str, user_final_draft: str,
+                       user_instructions: List[str], deadline: Optional[Deadline] = None,
+                       learn_preferences: bool = True, learn_rules: bool = True):
+    """
+    同时发出偏好学习和规则学习两个请求，返回 (偏好列表, 规则列表, 错误)，错误按步骤（preferences/rules）记录
+    一边失败不影响另一边的结果；调用在当前上下文中执行，指标仍计入当前会话
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="learn") as executor:
+        preferences_future = executor.submit(
+            contextvars.copy_context().run, ai_agent.learn_preferences,
+            ai_final_draft, user_final_draft, deadline=deadline
+        ) if learn_preferences else None
+        rules_future = executor.submit(
+            contextvars.copy_context().run, ai_agent.learn_rules,
+            user_instructions, deadline=deadline
+        ) if learn_rules else None
+    
+    errors = {}
+    learned_preferences = []
+    try:
+        if preferences_future is not None:
+            learned_preferences = preferences_future.result()
+    except LLMCallError as e:
+        errors["preferences"] = str(e)
+    learned_rules = []
+    try:
+        if rules_future is not None:
+            learned_rules = rules_future.result()
+    except LLMCallError as e:
+        errors["rules"] = str(e)
+    return learned_preferences, learned_rules, errors
+
+
+def merge_learned(data_manager: DataManager, deduplication_engine: DeduplicationEngine,
+                  learned_preferences: List[str], learned_rules: List[str]):
+    """去重后写入用户配置，返回 (新增偏好, 新增规则)"""
+    with _merge_lock:
+        existing_preferences = data_manager.get_user_preferences()
+        new_preferences = []
+        for pref_description in learned_preferences:
+            if deduplication_engine.deduplicate_preference(pref_description, existing_preferences):
+                data_manager.add_user_preference(pref_description)
+                new_preferences.append(pref_description)
+                existing_preferences.append({"description": pref_description})  # 更新本地列表
+        
+        existing_rules = data_manager.get_restriction_rules()
+        new_rules = []
+        for rule_instruction in learned_rules:
+            if deduplication_engine.deduplicate_rule(rule_instruction, existing_rules):
+                data_manager.add_restriction_rule(rule_instruction)
+                new_rules.append(rule_instruction)
+                existing_rules.append({"instruction": rule_instruction})  # 更新本地列表
+    return new_preferences, new_rules
+
+
+def learn_and_merge(ai_agent: AIAgent, data_manager: DataManager, deduplication_engine: DeduplicationEngine,
+                    ai_final_draft: str, user_final_draft: str, user_instructions: List[str],
+                    deadline: Optional[Deadline] = None, gate: Optional[LearningGate] = None,
+                    learn_preferences: bool = True, learn_rules: bool = True) -> LearningResult:
+    """
+    并发学习偏好和规则，去重后写入用户配置；修改不值得学习时跳过偏好学习
+    learn_preferences/learn_rules为False时不执行对应的步骤（如重试时跳过已经成功的一边）
+    """
+    skipped = (gate or LearningGate.default()).check(ai_final_draft, user_final_draft) if learn_preferences else None
+    learned_preferences, learned_rules, errors = learn_concurrently(
+        ai_agent, ai_final_draft, user_final_draft, user_instructions, deadline,
+        learn_preferences=learn_preferences and skipped is None, learn_rules=learn_rules
+    )
+    new_preferences, new_rules = merge_learned(data_manager, deduplication_engine, learned_preferences, learned_rules)
+    return LearningResult(new_preferences, new_rules, list(errors.values()), skipped, failed_steps=list(errors))
+
+
+def register_learning_job(job_queue: JobQueue, ai_agent: AIAgent, data_manager: DataManager,
+                          deduplication_engine: DeduplicationEngine):
+    """
+    在任务队列中注册"learn"任务，payload包含ai_final_draft、user_final_draft、user_instructions
+    一边学习失败时，成功一边的结果记入payload的completed后交由队列重试，重试时只重新学习失败的一边，
+    已写入用户配置的结果不会再请求一次大模型、也不会因为两次输出措辞不同而重复添加
+    """
+    def handle(payload: Dict[str, Any]) -> Dict[str, Any]:
+        completed = payload.get("completed", {})  # 已成功的步骤 -> 该步骤新增的条目
+        result = learn_and_merge(
+            ai_agent, data_manager, deduplication_engine,
+            payload["ai_final_draft"], payload["user_final_draft"], payload.get("user_instructions", []),
+            learn_preferences="preferences" not in completed, learn_rules="rules" not in completed
+        )
+        completed = dict(completed)
+        if "preferences" not in completed and "preferences" not in result.failed_steps:
+            completed["preferences"] = result.new_preferences
+            completed["preferences_skipped"] = result.skipped
+        if "rules" not in completed and "rules" not in result.failed_steps:
+            completed["rules"] = result.new_rules
+        if result.errors:
+            raise PartialJobError("；".join(result.errors), {**payload, "completed": completed})
+        return LearningResult(completed["preferences"], completed["rules"],
+                              skipped=completed.get("preferences_skipped")).to_dict()
+    
+    job_queue.register("learn", handle)
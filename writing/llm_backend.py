@@ -0,0 +1,173 @@
+"""
+大模型后端模块 - AIAgent通过后端接口发出对话请求，可在火山方舟和本地替身服务之间切换
+"""
+import os
+from typing import List, Dict, Any, Optional
+
+try:
+    from volcenginesdkarkruntime import Ark, AsyncArk
+except ImportError:
+    print("请安装火山方舟SDK: pip install -U 'volcengine-python-sdk[ark]'")
+    raise
+
+from http_pool import HTTPPool
+
+DEFAULT_ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+DEFAULT_ARK_MODEL = "doubao-seed-1.6-250615"
+DEFAULT_LOCAL_BASE_URL = "http://127.0.0.1:8765/api/v3"
+DEFAULT_LOCAL_MODEL = "local-stand-in"
+
+
+class LLMBackend:
+    """
+    大模型后端接口
+    chat/achat的参数和返回值与火山方舟（OpenAI兼容）的chat.completions.create一致，
+    stream=True时返回逐块产出的流
+    """
+    
+    name = "base"
+    supports_context = False  # 是否支持服务端上下文缓存（会话历史保存在服务端，每轮只发送新增消息）
+    
+    def __init__(self, model: str, completion_params: Optional[Dict[str, Any]] = None):
+        self.model = model
+        self.completion_params = completion_params or {}
+    
+    def chat(self, messages: List[Dict[str, str]], timeout: float, model: Optional[str] = None, **kwargs):
+        """model为空时使用后端的默认模型"""
+        raise NotImplementedError
+    
+    def create_context(self, messages: List[Dict[str, str]], ttl: int, timeout: float) -> str:
+        """创建服务端会话上下文，返回上下文ID"""
+        raise NotImplementedError
+    
+    def context_chat(self, context_id: str, messages: List[Dict[str, str]], timeout: float, **kwargs):
+        """在服务端会话上下文中追加消息并生成回复，返回值与chat一致"""
+        raise NotImplementedError
+    
+    async def achat(self, messages: List[Dict[str, str]], timeout: float, model: Optional[str] = None, **kwargs):
+        raise NotImplementedError
+    
+    async def aclose(self):
+        """关闭异步客户端的HTTP连接"""
+    
+    def warm_up(self, connections: int = 1) -> Optional[Dict[str, Any]]:
+        """预先建立到模型服务的连接，返回预热结果；不需要预热的后端返回None"""
+        return None
+
+
+class ArkBackend(LLMBackend):
+    """火山方舟后端，同步请求经由进程内共享的HTTP连接池发出"""
+    
+    name = "ark"
+    supports_context = True
+    
+    def __init__(self, api_key: Optional[str] = None, model: str = DEFAULT_ARK_MODEL,
+                 base_url: Optional[str] = None, completion_params: Optional[Dict[str, Any]] = None):
+        if completion_params is None:
+            completion_params = {"thinking": {"type": "disabled"}}  # 不使用深度思考能力
+        super().__init__(model, completion_params)
+        
+        self.base_url = base_url or DEFAULT_ARK_BASE_URL
+        self.http_pool = HTTPPool.default()
+        self._client_kwargs = {
+            "api_key": api_key or os.getenv("VOLCANO_API_KEY"),
+            "base_url": self.base_url,
+            "timeout": 1800,  # 30分钟超时，实际以每一步的截止时间为准
+            "max_retries": 0,  # 重试由resilience模块统一处理
+        }
+        # 所有后端共享同一个连接池，同一进程内新建的AIAgent复用已经建立的长连接
+        self.client = Ark(http_client=self.http_pool.client(), **self._client_kwargs)
+        self._async_client = None
+    
+    @property
+    def async_client(self):
+        """异步客户端，第一次使用时才创建（连接绑定在事件循环上，不与同步客户端共享）"""
+        if self._async_client is None:
+            self._async_client = AsyncArk(http_client=self.http_pool.new_async_client(), **self._client_kwargs)
+        return self._async_client
+    
+    def chat(self, messages: List[Dict[str, str]], timeout: float, model: Optional[str] = None, **kwargs):
+        return self.client.chat.completions.create(
+            model=model or self.model,
+            messages=messages,
+            timeout=timeout,
+            **kwargs,
+            **self.completion_params
+        )
+    
+    def create_context(self, messages: List[Dict[str, str]], ttl: int, timeout: float) -> str:
+        """火山方舟上下文缓存（session模式），历史超出模型上下文时由服务端滚动截断"""
+        response = self.client.context.create(
+            model=self.model,
+            messages=messages,
+            mode="session",
+            ttl=ttl,
+            truncation_strategy={"type": "rolling_tokens", "rolling_tokens": True},
+            timeout=timeout,
+        )
+        return response.id
+    
+    def context_chat(self, context_id: str, messages: List[Dict[str, str]], timeout: float, **kwargs):
+        # 上下文对话接口没有单独的thinking等参数，放在请求体中透传
+        return self.client.context.completions.create(
+            context_id=context_id,
+            model=self.model,
+            messages=messages,
+            timeout=timeout,
+            extra_body=self.completion_params or None,
+            **kwargs
+        )
+    
+    async def achat(self, messages: List[Dict[str, str]], timeout: float, model: Optional[str] = None, **kwargs):
+        return await self.async_client.chat.completions.create(
+            model=model or self.model,
+            messages=messages,
+            timeout=timeout,
+            **kwargs,
+            **self.completion_params
+        )
+    
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+    
+    def warm_up(self, connections: int = 1) -> Optional[Dict[str, Any]]:
+        return self.http_pool.warm_up(self.base_url, connections)
+
+
+class LocalBackend(ArkBackend):
+    """
+    本地替身后端，连接local_llm_server.py启动的OpenAI兼容服务
+    无需网络和API密钥，用于压测和离线调试
+    """
+    
+    name = "local"
+    supports_context = False  # 替身服务只实现了/chat/completions，会话历史由客户端保存
+    
+    def __init__(self, base_url: Optional[str] = None, model: Optional[str] = None):
+        super().__init__(
+            api_key="local",
+            model=model or os.getenv("AI_LOCAL_MODEL", DEFAULT_LOCAL_MODEL),
+            base_url=base_url or os.getenv("AI_LOCAL_BASE_URL", DEFAULT_LOCAL_BASE_URL),
+            completion_params={},
+        )
+
+
+BACKENDS = {
+    ArkBackend.name: ArkBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """按名称创建后端，未指定时读取环境变量AI_BACKEND（默认ark）"""
+    name = name or os.getenv("AI_BACKEND", ArkBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"未知的大模型后端: {name}（可选: {', '.join(BACKENDS)}）")
+    return BACKENDS[name]()
+
+
+def needs_api_key(name: Optional[str] = None) -> bool:
+    """所选后端是否需要火山方舟API密钥（本地替身后端不需要）"""
+    return (name or os.getenv("AI_BACKEND", ArkBackend.name)) == ArkBackend.name
@@ -0,0 +1,226 @@
+"""
+本地大模型替身服务 - 兼容OpenAI/火山方舟的 /chat/completions 接口，不联网、不消耗token
+可配置首token延迟分布、输出速率和错误注入，输出内容确定，用于在本机压测Web界面和命令行
+
+用法：
+    python local_llm_server.py --port 8765 --ttft 0.8 --tokens-per-second 40 --error-rate 0.05
+    AI_BACKEND=local python web_interface.py
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+
+
+class StandInConfig:
+    """替身服务的行为配置"""
+    
+    def __init__(self, ttft: float = 0.5, ttft_sigma: float = 0.3, tokens_per_second: float = 50.0,
+                 error_rate: float = 0.0, error_status: int = 429, canned: Optional[List[Dict[str, str]]] = None,
+                 seed: Optional[int] = None):
+        self.ttft = ttft  # 首token延迟的中位数（秒）
+        self.ttft_sigma = ttft_sigma  # 首token延迟对数正态分布的sigma，0表示固定延迟
+        self.tokens_per_second = tokens_per_second  # 输出速率，0表示瞬间输出
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.canned = canned or []  # [{"contains": "...", "output": "..."}]，按顺序匹配
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def sample_ttft(self) -> float:
+        with self._lock:
+            if self.ttft_sigma <= 0:
+                return self.ttft
+            return self.ttft * self._random.lognormvariate(0, self.ttft_sigma)
+    
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def canned_output(messages: List[Dict[str, str]], canned: List[Dict[str, str]]) -> str:
+    """
+    根据请求确定性地生成输出：
+    先按canned配置匹配；要求分点输出的（学习偏好/规则）返回固定的序号列表；补丁模式返回空替换列表；
+    其余改写类请求原样返回"文案："后面的文案（多轮对话中只有指令时返回上一轮的输出），使输出长度与真实改写相近
+    """
+    prompt = messages[-1].get("content", "") if messages else ""
+    for item in canned:
+        if item["contains"] in prompt:
+            return item["output"]
+    
+    if "分点" in prompt:
+        return "1. 句子简短有力，多用短句\n2. 避免使用感叹号"
+    if '"find"' in prompt:
+        # 补丁模式的提示词：返回空替换列表，即不做修改
+        return "[]"
+    match = re.search(r"(?:^|\n)文案：(.*?)(?:\n\n|$)", prompt, re.DOTALL)
+    if match:
+        return match.group(1).strip()
+    # 多轮对话中只给出指令时，在上一轮输出的基础上"修改"，即原样返回上一轮的输出
+    for message in reversed(messages[:-1]):
+        if message.get("role") == "assistant":
+            return message.get("content", "")
+    return prompt[:200]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """处理 POST .../chat/completions"""
+    
+    protocol_version = "HTTP/1.1"
+    config: StandInConfig = StandInConfig()
+    
+    def log_message(self, format, *args):
+        # 压测时每个请求都打日志会淹没输出
+        pass
+    
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}", "code": "NotFound"}})
+            return
+        
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        config = self.config
+        
+        time.sleep(config.sample_ttft())
+        if config.should_fail():
+            self._send_json(config.error_status, {
+                "error": {"message": "本地替身服务注入的错误", "type": "injected", "code": str(config.error_status)}
+            })
+            return
+        
+        messages = request.get("messages", [])
+        text = canned_output(messages, config.canned)
+        # 本地替身按一个字一个token计
+        usage = {
+            "prompt_tokens": sum(len(m.get("content") or "") for m in messages),
+            "completion_tokens": len(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get("model", "local-stand-in")
+        
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._stream(completion_id, model, text, usage if include_usage else None)
+            return
+        
+        if config.tokens_per_second > 0:
+            time.sleep(len(text) / config.tokens_per_second)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+    
+    def _stream(self, completion_id: str, model: str, text: str, usage: Optional[Dict[str, int]]):
+        """以SSE逐块输出，每块4个字，按输出速率控制间隔"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        
+        def send(payload):
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        
+        def chunk(choices, chunk_usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+            }
+            if chunk_usage is not None:
+                payload["usage"] = chunk_usage
+            return payload
+        
+        chunk_size = 4
+        try:
+            for start in range(0, len(text), chunk_size):
+                piece = text[start:start + chunk_size]
+                send(chunk([{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}]))
+                if self.config.tokens_per_second > 0:
+                    time.sleep(len(piece) / self.config.tokens_per_second)
+            send(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if usage is not None:
+                send(chunk([], usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如超过截止时间）
+            pass
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, config: Optional[StandInConfig] = None) -> ThreadingHTTPServer:
+    """创建替身服务（未启动），可在测试中用serve_forever在后台线程运行"""
+    handler = type("ConfiguredStandInHandler", (StandInHandler,), {"config": config or StandInConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地大模型替身服务（OpenAI兼容）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.5, help="首token延迟的中位数（秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.3, help="首token延迟的对数正态sigma，0为固定延迟")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="输出速率，0为瞬间输出")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例（0-1）")
+    parser.add_argument("--error-status", type=int, default=429, help="注入错误的HTTP状态码")
+    parser.add_argument("--canned", help='固定输出配置JSON文件，形如 [{"contains": "...", "output": "..."}]')
+    parser.add_argument("--seed", type=int, help="随机种子，固定后延迟和错误序列可复现")
+    args = parser.parse_args()
+    
+    canned = None
+    if args.canned:
+        with open(args.canned, 'r', encoding='utf-8') as f:
+            canned = json.load(f)
+    
+    config = StandInConfig(
+        ttft=args.ttft,
+        ttft_sigma=args.ttft_sigma,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        canned=canned,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"本地替身服务已启动: http://{args.host}:{args.port}/api/v3")
+    print("使用方式: AI_BACKEND=local python web_interface.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
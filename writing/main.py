@@ -2,6 +2,7 @@
 文案风格个性化AI Agent - 主程序入口
 """
 import os
+import argparse
 try:
     from dotenv import load_dotenv
 except ImportError:
@@ -11,6 +12,10 @@ from data_manager import DataManager
 from ai_agent import AIAgent
 from user_interface import UserInterface
 from deduplication import DeduplicationEngine
+from resilience import LLMCallError
+from llm_backend import needs_api_key
+from speculation import Speculator, predict_selection
+from learning import learn_and_merge, SKIP_REASONS
 
 # 加载环境变量
 load_dotenv()
@@ -18,20 +23,32 @@ load_dotenv()
 class CopywritingAgent:
     """文案风格个性化AI Agent主类"""
     
-    def __init__(self):
+    def __init__(self, speculative: bool = False):
         self.data_manager = DataManager()
         self.ai_agent = AIAgent()
         self.ui = UserInterface()
         self.deduplication_engine = DeduplicationEngine()
         
+        # 推测执行：用户勾选偏好/规则期间，先按上一次的选择在后台应用
+        self.speculator = Speculator(self.ai_agent) if speculative else Speculator.from_env(self.ai_agent)
+        
+        # 本次会话内每一步大模型调用的token用量和耗时
+        self.session_metrics = self.ai_agent.metrics.start_session()
+        
         # 检查API密钥
-        if not os.getenv("VOLCANO_API_KEY"):
+        if needs_api_key() and not os.getenv("VOLCANO_API_KEY"):
             self.ui.console.print("[red]错误：未找到VOLCANO_API_KEY环境变量！[/red]")
             self.ui.console.print("请创建.env文件并设置您的火山方舟API密钥。")
             exit(1)
+        
+        # 用户输入文案期间在后台预先建立连接（AI_HTTP_WARMUP）
+        self.ai_agent.warm_up()
     
-    def run(self):
-        """运行主程序"""
+    def run(self, one_shot: bool = False):
+        """
+        运行主程序
+        one_shot为True时先选择偏好和规则，再用一次请求直接生成AI终稿
+        """
         self.ui.display_welcome()
         
         try:
@@ -39,36 +56,24 @@ class CopywritingAgent:
             user_input_text = self.ui.get_user_input_text()
             reference_texts = self.ui.get_reference_texts()
             
-            # Step 2: 生成风格化初稿
-            self.ui.console.print("[bold]正在生成风格化初稿...[/bold]")
-            draft_1 = self.ai_agent.generate_style_draft(user_input_text, reference_texts)
-            self.ui.display_draft(draft_1, "风格化初稿")
-            
-            # Step 3: 应用写作偏好
-            preferences = self.data_manager.get_user_preferences()
-            selected_preferences = self.ui.select_preferences(preferences)
-            
-            if selected_preferences:
-                self.ui.console.print("[bold]正在应用写作偏好...[/bold]")
-                draft_2 = self.ai_agent.apply_preferences(draft_1, selected_preferences)
-                self.ui.display_draft(draft_2, "应用偏好后的文案")
+            # 有风格卡片时直接使用卡片；否则参考文案过长时只保留最具代表性的段落
+            if self.ai_agent.find_style_card(reference_texts):
+                self.ui.console.print("[green]已使用保存的风格卡片代替完整参考文案。[/green]")
             else:
-                draft_2 = draft_1
-            
-            # Step 4: 应用限制规则
-            rules = self.data_manager.get_restriction_rules()
-            selected_rules = self.ui.select_rules(rules)
+                reference_budget = self.ai_agent.fit_references(reference_texts)
+                if reference_budget.truncated:
+                    self.ui.display_reference_budget(reference_budget.to_dict())
             
-            if selected_rules:
-                self.ui.console.print("[bold]正在应用限制规则...[/bold]")
-                first_final_draft = self.ai_agent.apply_restrictions(draft_2, selected_rules)
-                self.ui.display_draft(first_final_draft, "AI生成的终稿")
+            if one_shot:
+                first_final_draft = self.generate_one_shot(user_input_text, reference_texts)
             else:
-                first_final_draft = draft_2
+                first_final_draft = self.generate_step_by_step(user_input_text, reference_texts)
             
             # Step 5: 多轮对话与编辑
             current_draft = first_final_draft
             user_instructions = []
+            # 多轮修改共用一个会话，之后每轮只发送新的指令
+            edit_session = self.ai_agent.start_edit_session()
             
             while True:
                 choice = self.ui.get_edit_choice()
@@ -84,7 +89,13 @@ class CopywritingAgent:
                     instruction = self.ui.get_ai_instruction()
                     user_instructions.append(instruction)
                     self.ui.console.print("[bold]正在根据指令修改文案...[/bold]")
-                    new_version = self.ai_agent.modify_with_instruction(current_draft, instruction)
+                    try:
+                        new_version = edit_session.edit(current_draft, instruction)
+                    except LLMCallError as e:
+                        # 修改失败时保留当前文案，用户可以重试或换一种方式修改
+                        user_instructions.pop()
+                        self.ui.console.print(f"[red]{e}[/red]")
+                        continue
                     current_draft = new_version
                     self.ui.display_draft(current_draft, "AI修改后的文案")
             
@@ -100,37 +111,177 @@ class CopywritingAgent:
         except Exception as e:
             self.ui.console.print(f"[red]程序运行出错: {e}[/red]")
     
-    def learn_and_update(self, first_final_draft: str, user_confirmed_final_draft: str, user_instructions: list):
-        """学习用户偏好和规则，更新数据库"""
-        # 学习偏好
-        learned_preferences = self.ai_agent.learn_preferences(first_final_draft, user_confirmed_final_draft)
-        existing_preferences = self.data_manager.get_user_preferences()
+    def generate_step_by_step(self, user_input_text: str, reference_texts: list) -> str:
+        """逐步生成：风格化初稿 -> 应用偏好 -> 应用限制规则，返回AI终稿"""
+        # Step 2: 生成风格化初稿
+        self.ui.console.print("[bold]正在生成风格化初稿...[/bold]")
+        draft_1 = self.ai_agent.generate_style_draft(user_input_text, reference_texts)
+        self.ui.display_draft(draft_1, "风格化初稿")
+        
+        # Step 3: 应用写作偏好
+        last_selection = self.data_manager.get_last_selection()
+        preferences = self.data_manager.get_user_preferences()
+        self._speculate("preferences", draft_1, predict_selection(preferences, last_selection["preference_ids"]))
+        selected_preferences = self.ui.select_preferences(preferences)
+        self._record_selection(preference_ids=[p["id"] for p in selected_preferences])
         
-        new_preferences = []
-        for pref_description in learned_preferences:
-            if self.deduplication_engine.deduplicate_preference(pref_description, existing_preferences):
-                self.data_manager.add_user_preference(pref_description)
-                new_preferences.append(pref_description)
-                existing_preferences.append({"description": pref_description})  # 更新本地列表
+        if selected_preferences:
+            self.ui.console.print("[bold]正在应用写作偏好...[/bold]")
+            draft_2 = self._apply("preferences", draft_1, selected_preferences)
+            self.ui.display_draft(draft_2, "应用偏好后的文案")
+        else:
+            draft_2 = draft_1
         
-        # 学习规则
-        learned_rules = self.ai_agent.learn_rules(user_instructions)
-        existing_rules = self.data_manager.get_restriction_rules()
+        # Step 4: 应用限制规则
+        rules = self.data_manager.get_restriction_rules()
+        self._speculate("rules", draft_2, predict_selection(rules, last_selection["rule_ids"]))
+        selected_rules = self.ui.select_rules(rules)
+        self._record_selection(rule_ids=[r["id"] for r in selected_rules])
         
-        new_rules = []
-        for rule_instruction in learned_rules:
-            if self.deduplication_engine.deduplicate_rule(rule_instruction, existing_rules):
-                self.data_manager.add_restriction_rule(rule_instruction)
-                new_rules.append(rule_instruction)
-                existing_rules.append({"instruction": rule_instruction})  # 更新本地列表
+        if selected_rules:
+            self.ui.console.print("[bold]正在应用限制规则...[/bold]")
+            first_final_draft = self._apply("rules", draft_2, selected_rules)
+            self.ui.display_draft(first_final_draft, "AI生成的终稿")
+        else:
+            first_final_draft = draft_2
+        
+        return first_final_draft
+    
+    def _record_selection(self, preference_ids: list = None, rule_ids: list = None):
+        """开启推测执行时记录本次的选择，作为下一次推测的依据"""
+        if self.speculator is not None:
+            self.data_manager.save_last_selection(preference_ids=preference_ids, rule_ids=rule_ids)
+    
+    def _speculate(self, stage: str, draft: str, predicted_items: list):
+        """开启推测执行时，在用户勾选期间先按预测的选择在后台应用"""
+        if self.speculator is not None:
+            self.speculator.speculate(stage, draft, predicted_items)
+    
+    def _apply(self, stage: str, draft: str, selected_items: list) -> str:
+        """应用偏好或规则；选择与推测一致时直接使用推测结果"""
+        if self.speculator is not None:
+            result = self.speculator.take(stage, draft, selected_items)
+            if result is not None:
+                return result
+        if stage == "preferences":
+            return self.ai_agent.apply_preferences(draft, selected_items)
+        return self.ai_agent.apply_restrictions(draft, selected_items)
+    
+    def generate_one_shot(self, user_input_text: str, reference_texts: list) -> str:
+        """融合模式：先选择偏好和规则，再一次请求生成AI终稿"""
+        selected_preferences = self.ui.select_preferences(self.data_manager.get_user_preferences())
+        selected_rules = self.ui.select_rules(self.data_manager.get_restriction_rules())
+        self._record_selection(
+            preference_ids=[p["id"] for p in selected_preferences],
+            rule_ids=[r["id"] for r in selected_rules]
+        )
+        
+        self.ui.console.print("[bold]正在一步生成终稿...[/bold]")
+        first_final_draft = self.ai_agent.generate_final_draft(
+            user_input_text, reference_texts, selected_preferences, selected_rules
+        )
+        self.ui.display_draft(first_final_draft, "AI生成的终稿")
+        return first_final_draft
+    
+    def learn_and_update(self, first_final_draft: str, user_confirmed_final_draft: str, user_instructions: list):
+        """学习用户偏好和规则（两个请求并发执行），更新数据库"""
+        result = learn_and_merge(
+            self.ai_agent, self.data_manager, self.deduplication_engine,
+            first_final_draft, user_confirmed_final_draft, user_instructions
+        )
+        for error in result.errors:
+            self.ui.console.print(f"[red]{error}[/red]")
+        if result.skipped:
+            self.ui.console.print(f"[dim]{SKIP_REASONS[result.skipped]}，已跳过偏好学习。[/dim]")
+        new_preferences, new_rules = result.new_preferences, result.new_rules
         
         # 显示学习结果
         self.ui.display_learning_results(new_preferences, new_rules)
+        
+        # 显示本次会话的调用统计
+        self.ui.display_metrics(self.session_metrics.summary())
+
+def run_batch_command(args):
+    """batch子命令：批量生成"""
+    from batch import run_batch
+    
+    if needs_api_key() and not os.getenv("VOLCANO_API_KEY"):
+        print("错误：未找到VOLCANO_API_KEY环境变量！")
+        exit(1)
+    
+    summary = run_batch(
+        input_path=args.input,
+        output_path=args.output,
+        steps=[step.strip() for step in args.steps.split(",") if step.strip()],
+        workers=args.workers,
+        references_path=args.references,
+        preferences=args.preferences,
+        rules=args.rules,
+        resume=not args.no_resume,
+    )
+    print(f"批量生成完成：成功 {summary['succeeded']} 条，失败 {summary['failed']} 条，"
+          f"跳过已完成 {summary['skipped']} 条")
+
+def run_style_card_command(args):
+    """style-card子命令：为参考文案集合提炼并保存风格卡片"""
+    from batch import load_reference_sets
+    
+    if needs_api_key() and not os.getenv("VOLCANO_API_KEY"):
+        print("错误：未找到VOLCANO_API_KEY环境变量！")
+        exit(1)
+    
+    ai_agent = AIAgent()
+    if ai_agent.style_cards is None:
+        print("风格卡片已关闭（AI_STYLE_CARDS=off）")
+        exit(1)
+    
+    for name, texts in load_reference_sets(args.references).items():
+        if not args.force and ai_agent.find_style_card(texts):
+            print(f"跳过 {name}：已有风格卡片")
+            continue
+        try:
+            card = ai_agent.distill_style_card(texts, name=name, use_cache=not args.force)
+        except LLMCallError as e:
+            print(f"{name}: {e}")
+            continue
+        print(f"【{name}】\n{card}\n")
 
 def main():
     """主函数"""
-    agent = CopywritingAgent()
-    agent.run()
+    parser = argparse.ArgumentParser(description="文案风格个性化AI Agent")
+    parser.add_argument("--one-shot", action="store_true",
+                        help="融合模式：先选择偏好和规则，一次请求直接生成终稿")
+    parser.add_argument("--speculative", action="store_true",
+                        help="推测执行：勾选偏好/规则期间先按上一次的选择在后台应用（也可设置AI_SPECULATIVE=1）")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    batch_parser = subparsers.add_parser("batch", help="从JSONL文件批量生成文案")
+    batch_parser.add_argument("--input", required=True, help="输入JSONL，每行包含id、text和references/reference_set")
+    batch_parser.add_argument("--output", required=True, help="输出JSONL，按完成顺序写入")
+    batch_parser.add_argument("--references", help="参考文案集合JSONL，每行形如 {\"name\": ..., \"texts\": [...]}")
+    batch_parser.add_argument("--steps", default="style,preferences,rules",
+                              help="逗号分隔的步骤：style、preferences、rules，或单独使用one_shot")
+    batch_parser.add_argument("--preferences", help="要应用的偏好：all 或逗号分隔的偏好id")
+    batch_parser.add_argument("--rules", help="要应用的规则：all 或逗号分隔的规则id")
+    batch_parser.add_argument("--workers", type=int, default=8, help="并发数")
+    batch_parser.add_argument("--no-resume", action="store_true", help="覆盖输出文件，不从中断处继续")
+    
+    card_parser = subparsers.add_parser("style-card", help="为参考文案集合提炼并保存风格卡片")
+    card_parser.add_argument("--references", required=True,
+                             help="参考文案集合JSONL，每行形如 {\"name\": ..., \"texts\": [...]}")
+    card_parser.add_argument("--force", action="store_true", help="已有风格卡片时重新提炼")
+    
+    args = parser.parse_args()
+    
+    if args.command == "batch":
+        run_batch_command(args)
+        return
+    if args.command == "style-card":
+        run_style_card_command(args)
+        return
+    
+    agent = CopywritingAgent(speculative=args.speculative)
+    agent.run(one_shot=args.one_shot)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+"""
+指标模块 - 记录每一步大模型调用的token用量和耗时，进程内汇总，并可按会话（一次Web请求或一次命令行流程）收集
+"""
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict, deque
+from typing import List, Dict, Any, Optional
+
+# 当前上下文中的会话收集器；Web每个请求、命令行每次运行各自一个
+_current_session: contextvars.ContextVar = contextvars.ContextVar("metrics_session", default=None)
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+class MetricsSession:
+    """一次会话内的调用记录"""
+    
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+    
+    def add(self, record: Dict[str, Any]):
+        with self._lock:
+            self.records.append(record)
+    
+    def summary(self) -> Dict[str, Any]:
+        """按步骤汇总本次会话的调用，附带逐次调用明细"""
+        with self._lock:
+            records = list(self.records)
+        
+        steps = {}
+        for record in records:
+            step = steps.setdefault(record["step"], {
+                "calls": 0, "cached": 0, "coalesced": 0, "errors": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "wall_time": 0.0,
+            })
+            step["calls"] += 1
+            step["cached"] += int(record["cached"])
+            step["coalesced"] += int(record["coalesced"])
+            step["errors"] += int(record["error"])
+            step["prompt_tokens"] += record["prompt_tokens"]
+            step["completion_tokens"] += record["completion_tokens"]
+            step["wall_time"] = round(step["wall_time"] + record["wall_time"], 3)
+        
+        return {
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "completion_tokens": sum(r["completion_tokens"] for r in records),
+            "wall_time": round(sum(r["wall_time"] for r in records), 3),
+            "steps": steps,
+            "calls": records,
+        }
+
+
+class MetricsRegistry:
+    """
+    进程内指标汇总
+    record()把一次调用计入全局按步骤的统计，同时追加到当前上下文的会话中
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, max_samples: int = 500):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {
+            "calls": 0, "cached": 0, "coalesced": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        })
+        self._wall_times = defaultdict(lambda: deque(maxlen=max_samples))
+        self._ttfts = defaultdict(lambda: deque(maxlen=max_samples))
+    
+    @classmethod
+    def default(cls) -> "MetricsRegistry":
+        """进程内共享的指标汇总"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+    
+    def record(self, step: str, prompt_tokens: int = 0, completion_tokens: int = 0, wall_time: float = 0.0,
+               ttft: Optional[float] = None, cached: bool = False, error: bool = False,
+               coalesced: bool = False):
+        """
+        记录一次调用；缓存命中也会记录（token为0），便于看出缓存省下了多少时间
+        coalesced表示合并到了相同的进行中请求，没有单独调用模型（token为0）
+        """
+        record = {
+            "step": step,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "wall_time": round(wall_time, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "cached": cached,
+            "coalesced": coalesced,
+            "error": error,
+        }
+        
+        with self._lock:
+            totals = self._totals[step]
+            totals["calls"] += 1
+            totals["cached"] += int(cached)
+            totals["coalesced"] += int(coalesced)
+            totals["errors"] += int(error)
+            totals["prompt_tokens"] += record["prompt_tokens"]
+            totals["completion_tokens"] += record["completion_tokens"]
+            # 延迟分位数只统计真正发出的成功请求
+            if not cached and not coalesced and not error:
+                self._wall_times[step].append(wall_time)
+                if ttft is not None:
+                    self._ttfts[step].append(ttft)
+        
+        session = _current_session.get()
+        if session is not None:
+            session.add(record)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """按步骤返回累计调用次数、token用量和延迟分位数"""
+        with self._lock:
+            steps = {}
+            for step, totals in self._totals.items():
+                wall_times = list(self._wall_times[step])
+                ttfts = list(self._ttfts[step])
+                steps[step] = {
+                    **totals,
+                    "wall_time_avg": round(sum(wall_times) / len(wall_times), 3) if wall_times else 0.0,
+                    "wall_time_p50": round(_percentile(wall_times, 0.5), 3),
+                    "wall_time_p95": round(_percentile(wall_times, 0.95), 3),
+                    "ttft_avg": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+                }
+        return {"steps": steps}
+    
+    def start_session(self) -> MetricsSession:
+        """在当前上下文中开始一个新会话，之后的调用都会记入该会话"""
+        session = MetricsSession()
+        _current_session.set(session)
+        return session
+    
+    @contextmanager
+    def session(self, session: Optional[MetricsSession] = None):
+        """在with块内收集调用记录（可指定收集到已有的会话），退出后恢复原来的会话"""
+        session = session or MetricsSession()
+        token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(token)
+    
+    def current_session(self) -> Optional[MetricsSession]:
+        """当前上下文中的会话，没有时返回None"""
+        return _current_session.get()
+    
+    def attach(self, records: MetricsSession, session: Optional[MetricsSession] = None):
+        """把另一个会话（如后台推测执行）中已完成的调用并入session（默认为当前会话），不重复计入全局统计"""
+        session = session or _current_session.get()
+        if session is not None and session is not records:
+            for record in records.summary()["calls"]:
+                session.add(record)
+
+
+def usage_tokens(usage) -> Dict[str, int]:
+    """从响应的usage中取出prompt/completion token数，缺失时为0"""
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
@@ -0,0 +1,100 @@
+"""
+模型路由模块 - 按生成步骤选择模型、超时和最大输出长度
+学习偏好、学习规则这类简短的提取任务可以交给更快更便宜的模型，生成和改写仍使用主模型；
+某一步超时后可以改用备用模型再试一次
+"""
+import os
+import json
+import threading
+from typing import Dict, Any, Optional
+
+# 补丁、分段等派生步骤没有单独配置时沿用对应主步骤的路由
+PARENT_STEPS = {
+    "restrictions_patch": "restrictions",
+    "restrictions_chunk": "restrictions",
+    "preferences_chunk": "preferences",
+    "instruction_patch": "instruction_edit",
+}
+
+
+class StepRoute:
+    """一个步骤的路由：模型ID、超时秒数、最大输出token数和超时后的备用模型，未设置的项使用默认值"""
+    
+    def __init__(self, model: Optional[str] = None, timeout: Optional[float] = None,
+                 max_tokens: Optional[int] = None, fallback_model: Optional[str] = None):
+        self.model = model
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self.fallback_model = fallback_model
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StepRoute":
+        return cls(
+            model=data.get("model"),
+            timeout=float(data["timeout"]) if data.get("timeout") else None,
+            max_tokens=int(data["max_tokens"]) if data.get("max_tokens") else None,
+            fallback_model=data.get("fallback_model"),
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "timeout": self.timeout,
+            "max_tokens": self.max_tokens,
+            "fallback_model": self.fallback_model,
+        }
+
+
+class ModelRouter:
+    """
+    步骤 -> 路由的对照表
+    查找顺序：步骤本身、PARENT_STEPS中的主步骤、"default"，都没有时使用后端的默认模型和全局步骤超时
+    """
+    
+    def __init__(self, routes: Optional[Dict[str, StepRoute]] = None):
+        self.routes = routes or {}
+        self._lock = threading.Lock()
+        self._fallbacks: Dict[str, int] = {}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, Any]]) -> "ModelRouter":
+        return cls({step: StepRoute.from_dict(route) for step, route in data.items()})
+    
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        环境变量AI_MODEL_ROUTES为路由表JSON文件的路径，或直接写JSON，如
+        {"learn_rules": {"model": "doubao-seed-1.6-flash-250615", "timeout": 30, "max_tokens": 512}}
+        未设置时所有步骤使用默认模型
+        """
+        value = os.getenv("AI_MODEL_ROUTES", "").strip()
+        if not value:
+            return cls()
+        try:
+            if value.startswith("{"):
+                data = json.loads(value)
+            else:
+                with open(value, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取模型路由表失败，所有步骤使用默认模型: {e}")
+            return cls()
+        return cls.from_dict(data)
+    
+    def route(self, step: str) -> StepRoute:
+        for key in (step, PARENT_STEPS.get(step), "default"):
+            if key and key in self.routes:
+                return self.routes[key]
+        return StepRoute()
+    
+    def record_fallback(self, step: str):
+        with self._lock:
+            self._fallbacks[step] = self._fallbacks.get(step, 0) + 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            fallbacks = dict(self._fallbacks)
+        return {
+            "routes": {step: route.to_dict() for step, route in self.routes.items()},
+            "fallbacks": fallbacks,
+        }
@@ -0,0 +1,82 @@
+"""
+补丁模块 - 局部修改时让模型只输出"原片段 -> 新片段"的替换列表，在本地校验并应用，输出长度与改动大小相关而不是与全文长度相关
+"""
+import os
+import re
+import json
+import threading
+from typing import List, Dict, Any, Optional
+
+_JSON_BLOCK_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+def parse_patches(content: str) -> Optional[List[Dict[str, str]]]:
+    """
+    解析模型输出的替换列表 [{"find": "...", "replace": "..."}]，允许包在```json代码块中
+    格式不对时返回None
+    """
+    match = _JSON_BLOCK_PATTERN.search(content)
+    text = match.group(1) if match else content
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        patches = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    
+    if not isinstance(patches, list):
+        return None
+    for patch in patches:
+        if not isinstance(patch, dict) or not isinstance(patch.get("find"), str) \
+                or not isinstance(patch.get("replace"), str) or not patch["find"]:
+            return None
+    return patches
+
+
+def apply_patches(draft: str, patches: List[Dict[str, str]]) -> Optional[str]:
+    """
+    依次应用替换；每个原片段必须在当前文本中恰好出现一次，否则无法确定改哪里，返回None
+    """
+    text = draft
+    for patch in patches:
+        if text.count(patch["find"]) != 1:
+            return None
+        text = text.replace(patch["find"], patch["replace"], 1)
+    return text
+
+
+class PatchMode:
+    """
+    补丁模式的开关和统计
+    mode为on时所有根据指令修改和应用限制规则都使用补丁；auto时只对不少于min_chars个字的文案使用
+    （短文案整篇重写也很快）；off关闭
+    """
+    
+    def __init__(self, mode: str = "off", min_chars: int = 400):
+        self.mode = mode
+        self.min_chars = min_chars
+        self._lock = threading.Lock()
+        self._stats = {"applied": 0, "fallback": 0}
+    
+    @classmethod
+    def from_env(cls) -> "PatchMode":
+        """读取环境变量AI_PATCH_MODE（off/on/auto，默认off）和AI_PATCH_MIN_CHARS（默认400）"""
+        return cls(os.getenv("AI_PATCH_MODE", "off"), int(os.getenv("AI_PATCH_MIN_CHARS", "400")))
+    
+    def applies_to(self, draft: str) -> bool:
+        if self.mode == "on":
+            return True
+        return self.mode == "auto" and len(draft) >= self.min_chars
+    
+    def record(self, applied: bool):
+        with self._lock:
+            self._stats["applied" if applied else "fallback"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["applied"] + stats["fallback"]
+        stats["mode"] = self.mode
+        stats["fallback_rate"] = stats["fallback"] / total if total else 0.0
+        return stats
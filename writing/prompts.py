@@ -0,0 +1,338 @@
+"""
+提示词模块 - 构建各个生成步骤发送给大模型的消息列表
+"""
+import re
+from typing import List, Dict, Any, Optional
+
+from text_diff import compact_diff
+
+
+def build_style_draft_messages(user_input_text: str, reference_texts: List[str]) -> List[Dict[str, str]]:
+    """Step 1: 风格化初稿的消息列表"""
+    reference_texts_str = "\n\n".join(reference_texts)
+    
+    prompt = f"""请结合示例的整体节奏、语气，优化所给文案。
+
+文案：{user_input_text}
+
+示例：{reference_texts_str}
+
+请生成一篇风格化的初稿，保持示例的写作风格和语调。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案优化助手，擅长学习和模仿不同的写作风格。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_style_card_messages(reference_texts: List[str]) -> List[Dict[str, str]]:
+    """提炼风格卡片的消息列表：把一组参考文案浓缩为简短的风格描述"""
+    reference_texts_str = "\n\n".join(reference_texts)
+    
+    prompt = f"""请分析以下示例文案的写作风格，提炼成一张简洁的"风格卡片"，供之后模仿该风格改写文案使用。
+
+示例：{reference_texts_str}
+
+风格卡片需包括：整体语气与情绪、句子长短与节奏、常用词汇和修辞、标点与排版习惯、段落结构，并附上2-3个最能体现风格的原文短句。
+只描述风格，不要复述示例的具体内容，总字数不超过300字。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的写作风格分析师，擅长用简洁准确的语言概括文案风格。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_style_draft_from_card_messages(user_input_text: str, style_card: str) -> List[Dict[str, str]]:
+    """Step 1: 使用已保存的风格卡片代替完整参考文案生成风格化初稿"""
+    prompt = f"""请按照风格卡片描述的整体节奏、语气，优化所给文案。
+
+文案：{user_input_text}
+
+风格卡片：
+{style_card}
+
+请生成一篇风格化的初稿，保持风格卡片所描述的写作风格和语调。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案优化助手，擅长学习和模仿不同的写作风格。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_preferences_messages(draft: str, selected_preferences: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Step 2: 应用写作偏好的消息列表"""
+    preferences_text = "\n".join([f"- {pref['description']}" for pref in selected_preferences])
+    
+    prompt = f"""根据文本修改要求，帮我修改所给文案。
+
+文案：{draft}
+
+文本修改要求：
+{preferences_text}
+
+请根据这些要求修改文案，保持内容的完整性。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的写作偏好调整文案风格。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_restrictions_messages(draft: str, selected_rules: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Step 3: 应用限制规则的消息列表"""
+    rules_text = "\n".join([f"- {rule['instruction']}" for rule in selected_rules])
+    
+    prompt = f"""根据要求，帮我修改所给文案。
+
+文案：{draft}
+
+要求：
+{rules_text}
+
+请严格按照这些要求修改文案。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够严格按照用户的要求调整文案。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_instruction_messages(draft: str, instruction: str) -> List[Dict[str, str]]:
+    """Step 4: 根据指令修改的消息列表"""
+    prompt = f"""请根据以下指令修改文案：
+
+文案：{draft}
+
+指令：{instruction}
+
+请根据指令修改文案。"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的详细指令调整文案。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _chunk_prompt(chunk: str, requirements_text: str, before: str, after: str, closing: str) -> str:
+    """长文案分段处理时每一块的提示词：前后文只供参考，只输出修改后的这一部分"""
+    context = ""
+    if before:
+        context += f"\n\n前文（仅供参考，不要输出）：……{before}"
+    if after:
+        context += f"\n\n后文（仅供参考，不要输出）：{after}……"
+    return f"""以下是一篇长文案中的一部分，请根据要求修改这一部分，注意与前后文衔接自然。{context}
+
+文案：{chunk}
+
+要求：
+{requirements_text}
+
+{closing}只输出修改后的这一部分文案。"""
+
+
+def build_preferences_chunk_messages(chunk: str, selected_preferences: List[Dict[str, Any]],
+                                     before: str = "", after: str = "") -> List[Dict[str, str]]:
+    """Step 2（分段）: 对长文案的一块应用写作偏好"""
+    preferences_text = "\n".join([f"- {pref['description']}" for pref in selected_preferences])
+    prompt = _chunk_prompt(chunk, preferences_text, before, after, "请根据这些要求修改文案，保持内容的完整性。")
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的写作偏好调整文案风格。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_restrictions_chunk_messages(chunk: str, selected_rules: List[Dict[str, Any]],
+                                      before: str = "", after: str = "") -> List[Dict[str, str]]:
+    """Step 3（分段）: 对长文案的一块应用限制规则"""
+    rules_text = "\n".join([f"- {rule['instruction']}" for rule in selected_rules])
+    prompt = _chunk_prompt(chunk, rules_text, before, after, "请严格按照这些要求修改文案。")
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够严格按照用户的要求调整文案。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+PATCH_OUTPUT_FORMAT = """只输出需要修改的地方，不要输出整篇文案。输出一个JSON数组，每一项为一处替换：
+[{"find": "原文中需要修改的片段", "replace": "修改后的片段"}]
+find必须从原文中原样复制，并且足够长、在原文中只出现一次；不需要修改时输出 []。除JSON数组外不要输出任何内容。"""
+
+
+def build_patch_instruction_messages(draft: str, instruction: str) -> List[Dict[str, str]]:
+    """Step 4（补丁模式）: 根据指令修改，只输出替换列表"""
+    prompt = f"""请根据以下指令修改文案：
+
+文案：{draft}
+
+指令：{instruction}
+
+{PATCH_OUTPUT_FORMAT}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够根据用户的详细指令对文案做局部修改。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_patch_restrictions_messages(draft: str, selected_rules: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Step 3（补丁模式）: 应用限制规则，只输出替换列表"""
+    rules_text = "\n".join([f"- {rule['instruction']}" for rule in selected_rules])
+    
+    prompt = f"""根据要求，帮我修改所给文案。
+
+文案：{draft}
+
+要求：
+{rules_text}
+
+请严格按照这些要求修改文案。{PATCH_OUTPUT_FORMAT}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够严格按照用户的要求对文案做局部修改。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_rule_repair_messages(draft: str, violations: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """生成后检查发现违反规则时的修正：只列出违反的规则和具体问题，输出替换列表"""
+    problems_text = "\n".join(
+        [f"- {v['instruction']}（{v['message']}）" if v.get("instruction") else f"- {v['message']}" for v in violations]
+    )
+    
+    prompt = f"""以下文案没有完全符合用户的要求，请只修正下列问题，不要改动其他内容。
+
+文案：{draft}
+
+问题：
+{problems_text}
+
+{PATCH_OUTPUT_FORMAT}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案修改助手，能够严格按照用户的要求对文案做局部修改。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_consistency_messages(draft: str) -> List[Dict[str, str]]:
+    """分段处理后的衔接检查：只修正段落衔接、称谓和用词前后不一致的地方，输出替换列表"""
+    prompt = f"""以下文案由几部分分别修改后拼接而成。请检查各部分之间的衔接是否自然，称谓、用词和语气是否前后一致，只修正这类问题，不要改动其他内容。
+
+文案：{draft}
+
+{PATCH_OUTPUT_FORMAT}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的文案编辑，负责统稿，保证全文前后一致。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+EDIT_SESSION_SYSTEM_PROMPT = "你是一个专业的文案修改助手，能够根据用户的详细指令调整文案。用户会逐条给出修改指令，每次只输出修改后的完整文案。"
+
+
+def build_edit_session_turn(instruction: str, draft: Optional[str] = None) -> Dict[str, str]:
+    """
+    多轮修改会话中一轮的用户消息
+    会话第一轮或用户手动改过文案时附上当前文案，否则只发送指令，在上一轮输出的基础上修改
+    """
+    if draft is not None:
+        content = f"""请根据以下指令修改文案：
+
+文案：{draft}
+
+指令：{instruction}
+
+请根据指令修改文案。"""
+    else:
+        content = f"""指令：{instruction}
+
+请在上一版文案的基础上根据指令修改，输出完整文案。"""
+    return {"role": "user", "content": content}
+
+
+def build_learn_preferences_messages(original_draft: str, user_modified_draft: str,
+                                     use_diff: bool = True) -> List[Dict[str, str]]:
+    """
+    Step 5: 学习写作偏好的消息列表
+    轻度修改时只发送改动片段（带少量上下文），大幅重写时发送完整的前后文本
+    """
+    hunks = compact_diff(original_draft, user_modified_draft) if use_diff else None
+    if hunks:
+        changes_text = "\n\n".join(
+            f"改动{i}：\n原片段：{hunk['original']}\n改为：{hunk['modified']}"
+            for i, hunk in enumerate(hunks, 1)
+        )
+        prompt = f"""以下是作者对一篇文案的改动，每处给出改动前后的片段（含少量上下文），未列出的部分没有改动。
+
+请总结出1-3条作者的写作风格偏好。你的输出必须是清晰的序号分点列表（如：1. ... 2. ...）。每一条都应是独立、可执行的描述。
+
+{changes_text}"""
+    else:
+        prompt = f"""分析"原文本"和"作者改动后的文本"的差异。
+
+请总结出1-3条作者的写作风格偏好。你的输出必须是清晰的序号分点列表（如：1. ... 2. ...）。每一条都应是独立、可执行的描述。
+
+原文本：{original_draft}
+
+作者改动后的文本：{user_modified_draft}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的写作风格分析师，能够从文本修改中识别出作者的写作偏好。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_learn_rules_messages(user_instructions: List[str]) -> List[Dict[str, str]]:
+    """Step 5: 学习通用规则的消息列表"""
+    instructions_text = "\n".join([f"- {instruction}" for instruction in user_instructions])
+    
+    prompt = f"""以下是用户对文案的修改意见。判断其中哪些是通用规则，而非对内容细节的意见。总结并分点输出其中通用规则，要求语言精简。
+
+用户意见：
+{instructions_text}"""
+
+    return [
+        {"role": "system", "content": "你是一个专业的规则提取器，能够从用户的修改意见中识别出通用的写作规则。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_one_shot_messages(user_input_text: str, reference_texts: List[str],
+                            selected_preferences: List[Dict[str, Any]],
+                            selected_rules: List[Dict[str, Any]],
+                            style_card: Optional[str] = None) -> List[Dict[str, str]]:
+    """融合模式: 风格化、偏好和限制规则合并为一次请求的消息列表；有风格卡片时用它代替示例"""
+    if style_card:
+        sections = [
+            "请按照风格卡片描述的整体节奏、语气，优化所给文案，并同时满足下列全部要求。",
+            f"文案：{user_input_text}",
+            f"风格卡片：\n{style_card}",
+        ]
+    else:
+        reference_texts_str = "\n\n".join(reference_texts)
+        sections = [
+            "请结合示例的整体节奏、语气，优化所给文案，并同时满足下列全部要求。",
+            f"文案：{user_input_text}",
+            f"示例：{reference_texts_str}",
+        ]
+    if selected_preferences:
+        preferences_text = "\n".join([f"- {pref['description']}" for pref in selected_preferences])
+        sections.append(f"写作偏好：\n{preferences_text}")
+    if selected_rules:
+        rules_text = "\n".join([f"- {rule['instruction']}" for rule in selected_rules])
+        sections.append(f"限制要求（必须严格遵守）：\n{rules_text}")
+    style_source = "风格卡片所描述的" if style_card else "示例的"
+    sections.append(f"请直接输出最终文案，保持{style_source}写作风格和语调，保持内容的完整性。")
+    
+    return [
+        {"role": "system", "content": "你是一个专业的文案优化助手，擅长模仿不同的写作风格，并能严格按照用户的偏好和要求调整文案。"},
+        {"role": "user", "content": "\n\n".join(sections)}
+    ]
+
+
+def parse_numbered_list(content: str) -> List[str]:
+    """从AI输出中提取序号分点列表（如：1. ... 2. ...）"""
+    # 使用正则表达式提取序号列表
+    pattern = r'\d+\.\s*(.+?)(?=\n\d+\.|\n\n|$)'
+    matches = re.findall(pattern, content, re.DOTALL)
+    return [match.strip() for match in matches if match.strip()]
@@ -0,0 +1,239 @@
+"""
+限流模块 - 客户端令牌桶限流（每分钟请求数/每分钟token数）和AIMD自适应并发控制
+"""
+import os
+import time
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List
+
+from resilience import Deadline, is_timeout
+from reference_budget import estimate_text_tokens
+
+try:
+    from volcenginesdkarkruntime._exceptions import ArkRateLimitError
+except ImportError:
+    ArkRateLimitError = None
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    粗略估算一次请求消耗的token数（提示词加上大致等长的输出）
+    只用于限流预占，请求完成后按实际用量校正
+    """
+    prompt_tokens = sum(estimate_text_tokens(message.get("content") or "") for message in messages)
+    return max(1, prompt_tokens * 2)
+
+
+def is_throttled(error: BaseException) -> bool:
+    """是否为服务端限流（429）"""
+    if ArkRateLimitError is not None and isinstance(error, ArkRateLimitError):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+class RateLimitTimeoutError(TimeoutError):
+    """在截止时间内没有等到限流配额"""
+
+
+class TokenBucket:
+    """令牌桶，按每分钟速率匀速补充，容量为一分钟的配额"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def wait_time(self, amount: float) -> float:
+        """取得amount个令牌还需等待的秒数，0表示现在即可取得"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+    
+    def adjust(self, delta: float):
+        """按实际用量校正，delta为正表示多用了，余额可以暂时为负"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class Permit:
+    """一次请求取得的配额，请求结束后交还给限流器"""
+    
+    def __init__(self, estimated_tokens: int):
+        self.estimated_tokens = estimated_tokens
+        self.started_at = time.monotonic()
+        self.released = False
+
+
+class RateLimiter:
+    """
+    端点级限流器，同一进程内所有AIAgent、Web请求和批量任务共享
+    - requests_per_minute / tokens_per_minute：令牌桶限流，不设置则不限制
+    - 并发数按AIMD调整：请求成功且延迟健康时缓慢增加，遇到429或延迟超标时减半
+    """
+    
+    _registry: Dict[str, "RateLimiter"] = {}
+    _registry_lock = threading.Lock()
+    
+    # 等待配额时的轮询间隔（秒）
+    POLL_INTERVAL = 0.02
+    # 两次减半之间至少间隔的秒数，避免同一波429把并发数连续砍到底
+    DECREASE_COOLDOWN = 1.0
+    
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 initial_concurrency: int = 8, min_concurrency: int = 1, max_concurrency: int = 32,
+                 latency_target: Optional[float] = None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.latency_target = latency_target
+        
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "throttled": 0,
+            "wait_seconds": 0.0,
+            "increases": 0,
+            "decreases": 0,
+        }
+    
+    @classmethod
+    def for_endpoint(cls, endpoint: str) -> "RateLimiter":
+        """同一进程内同一个模型端点共享一个限流器，参数从环境变量读取"""
+        with cls._registry_lock:
+            if endpoint not in cls._registry:
+                cls._registry[endpoint] = cls.from_env()
+            return cls._registry[endpoint]
+    
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        def number(name):
+            value = os.getenv(name)
+            return float(value) if value else None
+        
+        max_concurrency = int(os.getenv("AI_MAX_CONCURRENCY", "32"))
+        return cls(
+            requests_per_minute=number("AI_RATE_LIMIT_RPM"),
+            tokens_per_minute=number("AI_RATE_LIMIT_TPM"),
+            initial_concurrency=min(8, max_concurrency),
+            max_concurrency=max_concurrency,
+            latency_target=number("AI_LATENCY_TARGET"),
+        )
+    
+    def _try_acquire(self, estimated_tokens: int) -> float:
+        """尝试取得配额；成功返回0，否则返回建议的等待秒数"""
+        with self._lock:
+            if self.in_flight >= int(self.concurrency_limit):
+                return self.POLL_INTERVAL
+            wait_for = 0.0
+            if self.request_bucket:
+                wait_for = max(wait_for, self.request_bucket.wait_time(1))
+            if self.token_bucket:
+                wait_for = max(wait_for, self.token_bucket.wait_time(estimated_tokens))
+            if wait_for > 0:
+                return wait_for
+            
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            self._stats["requests"] += 1
+            return 0.0
+    
+    def acquire(self, estimated_tokens: int, deadline: Deadline) -> Permit:
+        """阻塞直到取得配额，截止时间内取不到则抛出RateLimitTimeoutError"""
+        started = time.monotonic()
+        while True:
+            wait_for = self._try_acquire(estimated_tokens)
+            if wait_for == 0:
+                break
+            if wait_for >= deadline.remaining():
+                raise RateLimitTimeoutError("等待限流配额超时")
+            time.sleep(min(wait_for, self.POLL_INTERVAL * 5))
+        self._record_wait(time.monotonic() - started)
+        return Permit(estimated_tokens)
+    
+    async def acquire_async(self, estimated_tokens: int, deadline: Deadline) -> Permit:
+        """acquire的协程版本，等待时不阻塞事件循环"""
+        started = time.monotonic()
+        while True:
+            wait_for = self._try_acquire(estimated_tokens)
+            if wait_for == 0:
+                break
+            if wait_for >= deadline.remaining():
+                raise RateLimitTimeoutError("等待限流配额超时")
+            await asyncio.sleep(min(wait_for, self.POLL_INTERVAL * 5))
+        self._record_wait(time.monotonic() - started)
+        return Permit(estimated_tokens)
+    
+    def _record_wait(self, seconds: float):
+        with self._lock:
+            self._stats["wait_seconds"] += seconds
+    
+    def release(self, permit: Permit, total_tokens: Optional[int] = None, error: Optional[BaseException] = None):
+        """
+        交还配额并调整并发上限
+        total_tokens为实际用量时按差额校正token桶；error为本次请求的异常（成功时为None）
+        """
+        with self._lock:
+            if permit.released:
+                return
+            permit.released = True
+            self.in_flight -= 1
+            
+            if self.token_bucket and total_tokens is not None:
+                self.token_bucket.adjust(total_tokens - permit.estimated_tokens)
+            
+            latency = time.monotonic() - permit.started_at
+            if error is not None and is_throttled(error):
+                self._stats["throttled"] += 1
+                self._decrease()
+            elif (error is not None and is_timeout(error)) or (
+                    error is None and self.latency_target and latency > self.latency_target):
+                self._decrease()
+            elif error is None:
+                # 加性增加：每个并发窗口内全部成功，上限大约加一
+                if self.concurrency_limit < self.max_concurrency:
+                    self.concurrency_limit = min(self.max_concurrency,
+                                                 self.concurrency_limit + 1.0 / self.concurrency_limit)
+                    self._stats["increases"] += 1
+    
+    def _decrease(self):
+        """乘性减少（调用方已持有锁）"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2)
+        self._stats["decreases"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self.in_flight
+            stats["concurrency_limit"] = int(self.concurrency_limit)
+            if self.request_bucket:
+                self.request_bucket._refill()
+                stats["request_tokens_available"] = round(self.request_bucket.tokens, 1)
+            if self.token_bucket:
+                self.token_bucket._refill()
+                stats["tpm_tokens_available"] = round(self.token_bucket.tokens, 1)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return stats
@@ -0,0 +1,187 @@
+"""
+参考文案预算模块 - 本地估算token数，参考文案超出预算时按n-gram统计挑选最能代表整体风格的段落
+"""
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional
+
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['\-][A-Za-z0-9]+)*")
+_SYMBOL_PATTERN = re.compile(r"[^\sA-Za-z0-9\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\.\n]+[。！？!?\.]*")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    本地粗略估算token数：汉字约1个token，英文单词约1.3个token，标点符号约1个token
+    偏保守，只用于预算和限流，不追求与服务端计数完全一致
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    words = len(_WORD_PATTERN.findall(text))
+    symbols = len(_SYMBOL_PATTERN.findall(text))
+    return cjk + math.ceil(words * 1.3) + symbols
+
+
+def _ngrams(text: str, n: int) -> Counter:
+    """字符n-gram（去掉空白），中英文混排都适用"""
+    compact = re.sub(r"\s+", "", text)
+    if len(compact) < n:
+        return Counter([compact]) if compact else Counter()
+    return Counter(compact[i:i + n] for i in range(len(compact) - n + 1))
+
+
+def _leave_one_out_cosine(unit: Counter, overall: Counter, overall_sq: int) -> float:
+    """
+    unit与(overall - unit)的余弦相似度，不构造差集：
+    dot(u, o-u) = dot(u, o) - |u|²，|o-u|² = |o|² - 2·dot(u, o) + |u|²，只需遍历unit自身的n-gram
+    """
+    if not unit:
+        return 0.0
+    dot = sum(count * overall[gram] for gram, count in unit.items())
+    unit_sq = sum(count * count for count in unit.values())
+    rest_sq = overall_sq - 2 * dot + unit_sq
+    norm = math.sqrt(unit_sq * rest_sq) if rest_sq > 0 else 0.0
+    return (dot - unit_sq) / norm if norm else 0.0
+
+
+class BudgetResult:
+    """预算结果：保留的参考文案、前后token数和被删去的段落"""
+    
+    def __init__(self, texts: List[str], original_tokens: int, kept_tokens: int,
+                 dropped: Optional[List[Dict[str, Any]]] = None):
+        self.texts = texts
+        self.original_tokens = original_tokens
+        self.kept_tokens = kept_tokens
+        self.dropped = dropped or []
+    
+    @property
+    def truncated(self) -> bool:
+        return bool(self.dropped)
+    
+    def summary(self) -> str:
+        """一句话说明删减情况"""
+        if not self.truncated:
+            return f"参考文案约{self.original_tokens}个token，未超出预算"
+        return (f"参考文案约{self.original_tokens}个token，超出预算，保留最具代表性的段落约{self.kept_tokens}个token，"
+                f"删去{len(self.dropped)}段")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "truncated": self.truncated,
+            "original_tokens": self.original_tokens,
+            "kept_tokens": self.kept_tokens,
+            "dropped": self.dropped,
+            "summary": self.summary(),
+        }
+
+
+class ReferenceBudget:
+    """
+    参考文案预算
+    总token数不超过max_tokens时原样返回；超出时把参考文案切成段落（过长的段落再切成句子），
+    按各段落的字符n-gram分布与其余全部参考文案的相似度打分，相似度越高越能代表整体风格。
+    先保证每篇参考文案至少保留得分最高的一段，再按得分从高到低填满预算，保留的段落按原文顺序拼回
+    """
+    
+    def __init__(self, max_tokens: int = 3000, ngram: int = 2, max_entries: int = 32):
+        self.max_tokens = max_tokens
+        self.ngram = ngram
+        # 同一组参考文案在一次请求中会被多次取用（生成消息、返回删减说明），结果按参考文案缓存
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_env(cls) -> Optional["ReferenceBudget"]:
+        """读取环境变量AI_REFERENCE_TOKEN_BUDGET（默认3000），设置为0表示不限制"""
+        max_tokens = int(os.getenv("AI_REFERENCE_TOKEN_BUDGET", "3000"))
+        return cls(max_tokens) if max_tokens > 0 else None
+    
+    def _split(self, text: str) -> List[str]:
+        """切分为段落；单段超过预算一半时继续切成句子"""
+        units = []
+        for paragraph in re.split(r"\n\s*\n|\n", text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if estimate_text_tokens(paragraph) > self.max_tokens // 2:
+                units.extend(s.strip() for s in _SENTENCE_PATTERN.findall(paragraph) if s.strip())
+            else:
+                units.append(paragraph)
+        return units
+    
+    def fit(self, reference_texts: List[str]) -> BudgetResult:
+        key = hashlib.sha256("\x00".join(reference_texts).encode("utf-8")).hexdigest()
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+        
+        result = self._fit(reference_texts)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+    
+    def _fit(self, reference_texts: List[str]) -> BudgetResult:
+        original_tokens = sum(estimate_text_tokens(text) for text in reference_texts)
+        if original_tokens <= self.max_tokens:
+            return BudgetResult(list(reference_texts), original_tokens, original_tokens)
+        
+        # 每个单元: (参考文案序号, 段落序号, 文本, token数, n-gram)
+        units = []
+        for ref_index, text in enumerate(reference_texts):
+            for unit_index, unit in enumerate(self._split(text)):
+                units.append((ref_index, unit_index, unit, estimate_text_tokens(unit), _ngrams(unit, self.ngram)))
+        
+        overall = Counter()
+        for unit in units:
+            overall.update(unit[4])
+        # 与"其余全部文本"比较，避免长段落因为自身占比大而得分虚高
+        overall_sq = sum(count * count for count in overall.values())
+        scores = {(u[0], u[1]): _leave_one_out_cosine(u[4], overall, overall_sq) for u in units}
+        
+        ranked = sorted(units, key=lambda u: scores[(u[0], u[1])], reverse=True)
+        selected = set()
+        used = 0
+        
+        def take(unit):
+            nonlocal used
+            key = (unit[0], unit[1])
+            if key in selected or used + unit[3] > self.max_tokens:
+                return
+            selected.add(key)
+            used += unit[3]
+        
+        best_per_reference = {}
+        for unit in ranked:
+            best_per_reference.setdefault(unit[0], unit)
+        for ref_index in sorted(best_per_reference):
+            take(best_per_reference[ref_index])
+        for unit in ranked:
+            take(unit)
+        
+        texts = []
+        dropped = []
+        for ref_index in range(len(reference_texts)):
+            kept = [u[2] for u in units if u[0] == ref_index and (u[0], u[1]) in selected]
+            if kept:
+                texts.append("\n\n".join(kept))
+        for unit in units:
+            if (unit[0], unit[1]) not in selected:
+                dropped.append({
+                    "reference": unit[0] + 1,
+                    "paragraph": unit[1] + 1,
+                    "tokens": unit[3],
+                    "preview": unit[2][:30],
+                })
+        
+        return BudgetResult(texts, original_tokens, used, dropped)
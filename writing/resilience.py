@@ -0,0 +1,250 @@
+"""
+容错模块 - 为大模型调用提供截止时间、带抖动的指数退避重试和熔断器
+"""
+import time
+import random
+import asyncio
+import threading
+from typing import Callable, Optional, Dict, Any
+
+import httpx
+
+try:
+    from volcenginesdkarkruntime._exceptions import (
+        ArkAPIConnectionError,
+        ArkAPITimeoutError,
+        ArkRateLimitError,
+        ArkInternalServerError,
+        ArkAPIStatusError,
+    )
+    ARK_RETRYABLE_ERRORS = (ArkAPIConnectionError, ArkAPITimeoutError, ArkRateLimitError, ArkInternalServerError)
+    ARK_TIMEOUT_ERRORS = (ArkAPITimeoutError,)
+except ImportError:
+    ArkAPIStatusError = None
+    ARK_RETRYABLE_ERRORS = ()
+    ARK_TIMEOUT_ERRORS = ()
+
+
+class LLMCallError(Exception):
+    """大模型调用失败，替代原先静默返回输入文本的做法"""
+    
+    def __init__(self, step: str, message: str, cause: Optional[BaseException] = None):
+        super().__init__(f"{step}失败: {message}")
+        self.step = step
+        self.cause = cause
+
+
+class DeadlineExceededError(LLMCallError):
+    """在截止时间内未能完成调用"""
+
+
+class CircuitOpenError(LLMCallError):
+    """熔断器处于打开状态，直接快速失败"""
+
+
+class Deadline:
+    """截止时间，可从HTTP请求一路传递到每一步大模型调用"""
+    
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self) -> float:
+        """剩余秒数，已过期时返回0"""
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    def earliest(self, seconds: float) -> "Deadline":
+        """返回当前截止时间与seconds秒后两者中较早的那个"""
+        if seconds >= self.remaining():
+            return self
+        return Deadline(seconds)
+
+
+class RetryPolicy:
+    """带完全抖动（full jitter）的指数退避重试策略"""
+    
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def backoff(self, attempt: int) -> float:
+        """第attempt次失败后的等待秒数（attempt从1开始）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """只有限流、超时、连接错误和服务端5xx错误才值得重试"""
+    if ARK_RETRYABLE_ERRORS and isinstance(error, ARK_RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+def is_timeout(error: BaseException) -> bool:
+    """
+    调用是否因超时失败：超过截止时间，或重试用尽时最后一次是请求超时
+    方舟SDK的APITimeoutError和读取流时直接抛出的httpx超时都不是TimeoutError的子类，需要单独判断
+    """
+    if isinstance(error, DeadlineExceededError):
+        return True
+    cause = error.cause if isinstance(error, LLMCallError) else error
+    return isinstance(cause, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException) + ARK_TIMEOUT_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后进入打开状态，在冷却期内直接拒绝请求；
+    冷却期过后放行一个试探请求（半开状态），成功则关闭，失败则重新打开
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    _registry: Dict[str, "CircuitBreaker"] = {}
+    _registry_lock = threading.Lock()
+    
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_endpoint(cls, endpoint: str) -> "CircuitBreaker":
+        """同一进程内同一个模型端点共享一个熔断器"""
+        with cls._registry_lock:
+            if endpoint not in cls._registry:
+                cls._registry[endpoint] = cls()
+            return cls._registry[endpoint]
+    
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+    
+    def release(self):
+        """本次请求未真正发出（如等待限流配额超时），既不计成功也不计失败"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures}
+
+
+def call_with_resilience(step: str, call: Callable[[float], Any], deadline: Deadline,
+                         retry_policy: RetryPolicy, breaker: CircuitBreaker) -> Any:
+    """
+    在截止时间内调用call(剩余秒数)，可重试错误按退避策略重试
+    任何失败最终都以LLMCallError及其子类抛出
+    """
+    last_error = None
+    for attempt in range(1, retry_policy.max_attempts + 1):
+        if deadline.expired():
+            break
+        if not breaker.allow():
+            raise CircuitOpenError(step, "模型服务暂时不可用（熔断中），请稍后重试", last_error)
+        
+        try:
+            result = call(deadline.remaining())
+        except LLMCallError:
+            # 调用方已经归类好的错误（如等待限流配额超时）直接抛出
+            breaker.release()
+            raise
+        except Exception as e:
+            last_error = e
+            if not is_retryable(e):
+                # 请求本身有问题（如参数错误、鉴权失败），不计入熔断也不重试
+                breaker.record_success()
+                raise LLMCallError(step, str(e), e) from e
+            breaker.record_failure()
+            if attempt == retry_policy.max_attempts:
+                break
+            delay = retry_policy.backoff(attempt)
+            if delay >= deadline.remaining():
+                break
+            print(f"{step}第{attempt}次调用失败，{delay:.1f}秒后重试: {e}")
+            time.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        return result
+    
+    if deadline.expired():
+        raise DeadlineExceededError(step, "超过截止时间", last_error)
+    raise LLMCallError(step, str(last_error), last_error)
+
+
+async def async_call_with_resilience(step: str, call: Callable[[float], Any], deadline: Deadline,
+                                     retry_policy: RetryPolicy, breaker: CircuitBreaker) -> Any:
+    """call_with_resilience的协程版本，call(剩余秒数)返回可等待对象"""
+    last_error = None
+    for attempt in range(1, retry_policy.max_attempts + 1):
+        if deadline.expired():
+            break
+        if not breaker.allow():
+            raise CircuitOpenError(step, "模型服务暂时不可用（熔断中），请稍后重试", last_error)
+        
+        try:
+            result = await asyncio.wait_for(call(deadline.remaining()), timeout=deadline.remaining())
+        except asyncio.TimeoutError as e:
+            last_error = e
+            breaker.record_failure()
+            break
+        except LLMCallError:
+            breaker.release()
+            raise
+        except Exception as e:
+            last_error = e
+            if not is_retryable(e):
+                breaker.record_success()
+                raise LLMCallError(step, str(e), e) from e
+            breaker.record_failure()
+            if attempt == retry_policy.max_attempts:
+                break
+            delay = retry_policy.backoff(attempt)
+            if delay >= deadline.remaining():
+                break
+            print(f"{step}第{attempt}次调用失败，{delay:.1f}秒后重试: {e}")
+            await asyncio.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        return result
+    
+    if deadline.expired():
+        raise DeadlineExceededError(step, "超过截止时间", last_error)
+    raise LLMCallError(step, str(last_error), last_error)
@@ -0,0 +1,261 @@
+"""
+响应缓存模块 - 按请求内容寻址缓存大模型的输出，内存LRU + 磁盘存储两级
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+
+class ResponseCache:
+    """
+    大模型响应缓存
+    以(模型, 消息列表, 采样参数)的哈希作为键；先查内存LRU，再查磁盘，
+    磁盘部分按总大小和过期时间淘汰，最久未使用的条目优先淘汰。
+    磁盘条目的大小和访问顺序记在内存索引中（启动时扫描一次目录），写入时按索引淘汰，
+    文件读写都在锁外进行；每sweep_interval次写入在后台重新扫描一次目录，清理过期文件并校正索引
+    """
+    
+    def __init__(self, cache_dir: str = "data/cache", max_memory_entries: int = 256,
+                 max_disk_bytes: int = 50 * 1024 * 1024, ttl_seconds: int = 7 * 24 * 3600,
+                 sweep_interval: int = 1000):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # 键 -> (文件大小, 最近访问时间)，按访问顺序排列
+        self._disk_bytes = 0
+        self._writes_since_sweep = 0
+        self._sweeping = False
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._sweep()
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    @classmethod
+    def default(cls) -> Optional["ResponseCache"]:
+        """
+        进程内共享的默认缓存，由环境变量配置
+        设置AI_CACHE_DISABLED=1时返回None
+        """
+        if os.getenv("AI_CACHE_DISABLED") == "1":
+            return None
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(cache_dir=os.getenv("AI_CACHE_DIR", "data/cache"))
+            return cls._default
+    
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """根据请求内容计算缓存键"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+        
+        # 文件读取在锁外进行；其他进程（命令行、Web）写入的条目同样可以命中
+        entry, size = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._forget_disk(key)
+                self._stats["misses"] += 1
+                return None
+            self._remember(key, entry)
+            self._index_disk(key, size, now)
+            self._stats["disk_hits"] += 1
+            return entry[1]
+    
+    def set(self, key: str, value: str):
+        """写入缓存"""
+        entry = (time.time(), value)
+        with self._lock:
+            self._remember(key, entry)
+            self._stats["writes"] += 1
+        
+        size = self._write_disk(key, entry)
+        if size is None:
+            return
+        with self._lock:
+            self._index_disk(key, size, entry[0])
+            victims = self._take_victims()
+            self._writes_since_sweep += 1
+            sweep = self._writes_since_sweep >= self.sweep_interval and not self._sweeping
+            if sweep:
+                self._writes_since_sweep = 0
+                self._sweeping = True
+        self._remove_files(victims)
+        if sweep:
+            threading.Thread(target=self._sweep, name="cache-sweep", daemon=True).start()
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回命中/未命中计数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = len(self._disk_index)
+            stats["disk_bytes"] = self._disk_bytes
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = hits / total if total else 0.0
+        return stats
+    
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._disk_index.clear()
+            self._disk_bytes = 0
+            for path in self._disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _remember(self, key: str, entry: tuple):
+        """写入内存LRU，超出容量时淘汰最久未使用的条目"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def _disk_files(self) -> List[str]:
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+    
+    def _read_disk(self, key: str, now: float) -> tuple:
+        """读取磁盘条目，返回 ((创建时间, 值), 文件大小)；不存在或已过期时返回 (None, 0)"""
+        if not self.cache_dir:
+            return None, 0
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                size = os.fstat(f.fileno()).st_size
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return None, 0
+        
+        if now - data["created_at"] > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, 0
+        
+        # 更新访问时间，重启后扫描目录时据此恢复LRU顺序
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return (data["created_at"], data["value"]), size
+    
+    def _write_disk(self, key: str, entry: tuple) -> Optional[int]:
+        """写入磁盘，返回文件大小；不使用磁盘或写入失败时返回None"""
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            # 临时文件名唯一，并发写入同一个键时互不干扰
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"created_at": entry[0], "value": entry[1]}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入响应缓存时出错: {e}")
+            return None
+        return size
+    
+    def _index_disk(self, key: str, size: int, accessed_at: float):
+        """记入磁盘索引并移到最近使用的一端（调用方已持有锁）"""
+        self._forget_disk(key)
+        self._disk_index[key] = (size, accessed_at)
+        self._disk_bytes += size
+    
+    def _forget_disk(self, key: str):
+        """从磁盘索引中移除（调用方已持有锁）"""
+        indexed = self._disk_index.pop(key, None)
+        if indexed is not None:
+            self._disk_bytes -= indexed[0]
+    
+    def _take_victims(self) -> List[str]:
+        """总大小超限时按访问顺序从旧到新取出要删除的文件（调用方已持有锁，删除在锁外进行）"""
+        victims = []
+        while self._disk_bytes > self.max_disk_bytes and self._disk_index:
+            key, (size, _) = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            victims.append(self._disk_path(key))
+        return victims
+    
+    def _remove_files(self, paths: List[str]):
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            with self._lock:
+                self._stats["evictions"] += removed
+    
+    def _sweep(self):
+        """
+        扫描整个缓存目录（锁外进行）：删除过期文件，按文件大小和访问时间重建磁盘索引；
+        扫描期间写入或读取过的条目以内存中的记录为准。启动时执行一次，之后每sweep_interval次写入在后台执行
+        """
+        started = time.time()
+        scanned = []
+        expired = []
+        for path in self._disk_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if started - st.st_mtime > self.ttl_seconds:
+                expired.append(path)
+                continue
+            scanned.append((st.st_mtime, st.st_size, os.path.basename(path)[:-len(".json")]))
+        scanned.sort()
+        
+        with self._lock:
+            index = OrderedDict((key, (size, mtime)) for mtime, size, key in scanned)
+            for key, (size, accessed_at) in self._disk_index.items():
+                if accessed_at >= started:
+                    index[key] = (size, accessed_at)
+                    index.move_to_end(key)
+            self._disk_index = index
+            self._disk_bytes = sum(size for size, _ in index.values())
+            victims = self._take_victims()
+            self._sweeping = False
+        self._remove_files(expired + victims)
@@ -0,0 +1,548 @@
+"""
+规则引擎模块 - 识别可以机械执行的限制规则（标点数量、禁用字词、句子/段落长度、表情符号、全角半角），
+在本地直接应用，只把其余规则交给大模型；生成后在本地检查结果是否符合规则，只有违反时才请求修正
+"""
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+# "不要那么多""少用"这类没有给出具体数量的规则，每种符号最多保留的个数
+SOFT_LIMIT = 2
+
+# 可识别的符号：名称 -> 匹配方式。paired为成对符号（引号），超出上限时去掉引号保留内容；
+# 其余符号超出上限时替换为replacement
+_MARKS = {
+    "破折号": {"pattern": r"——|—|--", "replacement": "，"},
+    "双引号": {"pattern": r"“([^“”]*)”|\"([^\"\n]*)\"", "paired": True},
+    "单引号": {"pattern": r"‘([^‘’]*)’", "paired": True},
+    "感叹号": {"pattern": r"[！!]+", "replacement": "。"},
+    "省略号": {"pattern": r"…+|\.{3,}", "replacement": "。"},
+    "分号": {"pattern": r"[；;]", "replacement": "。"},
+    "括号": {"pattern": r"（([^（）]*)）|\(([^()\n]*)\)", "paired": True},
+}
+_MARK_ALIASES = {
+    "破折号": "破折号", "破折": "破折号", "长破折号": "破折号",
+    "双引号": "双引号", "引号": "双引号", "单引号": "单引号",
+    "感叹号": "感叹号", "惊叹号": "感叹号",
+    "省略号": "省略号", "分号": "分号", "括号": "括号", "圆括号": "括号",
+}
+_EMOJI_NAMES = ("emoji", "表情符号", "表情", "颜文字")
+
+_EMOJI_PATTERN = re.compile(
+    "[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\u2300-\u23FF\uFE0F\u200D]+[ \t]*"
+)
+_CJK = r"\u4e00-\u9fff"
+_HALF_TO_FULL_PUNCTUATION = {",": "，", "!": "！", "?": "？", ";": "；", ":": "："}
+_SENTENCE_END = re.compile(r"[^。！？!?\n]+[。！？!?]*")
+_DUPLICATE_PUNCTUATION = re.compile(r"[，,](?=[，。！？；：,.!?;:」』”\n]|$)|(?<=[。！？；：\n])[，,]|^[，,]",
+                                    re.MULTILINE)
+
+_CHINESE_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5,
+                   "六": 6, "七": 7, "八": 8, "九": 9}
+
+
+def _number(text: str) -> Optional[int]:
+    """解析阿拉伯数字或一百以内的中文数字"""
+    if text.isdigit():
+        return int(text)
+    if text in _CHINESE_DIGITS:
+        return _CHINESE_DIGITS[text]
+    if "十" in text and len(text) <= 3:
+        tens, _, ones = text.partition("十")
+        tens_value = _CHINESE_DIGITS.get(tens, None) if tens else 1
+        ones_value = _CHINESE_DIGITS.get(ones, None) if ones else 0
+        if tens_value is not None and ones_value is not None:
+            return tens_value * 10 + ones_value
+    return None
+
+
+def _tidy(text: str) -> str:
+    """替换符号后清理多余的逗号（如"，，"、"，。"、段首的逗号）"""
+    return _DUPLICATE_PUNCTUATION.sub("", text)
+
+
+class MechanicalRule:
+    """
+    一条可以机械执行的规则
+    kind: max_count（target符号最多limit个）、ban（删除phrases）、replace（find替换为replace）、
+    max_sentence_chars / max_paragraph_chars（句子/段落最多limit个字）、remove_emoji、
+    fullwidth_punctuation（中文中的半角标点改为全角）、halfwidth_alnum（全角数字字母改为半角）；
+    以下类型只能检查、不能在本地修正（fixable为False）：max_chars / min_chars（全文字数上下限）、
+    must_include（必须出现phrases）
+    """
+    
+    def __init__(self, kind: str, rule_id: Optional[str] = None, instruction: Optional[str] = None, **params):
+        if kind not in _CHECKERS:
+            raise ValueError(f"未知的规则类型: {kind}")
+        self.kind = kind
+        self.rule_id = rule_id
+        self.instruction = instruction
+        self.params = params
+    
+    @property
+    def fixable(self) -> bool:
+        return self.kind in _APPLIERS
+    
+    def apply(self, text: str) -> str:
+        if not self.fixable:
+            return text
+        return _APPLIERS[self.kind](text, **self.params)
+    
+    def check(self, text: str) -> Optional[str]:
+        """检查文案是否符合这条规则，不符合时返回问题描述"""
+        return _CHECKERS[self.kind](text, **self.params)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.kind, **self.params}
+    
+    def __repr__(self):
+        return f"MechanicalRule({self.kind}, {self.params})"
+
+
+def _apply_max_count(text: str, target: str, limit: int) -> str:
+    mark = _MARKS[target]
+    seen = 0
+    
+    def replace(match):
+        nonlocal seen
+        seen += 1
+        if seen <= limit:
+            return match.group(0)
+        if mark.get("paired"):
+            return next((group for group in match.groups() if group is not None), "")
+        return mark["replacement"]
+    
+    return _tidy(re.sub(mark["pattern"], replace, text))
+
+
+def _apply_ban(text: str, phrases: List[str]) -> str:
+    for phrase in phrases:
+        text = text.replace(phrase, "")
+    return _tidy(text)
+
+
+def _apply_replace(text: str, find: str, replace: str) -> str:
+    return text.replace(find, replace)
+
+
+def _split_long_sentence(sentence: str, limit: int) -> str:
+    """把超长的句子在上限之前最后一个逗号处断开（逗号改为句号），没有逗号时保持原样"""
+    result = []
+    while len(sentence) > limit:
+        cut = max(sentence.rfind("，", 0, limit), sentence.rfind(",", 0, limit))
+        if cut <= 0:
+            break
+        result.append(sentence[:cut] + "。")
+        sentence = sentence[cut + 1:]
+    result.append(sentence)
+    return "".join(result)
+
+
+def _apply_max_sentence_chars(text: str, limit: int) -> str:
+    return _SENTENCE_END.sub(lambda match: _split_long_sentence(match.group(0), limit), text)
+
+
+def _apply_max_paragraph_chars(text: str, limit: int) -> str:
+    """超长的段落在句子边界处拆成多段"""
+    paragraphs = []
+    for paragraph in text.split("\n"):
+        current = ""
+        for sentence in _SENTENCE_END.findall(paragraph) or [paragraph]:
+            if current and len(current) + len(sentence) > limit:
+                paragraphs.append(current)
+                paragraphs.append("")
+                current = sentence.lstrip()
+            else:
+                current += sentence
+        paragraphs.append(current)
+    return "\n".join(paragraphs)
+
+
+def _apply_remove_emoji(text: str) -> str:
+    return _EMOJI_PATTERN.sub("", text)
+
+
+def _apply_fullwidth_punctuation(text: str) -> str:
+    """紧跟在中文后面的半角标点改为全角，英文和数字中的标点（如3.14、a,b）不变"""
+    text = re.sub(f"(?<=[{_CJK}])[,!?;:]", lambda match: _HALF_TO_FULL_PUNCTUATION[match.group(0)], text)
+    text = re.sub(f"(?<=[{_CJK}])\\.(?!\\d)", "。", text)
+    return re.sub(f"\\(([^()\n]*[{_CJK}][^()\n]*)\\)", r"（\1）", text)
+
+
+def _apply_halfwidth_alnum(text: str) -> str:
+    return re.sub("[０-９Ａ-Ｚａ-ｚ]", lambda match: chr(ord(match.group(0)) - 0xFEE0), text)
+
+
+def _preview(text: str, length: int = 20) -> str:
+    text = text.strip()
+    return text if len(text) <= length else text[:length] + "……"
+
+
+def _text_length(text: str) -> int:
+    """字数，不计空白"""
+    return len(re.sub(r"\s", "", text))
+
+
+def _check_max_count(text: str, target: str, limit: int) -> Optional[str]:
+    count = sum(1 for _ in re.finditer(_MARKS[target]["pattern"], text))
+    return f"{target}出现{count}处，最多{limit}处" if count > limit else None
+
+
+def _check_ban(text: str, phrases: List[str]) -> Optional[str]:
+    found = [phrase for phrase in phrases if phrase in text]
+    return f"出现了禁用的字词：{'、'.join(found)}" if found else None
+
+
+def _check_replace(text: str, find: str, replace: str) -> Optional[str]:
+    return f"“{find}”应改为“{replace}”" if find in text else None
+
+
+def _check_max_sentence_chars(text: str, limit: int) -> Optional[str]:
+    long_sentences = [sentence for sentence in _SENTENCE_END.findall(text) if len(sentence) > limit]
+    if not long_sentences:
+        return None
+    return f"{len(long_sentences)}个句子超过{limit}个字：" + "；".join(_preview(s) for s in long_sentences[:3])
+
+
+def _check_max_paragraph_chars(text: str, limit: int) -> Optional[str]:
+    long_paragraphs = [paragraph for paragraph in text.split("\n") if len(paragraph.strip()) > limit]
+    if not long_paragraphs:
+        return None
+    return f"{len(long_paragraphs)}个段落超过{limit}个字：" + "；".join(_preview(p) for p in long_paragraphs[:3])
+
+
+def _check_remove_emoji(text: str) -> Optional[str]:
+    found = _EMOJI_PATTERN.findall(text)
+    return f"包含{len(found)}处表情符号" if found else None
+
+
+def _check_fullwidth_punctuation(text: str) -> Optional[str]:
+    return None if _apply_fullwidth_punctuation(text) == text else "中文中使用了半角标点"
+
+
+def _check_halfwidth_alnum(text: str) -> Optional[str]:
+    found = re.findall("[０-９Ａ-Ｚａ-ｚ]+", text)
+    return f"使用了全角数字或字母：{'、'.join(found[:5])}" if found else None
+
+
+def _check_max_chars(text: str, limit: int) -> Optional[str]:
+    length = _text_length(text)
+    return f"全文{length}个字，超过{limit}个字" if length > limit else None
+
+
+def _check_min_chars(text: str, limit: int) -> Optional[str]:
+    length = _text_length(text)
+    return f"全文{length}个字，少于{limit}个字" if length < limit else None
+
+
+def _check_must_include(text: str, phrases: List[str]) -> Optional[str]:
+    missing = [phrase for phrase in phrases if phrase not in text]
+    return f"缺少必须出现的内容：{'、'.join(missing)}" if missing else None
+
+
+# 应用顺序：先统一字符和字词，再限制符号数量，最后按长度断句分段
+_APPLY_ORDER = ["halfwidth_alnum", "fullwidth_punctuation", "remove_emoji", "replace", "ban",
+                "max_count", "max_sentence_chars", "max_paragraph_chars"]
+
+_APPLIERS = {
+    "max_count": _apply_max_count,
+    "ban": _apply_ban,
+    "replace": _apply_replace,
+    "max_sentence_chars": _apply_max_sentence_chars,
+    "max_paragraph_chars": _apply_max_paragraph_chars,
+    "remove_emoji": _apply_remove_emoji,
+    "fullwidth_punctuation": _apply_fullwidth_punctuation,
+    "halfwidth_alnum": _apply_halfwidth_alnum,
+}
+
+_CHECKERS = {
+    "max_count": _check_max_count,
+    "ban": _check_ban,
+    "replace": _check_replace,
+    "max_sentence_chars": _check_max_sentence_chars,
+    "max_paragraph_chars": _check_max_paragraph_chars,
+    "remove_emoji": _check_remove_emoji,
+    "fullwidth_punctuation": _check_fullwidth_punctuation,
+    "halfwidth_alnum": _check_halfwidth_alnum,
+    "max_chars": _check_max_chars,
+    "min_chars": _check_min_chars,
+    "must_include": _check_must_include,
+}
+
+
+# 规则文本的识别（整条规则都能识别时才按机械规则处理，带有其他要求的规则仍交给大模型）
+_QUOTED = r"[“\"「『']([^“”\"「」『』']+)[”\"」』']"
+_NUMBER = r"(?P<number>\d+|[零一二两三四五六七八九十]{1,3})"
+_NEGATION = r"(?:不要|不用|别|禁止|避免|不能|不准|不得|去掉|删除|删掉|去除|不许)"
+_VERB = r"(?:再)?(?:使用|用|加入|加|出现|有|带|包含|添加|写)?"
+_SOFT = r"(?:那么多|太多|过多|这么多|很多|大量)?(?:的)?"
+_TARGET_SEPARATOR = re.compile(r"和|、|及|以及|或|与|，|,|/")
+
+_BAN_MARKS_PATTERN = re.compile(f"^{_NEGATION}{_VERB}(?P<soft>{_SOFT})(?P<targets>[^“\"「『]+?)(?:符号)?$")
+_SOFT_MARKS_PATTERN = re.compile(r"^(?:少用|少加|减少|尽量少用|控制)(?P<targets>[^“\"「『]+?)(?:的(?:使用|数量))?$")
+_CAP_MARKS_PATTERNS = [
+    re.compile(f"^(?P<targets>[^“\"「『\\d]+?)(?:的数量)?(?:不要?超过|不多于|最多|至多)(?:使用|用)?{_NUMBER}个$"),
+    re.compile(f"^(?:最多|至多)(?:只)?(?:使用|用|出现)?{_NUMBER}个(?P<targets>[^“\"「『\\d]+?)$"),
+]
+_BAN_PHRASES_PATTERN = re.compile(
+    f"^{_NEGATION}{_VERB}(?P<phrases>(?:{_QUOTED}(?:和|、|或|，)?)+)(?:这(?:个|些|类|种)?(?:词|字|词语|说法|表达))?$"
+)
+_REPLACE_PATTERN = re.compile(
+    f"^(?:把|将|用){_QUOTED}(?:改为|改成|换成|替换为|替换成|统一为|代替){_QUOTED}$"
+)
+_LENGTH_PATTERN = re.compile(
+    f"^(?:每(?:个|一)?)?(?P<unit>句子?|句话|段落?|段话)(?:的长度|长度)?"
+    f"(?:不要?超过|不多于|最多|控制在|少于|不超)(?:在)?{_NUMBER}个?字(?:以内|之内)?$"
+)
+_TOTAL_LENGTH_PATTERN = re.compile(
+    f"^(?:全文|文案|正文|总字数|全文字数|字数|篇幅|总长度)(?:的长度|长度)?(?:要|需要)?"
+    f"(?P<op>控制在|不要?超过|不多于|最多|不少于|至少|不低于|不能少于)(?:在)?{_NUMBER}个?字(?:以内|之内|以上)?$"
+)
+_MUST_INCLUDE_PATTERN = re.compile(
+    f"^(?:必须|一定要|需要|要|务必|记得)(?:在文案中|在文中)?(?:包含|提到|出现|带上|写上|加上|提及)"
+    f"(?P<phrases>(?:{_QUOTED}(?:和|、|及|，)?)+)(?:这(?:个|些|几个)?(?:词|字|词语|说法|信息|内容))?$"
+)
+_FULLWIDTH_PATTERN = re.compile(r"^(?:统一)?(?:使用|用|改为|改用)?(?:全角|中文)标点(?:符号)?$")
+_HALFWIDTH_PATTERN = re.compile(r"^(?:数字|字母|英文|数字和字母|数字和英文|英文和数字|字母和数字)"
+                                r"(?:统一)?(?:使用|用|改为|改用|为)?半角(?:字符)?$")
+
+
+def _parse_targets(text: str) -> Optional[List[str]]:
+    """把"破折号和双引号"拆成符号名称列表，有无法识别的名称时返回None"""
+    targets = []
+    for name in _TARGET_SEPARATOR.split(text):
+        name = name.strip()
+        if not name:
+            continue
+        name = name[:-2] if name.endswith("符号") and name not in _EMOJI_NAMES else name
+        if name in _EMOJI_NAMES:
+            targets.append("emoji")
+        elif name in _MARK_ALIASES:
+            targets.append(_MARK_ALIASES[name])
+        else:
+            return None
+    return targets or None
+
+
+def _mark_rules(targets: List[str], limit: int) -> List[MechanicalRule]:
+    return [
+        MechanicalRule("remove_emoji") if target == "emoji" else MechanicalRule("max_count", target=target, limit=limit)
+        for target in targets
+    ]
+
+
+@lru_cache(maxsize=1024)
+def _compile_text(instruction: str) -> Optional[Tuple[MechanicalRule, ...]]:
+    text = re.sub(r"\s+", "", instruction).rstrip("。.！!；;")
+    clauses = [clause for clause in re.split(r"[；;。]", text) if clause]
+    rules = []
+    for clause in clauses:
+        compiled = _compile_clause(clause)
+        if compiled is None:
+            return None
+        rules.extend(compiled)
+    return tuple(rules) or None
+
+
+def _compile_clause(clause: str) -> Optional[List[MechanicalRule]]:
+    match = _REPLACE_PATTERN.match(clause)
+    if match:
+        find, replace = match.group(1), match.group(2)
+        if clause.startswith("用"):
+            find, replace = replace, find
+        return [MechanicalRule("replace", find=find, replace=replace)]
+    
+    match = _BAN_PHRASES_PATTERN.match(clause)
+    if match:
+        return [MechanicalRule("ban", phrases=re.findall(_QUOTED, match.group("phrases")))]
+    
+    match = _LENGTH_PATTERN.match(clause)
+    if match:
+        limit = _number(match.group("number"))
+        if not limit:
+            return None
+        kind = "max_sentence_chars" if match.group("unit").startswith("句") else "max_paragraph_chars"
+        return [MechanicalRule(kind, limit=limit)]
+    
+    match = _TOTAL_LENGTH_PATTERN.match(clause)
+    if match:
+        limit = _number(match.group("number"))
+        if not limit:
+            return None
+        kind = "min_chars" if match.group("op") in ("不少于", "至少", "不低于", "不能少于") else "max_chars"
+        return [MechanicalRule(kind, limit=limit)]
+    
+    match = _MUST_INCLUDE_PATTERN.match(clause)
+    if match:
+        return [MechanicalRule("must_include", phrases=re.findall(_QUOTED, match.group("phrases")))]
+    
+    if _FULLWIDTH_PATTERN.match(clause):
+        return [MechanicalRule("fullwidth_punctuation")]
+    if _HALFWIDTH_PATTERN.match(clause):
+        return [MechanicalRule("halfwidth_alnum")]
+    
+    for pattern in _CAP_MARKS_PATTERNS:
+        match = pattern.match(clause)
+        if match:
+            targets = _parse_targets(match.group("targets"))
+            limit = _number(match.group("number"))
+            if targets is None or limit is None:
+                return None
+            return _mark_rules(targets, limit)
+    
+    match = _SOFT_MARKS_PATTERN.match(clause)
+    if match:
+        targets = _parse_targets(match.group("targets"))
+        return _mark_rules(targets, SOFT_LIMIT) if targets else None
+    
+    match = _BAN_MARKS_PATTERN.match(clause)
+    if match:
+        targets = _parse_targets(match.group("targets"))
+        return _mark_rules(targets, SOFT_LIMIT if match.group("soft") else 0) if targets else None
+    
+    return None
+
+
+def compile_rule(rule: Dict[str, Any]) -> Optional[List[MechanicalRule]]:
+    """
+    把一条限制规则编译为机械规则列表，不能机械执行或检查时返回None
+    规则中有结构化字段mechanical（单个或列表，如 {"type": "max_count", "target": "破折号", "limit": 2}）时直接使用，
+    否则从instruction文本识别
+    """
+    structured = rule.get("mechanical")
+    if structured:
+        items = structured if isinstance(structured, list) else [structured]
+        try:
+            return [MechanicalRule(rule_id=rule.get("id"), instruction=rule.get("instruction"),
+                                   **{("kind" if k == "type" else k): v for k, v in item.items()})
+                    for item in items]
+        except (TypeError, ValueError) as e:
+            print(f"忽略无效的结构化规则 {rule.get('id')}: {e}")
+            return None
+    
+    compiled = _compile_text(rule.get("instruction", ""))
+    if compiled is None:
+        return None
+    return [MechanicalRule(r.kind, rule.get("id"), rule.get("instruction"), **r.params) for r in compiled]
+
+
+class RuleViolation:
+    """文案违反的一条规则"""
+    
+    def __init__(self, rule: MechanicalRule, message: str):
+        self.rule = rule
+        self.message = message
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rule_id": self.rule.rule_id,
+            "instruction": self.rule.instruction,
+            "type": self.rule.kind,
+            "message": self.message,
+        }
+
+
+class RuleEngine:
+    """
+    本地规则引擎
+    split把选中的规则分为可机械执行的部分和其余部分，apply在本地依次应用机械规则；
+    只剩机械规则时应用限制规则这一步不再调用大模型。
+    verify检查文案是否符合可检查的规则，返回违反的规则；prepare在调用大模型之前应用机械规则，
+    并去掉文案已经符合的只能检查的规则（如字数上限），这些规则都已满足时同样不调用大模型
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {"mechanical_rules": 0, "model_rules": 0, "model_calls_skipped": 0,
+                       "verified": 0, "violations": 0, "repair_calls": 0}
+    
+    @classmethod
+    def default(cls) -> "RuleEngine":
+        """进程内共享的规则引擎，AI_RULE_ENGINE=0时关闭（所有规则交给大模型）"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(os.getenv("AI_RULE_ENGINE", "1") != "0")
+            return cls._default
+    
+    def split(self, selected_rules: List[Dict[str, Any]]) -> Tuple[List[MechanicalRule], List[Dict[str, Any]]]:
+        """返回 (机械规则, 需要交给大模型的规则)"""
+        if not self.enabled:
+            return [], list(selected_rules)
+        mechanical, remaining = [], []
+        for rule in selected_rules:
+            compiled = compile_rule(rule)
+            if compiled is None or not all(r.fixable for r in compiled):
+                remaining.append(rule)
+            else:
+                mechanical.extend(compiled)
+        with self._lock:
+            self._stats["mechanical_rules"] += len(selected_rules) - len(remaining)
+            self._stats["model_rules"] += len(remaining)
+            if selected_rules and not remaining:
+                self._stats["model_calls_skipped"] += 1
+        return mechanical, remaining
+    
+    def apply(self, rules: List[MechanicalRule], text: str) -> str:
+        for rule in sorted((r for r in rules if r.fixable), key=lambda r: _APPLY_ORDER.index(r.kind)):
+            text = rule.apply(text)
+        return text
+    
+    def checks(self, selected_rules: List[Dict[str, Any]]) -> List[MechanicalRule]:
+        """选中规则中所有可以在本地检查的规则"""
+        if not self.enabled:
+            return []
+        checks = []
+        for rule in selected_rules:
+            checks.extend(compile_rule(rule) or [])
+        return checks
+    
+    def verify(self, checks: List[MechanicalRule], text: str) -> List[RuleViolation]:
+        """检查文案，返回违反的规则（全部符合时为空列表）"""
+        violations = []
+        for rule in checks:
+            message = rule.check(text)
+            if message:
+                violations.append(RuleViolation(rule, message))
+        with self._lock:
+            self._stats["verified"] += 1
+            self._stats["violations"] += len(violations)
+        return violations
+    
+    def prepare(self, draft: str, selected_rules: List[Dict[str, Any]]) \
+            -> Tuple[str, List[Dict[str, Any]], List[MechanicalRule]]:
+        """
+        调用大模型之前的本地处理，返回 (应用机械规则后的文案, 需要交给大模型的规则, 生成后需要检查的规则)
+        只能检查的规则在文案已经符合时不再交给大模型，但仍在生成后检查
+        """
+        mechanical_rules, remaining = self.split(selected_rules)
+        draft = self.apply(mechanical_rules, draft)
+        checks = list(mechanical_rules)
+        model_rules = []
+        for rule in remaining:
+            compiled = compile_rule(rule) if self.enabled else None
+            if compiled is None:
+                model_rules.append(rule)
+                continue
+            checks.extend(compiled)
+            if any(r.check(draft) for r in compiled):
+                model_rules.append(rule)
+        if remaining and not model_rules:
+            with self._lock:
+                self._stats["model_calls_skipped"] += 1
+        return draft, model_rules, checks
+    
+    def record_repair(self):
+        with self._lock:
+            self._stats["repair_calls"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,128 @@
+"""
+请求合并模块 - 相同的请求（模型、提示词、参数均一致）同时在进行时只发出一次，
+后到的请求等待先到请求的结果，不再各自调用大模型（如用户连点"生成初稿"、多人提交同一份模板文案）
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Awaitable, Dict, Any, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class FlightAbortedError(Exception):
+    """leader没有得到结果就中断了（被取消，或流式输出中途被关闭），等待它的follower收到此异常"""
+
+
+class SingleFlight:
+    """
+    按请求键合并进行中的调用
+    第一个到达的调用（leader）真正执行，执行期间到达的相同调用（follower）等待它的结果；
+    leader出错时follower收到同样的异常。执行完成后即移除，之后的相同请求重新执行（或由响应缓存命中）
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "shared_errors": 0}
+    
+    @classmethod
+    def default(cls) -> "SingleFlight":
+        """进程内共享的合并器，AI_SINGLE_FLIGHT=0时关闭"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(os.getenv("AI_SINGLE_FLIGHT", "1") != "0")
+            return cls._default
+    
+    def join(self, key: str) -> Tuple[bool, Future]:
+        """
+        加入key对应的调用，返回 (是否为leader, future)
+        leader执行完成后必须调用finish；follower在future上等待结果
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return False, future
+            future = Future()
+            self._calls[key] = future
+            self._stats["leaders"] += 1
+            return True, future
+    
+    def finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        """leader交付结果或异常，唤醒所有follower"""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def wait(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """follower等待leader的结果"""
+        try:
+            return future.result(timeout)
+        except Exception:
+            with self._lock:
+                self._stats["shared_errors"] += 1
+            raise
+    
+    async def do_async(self, key: Optional[str], call: Callable[[], Awaitable[T]],
+                       timeout: Optional[float] = None) -> Tuple[T, bool]:
+        """
+        执行call或等待相同的进行中调用，返回 (结果, 是否合并到了其他调用)；key为None或关闭时直接执行
+        timeout只限制follower的等待；asyncio的future绑定在事件循环上，只合并同一个事件循环中的调用
+        """
+        if not self.enabled or key is None:
+            return await call(), False
+        flight_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            future = self._async_calls.get(flight_key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._async_calls[flight_key] = future
+                self._stats["leaders"] += 1
+                leader = True
+            else:
+                self._stats["coalesced"] += 1
+                leader = False
+        
+        if not leader:
+            try:
+                # shield：某个follower被取消时不影响leader和其他follower
+                return await asyncio.wait_for(asyncio.shield(future), timeout), True
+            except Exception:
+                with self._lock:
+                    self._stats["shared_errors"] += 1
+                raise
+        
+        try:
+            result = await call()
+        except BaseException as e:
+            with self._lock:
+                self._async_calls.pop(flight_key, None)
+            error = FlightAbortedError("相同的请求已被取消") if isinstance(e, asyncio.CancelledError) else e
+            future.set_exception(error)
+            # 没有follower时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        with self._lock:
+            self._async_calls.pop(flight_key, None)
+        future.set_result(result)
+        return result, False
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._async_calls)
+        total = stats["leaders"] + stats["coalesced"]
+        stats["enabled"] = self.enabled
+        stats["coalesced_rate"] = stats["coalesced"] / total if total else 0.0
+        return stats
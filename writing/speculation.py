@@ -0,0 +1,139 @@
+"""
+推测执行模块 - 初稿一出来就在后台按最可能的选择应用偏好/规则，用户选完后若选择一致则直接使用结果
+"""
+import os
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from ai_agent import AIAgent
+from metrics import MetricsSession
+
+
+def predict_selection(items: List[Dict[str, Any]], last_ids: List[str]) -> List[Dict[str, Any]]:
+    """预测用户的选择：上次选过且仍存在的条目；没有历史记录时预测为全选"""
+    if last_ids:
+        predicted = [item for item in items if item["id"] in set(last_ids)]
+        if predicted:
+            return predicted
+    return list(items)
+
+
+class Speculator:
+    """
+    推测执行器
+    speculate()在后台开始执行，take()在用户确定选择后取结果：选择一致则等待并返回推测结果，
+    不一致则取消尚未开始的推测（已在执行的无法中断，结果仍会写入响应缓存）并返回None，由调用方正常执行。
+    推测调用的指标单独收集，take()时并入取结果的请求的会话，推测的开销（包括落空的）会出现在该请求的指标中；
+    落空时推测仍在执行的，执行完后再并入
+    """
+    
+    STAGES = ("preferences", "rules")
+    
+    def __init__(self, ai_agent: AIAgent, max_workers: int = 4, max_entries: int = 64):
+        self.ai_agent = ai_agent
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self._pending = OrderedDict()  # (阶段, 文案哈希) -> (条目id元组, future, 推测调用的指标)
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "hits": 0, "misses": 0, "cancelled": 0}
+    
+    @classmethod
+    def from_env(cls, ai_agent: AIAgent) -> Optional["Speculator"]:
+        """设置环境变量AI_SPECULATIVE=1时开启"""
+        if os.getenv("AI_SPECULATIVE") != "1":
+            return None
+        return cls(ai_agent)
+    
+    @staticmethod
+    def _key(stage: str, draft: str):
+        return stage, hashlib.sha256(draft.encode("utf-8")).hexdigest()
+    
+    def speculate(self, stage: str, draft: str, selected_items: List[Dict[str, Any]]) -> bool:
+        """开始推测执行；没有可应用的条目或已有相同推测时返回False"""
+        if stage not in self.STAGES:
+            raise ValueError(f"未知的推测阶段: {stage}")
+        if not selected_items:
+            return False
+        
+        ids = tuple(sorted(item["id"] for item in selected_items))
+        key = self._key(stage, draft)
+        with self._lock:
+            existing = self._pending.get(key)
+            if existing and existing[0] == ids:
+                return False
+            if existing:
+                existing[1].cancel()
+            
+            apply = self.ai_agent.apply_preferences if stage == "preferences" else self.ai_agent.apply_restrictions
+            records = MetricsSession()
+            
+            def run():
+                with self.ai_agent.metrics.session(records):
+                    return apply(draft, selected_items)
+            
+            # 复制当前上下文执行（与learn_concurrently一致），调用记录收集到records中
+            future = self._executor.submit(contextvars.copy_context().run, run)
+            self._pending[key] = (ids, future, records)
+            self._pending.move_to_end(key)
+            self._stats["started"] += 1
+            
+            while len(self._pending) > self.max_entries:
+                _, (_, stale, _) = self._pending.popitem(last=False)
+                stale.cancel()
+        return True
+    
+    def take(self, stage: str, draft: str, selected_items: List[Dict[str, Any]],
+             timeout: Optional[float] = None) -> Optional[str]:
+        """用户选择确定后取推测结果；没有推测、选择不一致或推测失败时返回None"""
+        key = self._key(stage, draft)
+        with self._lock:
+            entry = self._pending.pop(key, None)
+        if entry is None:
+            return None
+        
+        ids, future, records = entry
+        if ids != tuple(sorted(item["id"] for item in selected_items)):
+            with self._lock:
+                self._stats["misses"] += 1
+                if future.cancel():
+                    self._stats["cancelled"] += 1
+            self._attach(future, records)
+            return None
+        
+        try:
+            result = future.result(timeout=timeout)
+        except Exception:
+            # 推测失败（包括等待超时）时交给调用方重新执行，由正常路径报告错误
+            with self._lock:
+                self._stats["misses"] += 1
+            self._attach(future, records)
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        self._attach(future, records)
+        return result
+    
+    def _attach(self, future: Future, records: MetricsSession):
+        """
+        把推测的调用记录并入当前请求的会话
+        推测仍在执行时（选择不一致但已无法取消，或等待超时），执行完后再并入，避免漏掉之后的调用
+        """
+        metrics = self.ai_agent.metrics
+        if future.done():
+            metrics.attach(records)
+            return
+        session = metrics.current_session()
+        if session is not None:
+            future.add_done_callback(lambda _: metrics.attach(records, session))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        taken = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / taken if taken else 0.0
+        return stats
@@ -0,0 +1,117 @@
+"""
+风格卡片模块 - 一组参考文案只提炼一次风格描述，按参考文案的哈希保存，跨会话复用
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+
+class StyleCardStore:
+    """
+    风格卡片存储，保存在一个JSON文件中，键为参考文案的哈希
+    多个进程（如Web服务的多个worker）可共用同一个文件：保存时先读入文件再合并本次修改，
+    读取时文件被修改过或没有找到卡片则重新读入，能看到其他进程保存的卡片
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, path: str = "data/style_cards.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = self._file_signature()
+        self._cards = self._load()
+    
+    @classmethod
+    def default(cls) -> "StyleCardStore":
+        """进程内共享的风格卡片存储，文件路径可用环境变量AI_STYLE_CARD_PATH指定"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(os.getenv("AI_STYLE_CARD_PATH", "data/style_cards.json"))
+            return cls._default
+    
+    @staticmethod
+    def reference_hash(reference_texts: List[str]) -> str:
+        """参考文案集合的哈希；忽略首尾空白，顺序不同视为同一组"""
+        normalized = sorted(text.strip() for text in reference_texts if text.strip())
+        return hashlib.sha256("\x1e".join(normalized).encode("utf-8")).hexdigest()
+    
+    def _file_signature(self) -> Optional[tuple]:
+        """文件的修改时间和大小，用于判断是否被其他进程修改过；文件不存在时返回None"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+    
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _refresh(self, force: bool = False):
+        """文件被修改过或force时重新读入（调用方已持有锁）"""
+        signature = self._file_signature()
+        if force or signature != self._signature:
+            self._signature = signature
+            self._cards = self._load()
+    
+    def _save(self):
+        """先写独立的临时文件再替换，避免写到一半的文件被读到，多个进程同时保存也不会互相覆盖临时文件（调用方已持有锁）"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._cards, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._signature = self._file_signature()
+    
+    def get(self, reference_texts: List[str]) -> Optional[str]:
+        """返回这组参考文案的风格卡片，没有则返回None；没有找到时重新读入文件再查一次"""
+        reference_hash = self.reference_hash(reference_texts)
+        with self._lock:
+            self._refresh()
+            entry = self._cards.get(reference_hash)
+            if entry is None:
+                self._refresh(force=True)
+                entry = self._cards.get(reference_hash)
+        return entry["card"] if entry else None
+    
+    def save(self, reference_texts: List[str], card: str, name: Optional[str] = None) -> str:
+        """保存风格卡片，返回参考文案的哈希"""
+        reference_hash = self.reference_hash(reference_texts)
+        with self._lock:
+            # 先读入文件，合并其他进程保存的卡片后再写回
+            self._refresh(force=True)
+            self._cards[reference_hash] = {
+                "name": name or reference_texts[0].strip()[:20],
+                "card": card,
+                "reference_count": len(reference_texts),
+                "created_at": datetime.now().isoformat(),
+            }
+            self._save()
+        return reference_hash
+    
+    def delete(self, reference_hash: str) -> bool:
+        with self._lock:
+            self._refresh(force=True)
+            if reference_hash not in self._cards:
+                return False
+            del self._cards[reference_hash]
+            self._save()
+            return True
+    
+    def list_cards(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return [{"hash": key, **entry} for key, entry in self._cards.items()]
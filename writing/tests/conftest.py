@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# 各模块直接位于项目目录下（没有包结构），测试时把项目目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_backend import LLMBackend  # noqa: E402
+from local_llm_server import StandInConfig, make_server  # noqa: E402
+
+
+class FakeBackend(LLMBackend):
+    """不联网的大模型后端：按顺序返回预设输出（用完后重复最后一条），并记录收到的请求"""
+    
+    name = "fake"
+    
+    def __init__(self, outputs=("输出",), model="fake-model", prompt_tokens=10, completion_tokens=5):
+        super().__init__(model)
+        self.outputs = list(outputs)
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.requests = []
+    
+    def _next_output(self, messages, kwargs):
+        self.requests.append({"messages": messages, **kwargs})
+        index = min(len(self.requests), len(self.outputs)) - 1
+        output = self.outputs[index]
+        if isinstance(output, BaseException):
+            raise output
+        return output
+    
+    def _usage(self):
+        return SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens,
+                               total_tokens=self.prompt_tokens + self.completion_tokens)
+    
+    def chat(self, messages, timeout, **kwargs):
+        output = self._next_output(messages, kwargs)
+        if kwargs.get("stream"):
+            return self._stream(output)
+        message = SimpleNamespace(content=output)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self._usage())
+    
+    async def achat(self, messages, timeout, **kwargs):
+        return self.chat(messages, timeout, **kwargs)
+    
+    def _stream(self, output):
+        for index in range(0, len(output), 2):
+            delta = SimpleNamespace(content=output[index:index + 2])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage())
+
+
+@pytest.fixture
+def fake_backend():
+    return FakeBackend()
+
+
+@pytest.fixture
+def stand_in():
+    """在随机端口启动不联网的替身服务，返回其base_url"""
+    config = StandInConfig(ttft=0, ttft_sigma=0, tokens_per_second=0,
+                           canned=[{"contains": "参考文案", "output": "替身输出"}])
+    server = make_server(port=0, config=config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/v3"
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from batch import BatchRunner, read_jsonl
+
+
+class FakeAgent:
+    """按步骤给文案加上标记，并记录处理过的文案"""
+    
+    def __init__(self):
+        self.seen = []
+    
+    def generate_style_draft(self, text, references):
+        self.seen.append(text)
+        if text == "bad":
+            raise RuntimeError("boom")
+        return f"{text}+style"
+    
+    def apply_preferences(self, draft, preferences):
+        return f"{draft}+prefs" if preferences else draft
+
+
+def write_jsonl(path, items):
+    path.write_text("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items), encoding="utf-8")
+
+
+def make_runner(agent, steps=("style", "preferences")):
+    return BatchRunner(agent, list(steps), [{"id": "p1", "content": "简洁"}], [], {"set": ["参考"]}, workers=2)
+
+
+def test_run_writes_one_result_per_item(tmp_path):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    write_jsonl(source, [
+        {"id": "a", "text": "one", "references": ["参考"]},
+        {"id": "b", "text": "bad", "reference_set": "set"},
+        {"text": "three", "reference_set": "set", "preference_ids": []},
+    ])
+    
+    summary = make_runner(FakeAgent()).run(str(source), str(output))
+    
+    assert summary == {"submitted": 3, "succeeded": 2, "failed": 1, "skipped": 0}
+    results = {item["id"]: item for item in read_jsonl(str(output))}
+    assert results["a"]["draft"] == "one+style+prefs"
+    assert results["b"]["error"] == "boom"
+    assert results["2"]["draft"] == "three+style"
+
+
+def test_resume_skips_succeeded_and_retries_failed(tmp_path):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    write_jsonl(source, [
+        {"id": "a", "text": "one", "references": ["参考"]},
+        {"id": "b", "text": "two", "references": ["参考"]},
+        {"id": "c", "text": "three", "references": ["参考"]},
+    ])
+    write_jsonl(output, [{"id": "a", "draft": "done"}, {"id": "b", "error": "timeout"}])
+    
+    agent = FakeAgent()
+    summary = make_runner(agent).run(str(source), str(output))
+    
+    assert sorted(agent.seen) == ["three", "two"]
+    assert summary["skipped"] == 1
+    assert summary["succeeded"] == 2
+    assert [item["id"] for item in read_jsonl(str(output))][:2] == ["a", "b"]
+
+
+def test_resume_drops_partial_last_line(tmp_path):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    write_jsonl(source, [
+        {"id": "a", "text": "one", "references": ["参考"]},
+        {"id": "b", "text": "two", "references": ["参考"]},
+    ])
+    # 上次运行写到一半时中断
+    output.write_text(json.dumps({"id": "a", "draft": "done"}) + "\n" + '{"id": "b", "dra', encoding="utf-8")
+    
+    agent = FakeAgent()
+    summary = make_runner(agent).run(str(source), str(output))
+    
+    assert agent.seen == ["two"]
+    assert summary["skipped"] == 1
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["a", "b"]
+
+
+def test_one_shot_cannot_be_combined():
+    with pytest.raises(ValueError, match="one_shot"):
+        make_runner(FakeAgent(), steps=("one_shot", "style"))
@@ -0,0 +1,83 @@
+"""分段处理：按段落切块、附带前后文，以及拼接时原样保留段落分隔"""
+import asyncio
+
+import pytest
+
+from ai_agent import AIAgent
+from async_ai_agent import AsyncAIAgent
+from chunking import ChunkingPolicy, split_chunks, stitch_chunks
+from response_cache import ResponseCache
+
+
+DRAFTS = [
+    "第一段。",
+    "第一段。\n第二段。\n第三段。",
+    "第一段。\n\n第二段。\n\n\n第三段。",
+    "第一段。\n  \n第二段。\n \n \n第三段。\n",
+    "\n".join(f"第{i}段，" + "字" * (i * 7 % 50) for i in range(40)),
+    "\n\n".join("很长的一段" * 100 for _ in range(3)),
+]
+
+
+@pytest.mark.parametrize("draft", DRAFTS)
+@pytest.mark.parametrize("max_chars", [1, 30, 200, 1500])
+def test_stitch_unchanged_chunks_round_trips(draft, max_chars):
+    chunks = split_chunks(draft, max_chars=max_chars, context_chars=10)
+    assert stitch_chunks(chunks, [chunk.text for chunk in chunks]) == draft
+
+
+@pytest.mark.parametrize("draft", DRAFTS)
+def test_chunks_respect_max_chars(draft):
+    for chunk in split_chunks(draft, max_chars=100):
+        # 单个段落超长时单独成块，不在段落中间切开
+        assert len(chunk.text) <= 100 or "\n" not in chunk.text
+
+
+def test_chunks_split_on_paragraph_boundaries():
+    chunks = split_chunks("甲甲甲\n\n乙乙乙\n\n丙丙丙", max_chars=8, context_chars=2)
+    assert [chunk.text for chunk in chunks] == ["甲甲甲\n\n乙乙乙", "丙丙丙"]
+    assert [chunk.separator for chunk in chunks] == ["\n\n", ""]
+
+
+def test_chunks_carry_neighbour_context():
+    chunks = split_chunks("甲甲甲\n乙乙乙\n丙丙丙", max_chars=3, context_chars=2)
+    assert [(chunk.before, chunk.after) for chunk in chunks] == [("", "乙乙"), ("甲甲", "丙丙"), ("乙乙", "")]
+
+
+def test_stitch_strips_results_and_keeps_separators():
+    chunks = split_chunks("甲\n\n乙\n丙", max_chars=1)
+    assert stitch_chunks(chunks, [" 一 \n", "\n二", "三\n\n"]) == "一\n\n二\n三"
+
+
+def test_policy_applies_only_to_long_drafts():
+    policy = ChunkingPolicy(enabled=True, min_chars=10)
+    assert not policy.applies_to("短")
+    assert policy.applies_to("长" * 10)
+    assert not ChunkingPolicy(enabled=False, min_chars=1).applies_to("长" * 10)
+
+
+LONG_DRAFT = "甲甲甲\n\n乙乙乙\n丙丙丙"
+PREFERENCES = [{"description": "更口语化"}]
+
+
+def make_agent(agent_class, backend):
+    backend.outputs = [" 改 "]
+    chunking = ChunkingPolicy(enabled=True, min_chars=1, max_chars=3, context_chars=2)
+    return agent_class(backend=backend, cache=ResponseCache(cache_dir=None), chunking=chunking)
+
+
+def test_agent_applies_preferences_per_chunk(fake_backend):
+    agent = make_agent(AIAgent, fake_backend)
+    assert agent.apply_preferences(LONG_DRAFT, PREFERENCES) == "改\n\n改\n改"
+    assert len(fake_backend.requests) == 3
+
+
+def test_stream_yields_chunks_in_order(fake_backend):
+    agent = make_agent(AIAgent, fake_backend)
+    assert list(agent.stream_preferences(LONG_DRAFT, PREFERENCES)) == ["改\n\n", "改\n", "改"]
+
+
+def test_async_agent_applies_preferences_per_chunk(fake_backend):
+    agent = make_agent(AsyncAIAgent, fake_backend)
+    assert asyncio.run(agent.apply_preferences(LONG_DRAFT, PREFERENCES)) == "改\n\n改\n改"
+    assert len(fake_backend.requests) == 3
@@ -0,0 +1,107 @@
+import pytest
+
+from ai_agent import AIAgent, EditSession
+from response_cache import ResponseCache
+from rate_limit import RateLimiter
+from resilience import CircuitBreaker, LLMCallError, RetryPolicy
+
+
+class ContextBackend:
+    """在FakeBackend上增加服务端上下文：记录创建的上下文和每轮发送的消息，可模拟上下文过期"""
+    
+    supports_context = True
+    
+    def __init__(self, backend, error=None):
+        self.backend = backend
+        self.error = error
+        self.contexts = []
+        self.context_turns = []
+    
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+    
+    def create_context(self, messages, ttl, timeout):
+        self.contexts.append(messages)
+        return f"ctx-{len(self.contexts)}"
+    
+    def context_chat(self, context_id, messages, timeout, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.context_turns.append((context_id, messages))
+        return self.backend.chat(messages, timeout, **kwargs)
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+@pytest.fixture(autouse=True)
+def fresh_endpoint(monkeypatch):
+    """熔断器和限流器按模型端点在进程内共享，每个测试使用新的，避免失败计数互相影响"""
+    monkeypatch.setattr(CircuitBreaker, "_registry", {})
+    monkeypatch.setattr(RateLimiter, "_registry", {})
+
+
+def make_agent(backend):
+    return AIAgent(backend=backend, cache=ResponseCache(cache_dir=None), retry_policy=RetryPolicy(max_attempts=1))
+
+
+def test_local_history_sends_draft_once(fake_backend):
+    fake_backend.outputs = ["第一版", "第二版", "第三版"]
+    session = EditSession(make_agent(fake_backend), use_context=False)
+    
+    assert session.edit("原始文案", "更简洁") == "第一版"
+    assert session.edit("第一版", "更口语化") == "第二版"
+    second = fake_backend.requests[-1]["messages"]
+    # 系统消息 + 第一轮（含原文） + 回复 + 只有指令的第二轮
+    assert [m["role"] for m in second] == ["system", "user", "assistant", "user"]
+    assert "原始文案" in second[1]["content"]
+    assert "第一版" not in second[3]["content"]
+    
+    # 用户在两轮之间手动改过文案时附上新文案
+    assert session.edit("手动改过的第二版", "加个结尾") == "第三版"
+    assert "手动改过的第二版" in fake_backend.requests[-1]["messages"][-1]["content"]
+    assert session.stats() == {"mode": "local", "turns": 3, "history_tokens": session._history_tokens()}
+
+
+def test_history_is_trimmed_to_budget(fake_backend):
+    fake_backend.outputs = ["改" * 50]
+    session = EditSession(make_agent(fake_backend), max_history_tokens=120, use_context=False)
+    for instruction in ("一", "二", "三", "四"):
+        session.edit("改" * 50, instruction)
+    # 超出预算时丢弃最早的轮次，最近一轮始终保留
+    assert len(session.messages) < 1 + 2 * 4
+    assert session.messages[-1]["role"] == "assistant"
+
+
+def test_server_context_sends_only_new_turns(fake_backend):
+    backend = ContextBackend(fake_backend)
+    fake_backend.outputs = ["第一版", "第二版"]
+    session = EditSession(make_agent(backend))
+    
+    session.edit("原始文案", "更简洁")
+    assert "".join(session.stream_edit("第一版", "更口语化")) == "第二版"
+    
+    assert len(backend.contexts) == 1
+    assert [len(messages) for _, messages in backend.context_turns] == [1, 1]
+    assert "原始文案" not in backend.context_turns[1][1][0]["content"]
+    assert session.stats()["mode"] == "context"
+
+
+def test_expired_context_falls_back_to_local_history(fake_backend):
+    backend = ContextBackend(fake_backend, error=ValueError("context expired"))
+    session = EditSession(make_agent(backend))
+    
+    assert session.edit("原始文案", "更简洁") == "输出"
+    assert session.stats()["mode"] == "local"
+    # 本地历史为空时必须附上完整文案
+    assert "原始文案" in fake_backend.requests[-1]["messages"][-1]["content"]
+
+
+def test_retryable_context_errors_are_raised(fake_backend):
+    session = EditSession(make_agent(ContextBackend(fake_backend, error=Throttled("slow down"))))
+    with pytest.raises(LLMCallError):
+        session.edit("原始文案", "更简洁")
+    # 限流等可重试的错误不改用本地历史
+    assert session.context_id == "ctx-1"
+    assert fake_backend.requests == []
@@ -0,0 +1,129 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ai_agent import AIAgent
+from hedging import HedgingPolicy, HedgeLeg, HedgeAbortedError
+from metrics import MetricsRegistry
+from response_cache import ResponseCache
+
+
+def test_fast_primary_is_not_hedged():
+    policy = HedgingPolicy(delay=0.5)
+    assert policy.run("style_draft", lambda leg: "primary") == "primary"
+    stats = policy.stats()
+    assert stats["requests"] == 1
+    assert stats["hedges_issued"] == 0
+
+
+def test_primary_runs_on_the_callers_thread():
+    policy = HedgingPolicy(delay=0.5)
+    assert policy.run("style_draft", lambda leg: threading.current_thread()) is threading.current_thread()
+
+
+def test_slow_primary_is_hedged_and_aborted():
+    policy = HedgingPolicy(delay=0.02)
+    primary_thread = threading.current_thread()
+    
+    def call(leg):
+        if threading.current_thread() is not primary_thread:
+            return "hedge"
+        # 主请求一直等到被中断
+        for _ in range(100):
+            if leg.aborted:
+                raise HedgeAbortedError()
+            time.sleep(0.01)
+        return "primary"
+    
+    assert policy.run("style_draft", call) == "hedge"
+    stats = policy.stats()
+    assert stats["hedges_issued"] == 1
+    assert stats["hedges_won"] == 1
+    assert stats["losers_aborted"] == 1
+    assert stats["hedge_win_rate"] == 1.0
+
+
+def test_losing_hedge_that_completes_counts_extra_tokens():
+    policy = HedgingPolicy(delay=0.01)
+    primary_thread = threading.current_thread()
+    
+    def call(leg):
+        if threading.current_thread() is primary_thread:
+            time.sleep(0.05)
+            return SimpleNamespace(name="primary", usage=None)
+        # 对冲请求不检查中断，来不及中断而完成
+        time.sleep(0.1)
+        return SimpleNamespace(name="hedge", usage=SimpleNamespace(prompt_tokens=7, completion_tokens=3))
+    
+    assert policy.run("style_draft", call).name == "primary"
+    time.sleep(0.2)
+    stats = policy.stats()
+    assert stats["hedges_won"] == 0
+    assert stats["extra_prompt_tokens"] == 7
+    assert stats["extra_completion_tokens"] == 3
+
+
+def test_failed_primary_falls_back_to_hedge():
+    policy = HedgingPolicy(delay=0.01)
+    primary_thread = threading.current_thread()
+    
+    def call(leg):
+        if threading.current_thread() is primary_thread:
+            time.sleep(0.05)
+            raise ConnectionError("primary failed")
+        return "hedge"
+    
+    assert policy.run("style_draft", call) == "hedge"
+    assert policy.stats()["hedges_won"] == 1
+
+
+def test_primary_error_is_raised_without_hedge():
+    policy = HedgingPolicy(delay=1)
+    
+    def call(leg):
+        raise ConnectionError("primary failed")
+    
+    with pytest.raises(ConnectionError):
+        policy.run("style_draft", call)
+
+
+def test_abort_closes_attached_stream():
+    leg = HedgeLeg()
+    closed = []
+    leg.attach(lambda: closed.append(1))
+    leg.abort()
+    leg.abort()
+    assert leg.aborted and closed == [1]
+    
+    # 已中断后登记的流立即关闭
+    late = HedgeLeg()
+    late.abort()
+    late.attach(lambda: closed.append(2))
+    assert closed == [1, 2]
+
+
+def test_agent_hedged_request_is_read_as_a_stream(fake_backend):
+    fake_backend.outputs = ["对冲模式下的输出"]
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), metrics=MetricsRegistry(),
+                    hedging=HedgingPolicy(delay=5))
+    assert agent.generate_style_draft("文案", ["参考"]) == "对冲模式下的输出"
+    assert fake_backend.requests[0]["stream"] is True
+    # 拼成的完整响应带着流末尾的token用量
+    assert agent.metrics.snapshot()["steps"]["style_draft"]["prompt_tokens"] == fake_backend.prompt_tokens
+
+
+def test_p90_delay_needs_enough_samples():
+    policy = HedgingPolicy(min_samples=10)
+    assert policy.hedge_delay("one_shot") is None
+    for i in range(10):
+        policy.record_latency("one_shot", float(i))
+    assert policy.hedge_delay("one_shot") == 9.0
+    assert policy.hedge_delay("preferences") is None
+
+
+def test_applies_to_configured_steps_only():
+    policy = HedgingPolicy(steps=["one_shot"])
+    assert policy.applies_to("one_shot")
+    assert not policy.applies_to("style_draft")
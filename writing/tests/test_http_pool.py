@@ -0,0 +1,60 @@
+"""HTTP连接池：进程内共享的客户端、环境变量配置和启动时的连接预热"""
+import pytest
+
+from ai_agent import AIAgent
+from http_pool import HTTPPool
+from llm_backend import LocalBackend
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    """默认连接池在进程内共享，每个测试重新创建"""
+    monkeypatch.setattr(HTTPPool, "_default", None)
+
+
+def test_default_reads_environment(monkeypatch, fresh_pool):
+    monkeypatch.setenv("AI_HTTP_POOL_SIZE", "8")
+    monkeypatch.setenv("AI_HTTP_KEEPALIVE", "4")
+    pool = HTTPPool.default()
+    assert (pool.pool_size, pool.keepalive) == (8, 4)
+    assert HTTPPool.default() is pool
+
+
+def test_http2_without_h2_falls_back(monkeypatch):
+    monkeypatch.setattr("importlib.util.find_spec", lambda name: None)
+    assert HTTPPool(http2=True).http2 is False
+
+
+def test_backends_share_one_client(stand_in, fresh_pool):
+    first = LocalBackend(base_url=stand_in)
+    second = LocalBackend(base_url=stand_in)
+    assert first.http_pool.client() is second.http_pool.client()
+
+
+def test_warm_up_opens_connections(stand_in, fresh_pool):
+    backend = LocalBackend(base_url=stand_in)
+    result = backend.warm_up(connections=2)
+    assert result["connections"] == 2 and result["errors"] == []
+    assert backend.http_pool.stats()["warm_up"] == result
+    
+    # 预热后的连接可直接用于请求
+    agent = AIAgent(backend=backend, cache=ResponseCache(cache_dir=None))
+    assert agent.generate_style_draft("原始文案", ["参考文案"]) == "替身输出"
+
+
+def test_warm_up_reports_unreachable_server(capsys):
+    result = HTTPPool().warm_up("http://127.0.0.1:1/api/v3", connections=1, timeout=1)
+    assert result["connections"] == 0
+    assert len(result["errors"]) == 1
+    assert "连接预热失败" in capsys.readouterr().out
+
+
+def test_agent_warm_up_is_off_by_default(monkeypatch, fake_backend):
+    calls = []
+    monkeypatch.delenv("AI_HTTP_WARMUP", raising=False)
+    monkeypatch.setattr(fake_backend, "warm_up", lambda connections: calls.append(connections))
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None))
+    agent.warm_up()
+    agent.warm_up(connections=3, background=False)
+    assert calls == [3]
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import JobQueue, PartialJobError
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), retry_delay=0, poll_interval=0.01)
+
+
+def test_submit_requires_registered_kind(queue):
+    with pytest.raises(ValueError):
+        queue.submit("unknown", {})
+
+
+def test_run_once_stores_result(queue):
+    queue.register("double", lambda payload: {"value": payload["value"] * 2})
+    job_id = queue.submit("double", {"value": 21})
+    
+    assert queue.get(job_id)["status"] == "pending"
+    assert queue.run_once()
+    assert not queue.run_once()
+    
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["attempts"] == 1
+    assert job["result"] == {"value": 42}
+    assert queue.stats() == {"done": 1}
+
+
+def test_failed_job_is_retried_then_marked_failed(queue):
+    calls = []
+    
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError("boom")
+    
+    queue.register("flaky", flaky)
+    job_id = queue.submit("flaky", {}, max_attempts=2)
+    
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert (job["status"], job["error"]) == ("pending", "boom")
+    
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == ("failed", 2)
+    assert len(calls) == 2
+
+
+def test_partial_failure_retries_with_updated_payload(queue):
+    payloads = []
+    
+    def two_parts(payload):
+        payloads.append(payload)
+        if "first" not in payload:
+            raise PartialJobError("second failed", {**payload, "first": "done"})
+        return payload
+    
+    queue.register("two_parts", two_parts)
+    job_id = queue.submit("two_parts", {"n": 1})
+    assert queue.run_once()
+    assert queue.get(job_id)["error"] == "second failed"
+    assert queue.run_once()
+    assert payloads == [{"n": 1}, {"n": 1, "first": "done"}]
+    assert queue.get(job_id)["result"] == {"n": 1, "first": "done"}
+
+
+def test_expired_lease_is_reclaimed_after_restart(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    crashed = JobQueue(path, lease_seconds=0)
+    crashed.register("echo", lambda payload: payload)
+    job_id = crashed.submit("echo", {"text": "hi"})
+    # 模拟领取后进程崩溃：任务停在running，租约随即过期
+    assert crashed._claim() is not None
+    assert crashed.get(job_id)["status"] == "running"
+    
+    restarted = JobQueue(path)
+    restarted.register("echo", lambda payload: payload)
+    assert restarted.run_once()
+    job = restarted.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"text": "hi"}
+
+
+def test_worker_threads_drain_the_queue(queue):
+    queue.register("echo", lambda payload: payload)
+    job_ids = [queue.submit("echo", {"n": n}) for n in range(5)]
+    queue.start()
+    try:
+        for _ in range(200):
+            if all(queue.get(job_id)["status"] == "done" for job_id in job_ids):
+                break
+            time.sleep(0.01)
+    finally:
+        queue.stop(timeout=1)
+    assert [queue.get(job_id)["result"] for job_id in job_ids] == [{"n": n} for n in range(5)]
+
+
+def test_expired_lease_counts_towards_max_attempts(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path, lease_seconds=0)
+    queue.register("echo", lambda payload: payload)
+    job_id = queue.submit("echo", {}, max_attempts=1)
+    # 领取后进程崩溃，尝试次数已用尽的任务不再被领取
+    assert queue._claim() is not None
+    
+    restarted = JobQueue(path)
+    restarted.register("echo", lambda payload: payload)
+    assert not restarted.run_once()
+    job = restarted.get(job_id)
+    assert (job["status"], job["attempts"]) == ("failed", 1)
+
+
+def test_heartbeat_renews_running_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.3, poll_interval=0.01)
+    release = threading.Event()
+    queue.register("slow", lambda payload: release.wait(2))
+    job_id = queue.submit("slow", {})
+    queue.start()
+    try:
+        for _ in range(200):
+            if queue.get(job_id)["status"] == "running":
+                break
+            time.sleep(0.01)
+        # 执行时间超过租约，心跳续约后租约仍未过期
+        time.sleep(0.5)
+        with queue._connect() as conn:
+            lease_until = conn.execute("SELECT lease_until FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        assert lease_until > time.time()
+    finally:
+        release.set()
+        queue.stop(timeout=1)
+    assert queue.get(job_id)["status"] == "done"
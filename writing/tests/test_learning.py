@@ -0,0 +1,112 @@
+from data_manager import DataManager
+from deduplication import DeduplicationEngine
+from job_queue import JobQueue
+from learning import LearningGate, learn_and_merge, learn_concurrently, register_learning_job
+from resilience import LLMCallError
+
+
+class FakeAgent:
+    """学习偏好和规则的替身，可以让其中一个调用失败"""
+    
+    def __init__(self, preferences, rules, fail=None):
+        self.preferences = preferences
+        self.rules = rules
+        self.fail = fail
+        self.calls = []
+    
+    def learn_preferences(self, original_draft, user_modified_draft, deadline=None):
+        self.calls.append("preferences")
+        if self.fail == "preferences":
+            raise LLMCallError("学习偏好", "boom")
+        return list(self.preferences)
+    
+    def learn_rules(self, user_instructions, deadline=None):
+        self.calls.append("rules")
+        if self.fail == "rules":
+            raise LLMCallError("学习规则", "boom")
+        return list(self.rules)
+
+
+def make_manager(tmp_path):
+    return DataManager(str(tmp_path / "user_profile.json"))
+
+
+def test_one_failure_keeps_the_other_result():
+    agent = FakeAgent(["多用短句"], ["不用感叹号"], fail="rules")
+    preferences, rules, errors = learn_concurrently(agent, "AI终稿", "用户终稿", ["去掉感叹号"])
+    assert preferences == ["多用短句"]
+    assert rules == []
+    assert errors == {"rules": "学习规则失败: boom"}
+
+
+def test_learn_and_merge_deduplicates(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.add_user_preference("多用短句")
+    agent = FakeAgent(["多用短句", "语气轻松活泼"], ["不用感叹号"])
+    
+    result = learn_and_merge(agent, manager, DeduplicationEngine(), "AI终稿", "用户终稿", ["去掉感叹号"])
+    
+    assert result.new_preferences == ["语气轻松活泼"]
+    assert result.new_rules == ["不用感叹号"]
+    assert result.to_dict()["new_preferences"] == 1
+    assert [p["description"] for p in manager.get_user_preferences()] == ["多用短句", "语气轻松活泼"]
+    assert [r["instruction"] for r in manager.get_restriction_rules()] == ["不用感叹号"]
+
+
+def test_learning_job_runs_in_queue(tmp_path):
+    manager = make_manager(tmp_path)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    register_learning_job(queue, FakeAgent(["多用短句"], []), manager, DeduplicationEngine())
+    job_id = queue.submit("learn", {"ai_final_draft": "AI终稿", "user_final_draft": "用户终稿"})
+    
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"]["preferences"] == ["多用短句"]
+
+
+def test_learning_job_retries_only_the_failed_step(tmp_path):
+    manager = make_manager(tmp_path)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), retry_delay=0)
+    agent = FakeAgent(["多用短句"], ["不用感叹号"], fail="rules")
+    register_learning_job(queue, agent, manager, DeduplicationEngine())
+    job_id = queue.submit("learn", {"ai_final_draft": "AI终稿", "user_final_draft": "用户终稿",
+                                    "user_instructions": ["去掉感叹号"]})
+    
+    assert queue.run_once()
+    assert queue.get(job_id)["status"] == "pending"
+    
+    # 重试时偏好学习已经成功，只重新学习规则；这次偏好的输出即使措辞不同也不会再写入
+    agent.fail = None
+    agent.preferences = ["句子要短"]
+    assert queue.run_once()
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert sorted(agent.calls) == ["preferences", "rules", "rules"]
+    assert job["result"]["preferences"] == ["多用短句"]
+    assert job["result"]["rules"] == ["不用感叹号"]
+    assert [p["description"] for p in manager.get_user_preferences()] == ["多用短句"]
+
+
+def test_gate_skips_trivial_edits():
+    gate = LearningGate(min_change_ratio=0.05)
+    original = "今天天气很好，我们去公园散步吧。" * 10
+    assert gate.check(original, original + "  ") == "identical"
+    assert gate.check(original, original.replace("，", ",")) == "formatting_only"
+    assert gate.check(original, original.replace("公园", "河边", 1)) == "below_threshold"
+    assert gate.check(original, original.replace("公园", "河边")) is None
+    
+    stats = gate.stats()
+    assert stats["checked"] == 4
+    assert stats["learned"] == 1
+    assert stats["skipped"] == 3
+
+
+def test_skipped_preference_learning_still_learns_rules(tmp_path):
+    agent = FakeAgent(["多用短句"], ["不用感叹号"])
+    result = learn_and_merge(agent, make_manager(tmp_path), DeduplicationEngine(), "AI终稿", "AI终稿",
+                             ["去掉感叹号"], gate=LearningGate())
+    assert agent.calls == ["rules"]
+    assert result.skipped == "identical"
+    assert result.new_rules == ["不用感叹号"]
+    assert result.to_dict()["preferences_skipped"] == "identical"
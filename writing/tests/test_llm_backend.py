@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from ai_agent import AIAgent
+from async_ai_agent import AsyncAIAgent
+from llm_backend import LocalBackend, create_backend, needs_api_key
+from response_cache import ResponseCache
+
+
+def test_create_backend_by_name(monkeypatch):
+    monkeypatch.setenv("AI_BACKEND", "local")
+    assert isinstance(create_backend(), LocalBackend)
+    assert not needs_api_key()
+    assert needs_api_key("ark")
+    with pytest.raises(ValueError):
+        create_backend("unknown")
+
+
+def test_agent_runs_against_stand_in(stand_in):
+    agent = AIAgent(backend=LocalBackend(base_url=stand_in), cache=ResponseCache(cache_dir=None))
+    assert agent.model == "local-stand-in"
+    assert agent.generate_style_draft("原始文案", ["参考文案一"]) == "替身输出"
+    assert "".join(agent.stream_style_draft("另一条文案", ["参考文案二"])) == "替身输出"
+    assert agent.learn_rules(["不要用感叹号"]) == ["句子简短有力，多用短句", "避免使用感叹号"]
+
+
+def test_async_agent_runs_against_stand_in(stand_in):
+    async def main():
+        agent = AsyncAIAgent(backend=LocalBackend(base_url=stand_in), cache=ResponseCache(cache_dir=None))
+        try:
+            return await agent.generate_style_draft("原始文案", ["参考文案一"])
+        finally:
+            await agent.close()
+    
+    assert asyncio.run(main()) == "替身输出"
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ai_agent import AIAgent
+from metrics import MetricsRegistry, usage_tokens
+from response_cache import ResponseCache
+from resilience import LLMCallError, RetryPolicy
+
+
+def test_snapshot_totals_and_percentiles():
+    registry = MetricsRegistry()
+    for wall_time in (0.1, 0.2, 0.3, 0.4):
+        registry.record("style_draft", prompt_tokens=100, completion_tokens=20, wall_time=wall_time, ttft=0.05)
+    registry.record("style_draft", wall_time=0.001, cached=True)
+    registry.record("style_draft", wall_time=9.0, error=True)
+    
+    step = registry.snapshot()["steps"]["style_draft"]
+    assert step["calls"] == 6
+    assert step["cached"] == 1
+    assert step["errors"] == 1
+    assert step["prompt_tokens"] == 400
+    assert step["completion_tokens"] == 80
+    # 缓存命中和失败的调用不计入延迟分位数
+    assert step["wall_time_avg"] == 0.25
+    assert step["wall_time_p50"] == 0.3
+    assert step["wall_time_p95"] == 0.4
+    assert step["ttft_avg"] == 0.05
+
+
+def test_session_collects_only_its_own_calls():
+    registry = MetricsRegistry()
+    registry.record("preferences", prompt_tokens=1)
+    with registry.session() as session:
+        registry.record("style_draft", prompt_tokens=30, completion_tokens=10, wall_time=0.5)
+        registry.record("style_draft", wall_time=0.01, cached=True)
+    registry.record("restrictions", prompt_tokens=1)
+    
+    summary = session.summary()
+    assert summary["prompt_tokens"] == 30
+    assert summary["completion_tokens"] == 10
+    assert list(summary["steps"]) == ["style_draft"]
+    assert summary["steps"]["style_draft"]["calls"] == 2
+    assert summary["steps"]["style_draft"]["cached"] == 1
+
+
+def test_usage_tokens_handles_missing_usage():
+    assert usage_tokens(None) == {"prompt_tokens": 0, "completion_tokens": 0}
+    usage = SimpleNamespace(prompt_tokens=3, completion_tokens=None)
+    assert usage_tokens(usage) == {"prompt_tokens": 3, "completion_tokens": 0}
+
+
+def test_agent_records_calls_cache_hits_and_errors(fake_backend):
+    registry = MetricsRegistry()
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), metrics=registry)
+    agent.generate_style_draft("文案", ["参考"])
+    agent.generate_style_draft("文案", ["参考"])
+    assert "".join(agent.stream_style_draft("另一条", ["参考"])) == "输出"
+    
+    step = registry.snapshot()["steps"]["style_draft"]
+    assert step["calls"] == 3
+    assert step["cached"] == 1
+    assert step["prompt_tokens"] == 20
+    assert step["completion_tokens"] == 10
+    assert step["ttft_avg"] is not None
+    
+    fake_backend.outputs = [ValueError("bad request")]
+    failing = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), metrics=registry,
+                      retry_policy=RetryPolicy(max_attempts=1))
+    with pytest.raises(LLMCallError):
+        failing.apply_preferences("文案", [{"id": "p1", "description": "简洁"}])
+    assert registry.snapshot()["steps"]["preferences"]["errors"] == 1
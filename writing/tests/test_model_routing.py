@@ -0,0 +1,110 @@
+"""模型路由：按步骤选择模型和最大输出长度，超时后改用备用模型"""
+import asyncio
+import json
+
+import pytest
+
+from ai_agent import AIAgent
+from async_ai_agent import AsyncAIAgent
+from model_routing import ModelRouter, StepRoute
+from rate_limit import RateLimiter
+from resilience import CircuitBreaker, LLMCallError, RetryPolicy
+from response_cache import ResponseCache
+
+
+class Unavailable(Exception):
+    status_code = 503
+
+
+@pytest.fixture(autouse=True)
+def fresh_endpoint(monkeypatch):
+    """熔断器和限流器按模型端点在进程内共享，每个测试使用新的，避免失败计数互相影响"""
+    monkeypatch.setattr(CircuitBreaker, "_registry", {})
+    monkeypatch.setattr(RateLimiter, "_registry", {})
+
+
+def make_agent(agent_class, backend, routes):
+    return agent_class(backend=backend, cache=ResponseCache(cache_dir=None), retry_policy=RetryPolicy(max_attempts=1),
+                       router=ModelRouter.from_dict(routes))
+
+
+def test_route_lookup_order():
+    router = ModelRouter.from_dict({"restrictions": {"model": "a"}, "default": {"model": "d"}})
+    assert router.route("restrictions").model == "a"
+    # 派生步骤沿用主步骤的路由
+    assert router.route("restrictions_patch").model == "a"
+    assert router.route("preferences").model == "d"
+    assert ModelRouter().route("preferences").model is None
+
+
+def test_from_env_accepts_json_or_file(monkeypatch, tmp_path):
+    monkeypatch.setenv("AI_MODEL_ROUTES", '{"learn_rules": {"model": "fast", "max_tokens": "512"}}')
+    route = ModelRouter.from_env().route("learn_rules")
+    assert (route.model, route.max_tokens) == ("fast", 512)
+    
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"default": {"timeout": 30}}), encoding="utf-8")
+    monkeypatch.setenv("AI_MODEL_ROUTES", str(path))
+    assert ModelRouter.from_env().route("one_shot").timeout == 30.0
+
+
+def test_from_env_ignores_unreadable_table(monkeypatch):
+    monkeypatch.setenv("AI_MODEL_ROUTES", "{不是JSON")
+    assert ModelRouter.from_env().routes == {}
+
+
+def test_agent_sends_routed_model_and_max_tokens(fake_backend):
+    agent = make_agent(AIAgent, fake_backend, {"learn_rules": {"model": "fast", "max_tokens": 256}})
+    agent.learn_rules(["更简洁"])
+    agent.apply_preferences("文案", [{"description": "口语化"}])
+    assert (fake_backend.requests[0]["model"], fake_backend.requests[0]["max_tokens"]) == ("fast", 256)
+    assert fake_backend.requests[1]["model"] is None
+    assert "max_tokens" not in fake_backend.requests[1]
+
+
+def test_cache_key_depends_on_route(fake_backend):
+    agent = make_agent(AIAgent, fake_backend, {})
+    messages = [{"role": "user", "content": "你好"}]
+    assert agent._cache_key(messages, True) == agent._cache_key(messages, True, StepRoute())
+    assert agent._cache_key(messages, True) != agent._cache_key(messages, True, StepRoute(model="fast"))
+    assert agent._cache_key(messages, True) != agent._cache_key(messages, True, StepRoute(max_tokens=100))
+
+
+def test_timeout_falls_back_without_caching(fake_backend):
+    fake_backend.outputs = [TimeoutError(), "备用模型输出", "主模型输出"]
+    agent = make_agent(AIAgent, fake_backend, {"preferences": {"fallback_model": "backup"}})
+    preferences = [{"description": "口语化"}]
+    
+    assert agent.apply_preferences("文案", preferences) == "备用模型输出"
+    assert fake_backend.requests[1]["model"] == "backup"
+    assert agent.router.stats()["fallbacks"] == {"preferences": 1}
+    # 备用模型的结果不写入缓存，下一次仍请求主模型
+    assert agent.apply_preferences("文案", preferences) == "主模型输出"
+    assert fake_backend.requests[2]["model"] is None
+
+
+def test_stream_falls_back_when_connecting_times_out(fake_backend):
+    fake_backend.outputs = [TimeoutError(), "备用模型输出"]
+    agent = make_agent(AIAgent, fake_backend, {"preferences": {"fallback_model": "backup"}})
+    assert "".join(agent.stream_preferences("文案", [{"description": "口语化"}])) == "备用模型输出"
+    assert fake_backend.requests[1]["model"] == "backup"
+
+
+def test_other_errors_do_not_fall_back(fake_backend):
+    fake_backend.outputs = [Unavailable(), "备用模型输出"]
+    agent = make_agent(AIAgent, fake_backend, {"preferences": {"fallback_model": "backup"}})
+    with pytest.raises(LLMCallError):
+        agent.apply_preferences("文案", [{"description": "口语化"}])
+    assert len(fake_backend.requests) == 1
+
+
+def test_async_agent_falls_back_on_timeout(fake_backend):
+    fake_backend.outputs = [TimeoutError(), "备用模型输出"]
+    agent = make_agent(AsyncAIAgent, fake_backend, {"default": {"fallback_model": "backup"}})
+    assert asyncio.run(agent.apply_preferences("文案", [{"description": "口语化"}])) == "备用模型输出"
+    assert fake_backend.requests[1]["model"] == "backup"
+
+
+def test_unknown_step_in_table_is_reported(fake_backend, capsys):
+    make_agent(AIAgent, fake_backend, {"no_such_step": {"model": "fast"}})
+    assert "no_such_step" in capsys.readouterr().out
@@ -0,0 +1,110 @@
+"""补丁模式：替换列表的解析，以及每个原片段必须恰好出现一次的应用规则"""
+import asyncio
+
+import pytest
+
+from ai_agent import AIAgent
+from async_ai_agent import AsyncAIAgent
+from patches import PatchMode, parse_patches, apply_patches
+from response_cache import ResponseCache
+
+
+def test_parse_plain_list():
+    assert parse_patches('[{"find": "苹果", "replace": "香蕉"}]') == [{"find": "苹果", "replace": "香蕉"}]
+
+
+def test_parse_code_block_with_surrounding_text():
+    content = '修改如下：\n```json\n[{"find": "甲", "replace": "乙"}]\n```\n以上。'
+    assert parse_patches(content) == [{"find": "甲", "replace": "乙"}]
+
+
+def test_parse_empty_list():
+    assert parse_patches("[]") == []
+
+
+@pytest.mark.parametrize("content", [
+    "整篇改写后的文案",
+    '[{"find": "甲", "replace": "乙"}',
+    '{"find": "甲", "replace": "乙"}',
+    '[{"find": "", "replace": "乙"}]',
+    '[{"find": "甲"}]',
+    '[{"find": "甲", "replace": 1}]',
+    '["甲"]',
+])
+def test_parse_rejects_malformed_output(content):
+    assert parse_patches(content) is None
+
+
+def test_apply_replaces_unique_fragments():
+    patches = [{"find": "苹果", "replace": "香蕉"}, {"find": "很甜", "replace": "很香"}]
+    assert apply_patches("苹果很甜。", patches) == "香蕉很香。"
+
+
+def test_apply_in_order_on_the_current_text():
+    # 第二个补丁针对的是第一个补丁应用后的文本
+    patches = [{"find": "苹果", "replace": "红苹果"}, {"find": "红苹果很", "replace": "它很"}]
+    assert apply_patches("苹果很甜。", patches) == "它很甜。"
+
+
+def test_apply_fails_when_fragment_is_missing():
+    assert apply_patches("苹果很甜。", [{"find": "香蕉", "replace": "梨"}]) is None
+
+
+def test_apply_fails_when_fragment_is_ambiguous():
+    assert apply_patches("苹果，苹果。", [{"find": "苹果", "replace": "香蕉"}]) is None
+
+
+def test_apply_fails_when_earlier_patch_makes_fragment_ambiguous():
+    patches = [{"find": "甲", "replace": "乙"}, {"find": "乙", "replace": "丙"}]
+    assert apply_patches("甲乙", patches) is None
+
+
+def test_apply_fails_as_a_whole():
+    draft = "苹果很甜。香蕉很软。"
+    patches = [{"find": "苹果", "replace": "梨"}, {"find": "不存在", "replace": "x"}]
+    assert apply_patches(draft, patches) is None
+
+
+def test_apply_empty_list_keeps_draft():
+    assert apply_patches("原文", []) == "原文"
+
+
+@pytest.mark.parametrize("mode, draft, expected", [
+    ("off", "字" * 1000, False),
+    ("on", "短", True),
+    ("auto", "字" * 399, False),
+    ("auto", "字" * 400, True),
+])
+def test_mode_applies_to(mode, draft, expected):
+    assert PatchMode(mode, min_chars=400).applies_to(draft) is expected
+
+
+def make_agent(agent_class, backend, outputs):
+    backend.outputs = outputs
+    agent = agent_class(backend=backend, cache=ResponseCache(cache_dir=None), patch_mode=PatchMode("on"))
+    return agent
+
+
+def test_agent_applies_patch_locally(fake_backend):
+    agent = make_agent(AIAgent, fake_backend, ['[{"find": "苹果", "replace": "香蕉"}]'])
+    assert agent.modify_with_instruction("苹果很甜。", "换成香蕉") == "香蕉很甜。"
+    assert len(fake_backend.requests) == 1
+    assert agent.patch_mode.stats()["applied"] == 1
+
+
+def test_agent_falls_back_to_full_rewrite_when_patch_does_not_match(fake_backend):
+    agent = make_agent(AIAgent, fake_backend, ['[{"find": "梨", "replace": "香蕉"}]', "香蕉很甜。"])
+    assert agent.apply_restrictions("苹果很甜。", [{"instruction": "不写苹果"}]) == "香蕉很甜。"
+    assert len(fake_backend.requests) == 2
+    assert agent.patch_mode.stats()["fallback"] == 1
+
+
+def test_stream_yields_patched_draft_at_once(fake_backend):
+    agent = make_agent(AIAgent, fake_backend, ['[{"find": "苹果", "replace": "香蕉"}]'])
+    assert list(agent.stream_instruction_edit("苹果很甜。", "换成香蕉")) == ["香蕉很甜。"]
+
+
+def test_async_agent_applies_patch_locally(fake_backend):
+    agent = make_agent(AsyncAIAgent, fake_backend, ['[{"find": "苹果", "replace": "香蕉"}]'])
+    assert asyncio.run(agent.modify_with_instruction("苹果很甜。", "换成香蕉")) == "香蕉很甜。"
+    assert len(fake_backend.requests) == 1
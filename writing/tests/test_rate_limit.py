@@ -0,0 +1,158 @@
+"""限流：并发上限和令牌桶的等待与超时，以及AIMD并发调整（429、超时减半，成功缓慢增加）"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from async_ai_agent import AsyncAIAgent
+from rate_limit import RateLimiter, RateLimitTimeoutError, TokenBucket, estimate_tokens, is_throttled
+from resilience import Deadline, DeadlineExceededError, RetryPolicy
+from response_cache import ResponseCache
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def _limiter(**kwargs):
+    limiter = RateLimiter(**kwargs)
+    limiter.DECREASE_COOLDOWN = 0
+    return limiter
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([]) == 1
+    assert estimate_tokens([{"role": "user", "content": "你好" * 50}]) > estimate_tokens([{"content": "你好"}])
+    assert estimate_tokens([{"role": "user", "content": None}]) == 1
+
+
+def test_is_throttled():
+    assert is_throttled(Throttled())
+    assert not is_throttled(ValueError())
+
+
+def test_concurrency_limit_blocks_until_release():
+    limiter = _limiter(initial_concurrency=1, min_concurrency=1)
+    permit = limiter.acquire(10, Deadline(1))
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire(10, Deadline(0.05))
+    limiter.release(permit)
+    limiter.release(limiter.acquire(10, Deadline(1)))
+    assert limiter.in_flight == 0
+
+
+def test_release_is_idempotent():
+    limiter = _limiter()
+    permit = limiter.acquire(10, Deadline(1))
+    limiter.release(permit)
+    limiter.release(permit)
+    assert limiter.in_flight == 0
+    assert limiter.stats()["requests"] == 1
+
+
+def test_request_bucket_limits_rate():
+    limiter = _limiter(requests_per_minute=2)
+    limiter.acquire(1, Deadline(1))
+    limiter.acquire(1, Deadline(1))
+    # 补充一个请求配额需要30秒
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire(1, Deadline(0.1))
+
+
+def test_token_bucket_is_corrected_by_actual_usage():
+    limiter = _limiter(tokens_per_minute=100)
+    permit = limiter.acquire(80, Deadline(1))
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire(80, Deadline(0.05))
+    # 实际只用了10个token，多预占的70个退回
+    limiter.release(permit, total_tokens=10)
+    limiter.acquire(80, Deadline(0.05))
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    bucket.adjust(-1)
+    assert bucket.wait_time(1) == 0
+
+
+@pytest.mark.parametrize("error", [Throttled(), TimeoutError(), httpx.ReadTimeout("read timed out")])
+def test_throttling_and_timeouts_halve_the_limit(error):
+    limiter = _limiter(initial_concurrency=8)
+    limiter.release(limiter.acquire(1, Deadline(1)), error=error)
+    assert limiter.stats()["concurrency_limit"] == 4
+    assert limiter.stats()["decreases"] == 1
+
+
+def test_other_errors_keep_the_limit():
+    limiter = _limiter(initial_concurrency=8)
+    limiter.release(limiter.acquire(1, Deadline(1)), error=ValueError("bad request"))
+    assert limiter.concurrency_limit == 8
+
+
+def test_decrease_cooldown():
+    limiter = RateLimiter(initial_concurrency=8)
+    limiter._last_decrease = time.monotonic()
+    limiter.release(limiter.acquire(1, Deadline(1)), error=Throttled())
+    assert limiter.concurrency_limit == 8
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = _limiter(initial_concurrency=2, min_concurrency=1)
+    for _ in range(5):
+        limiter.release(limiter.acquire(1, Deadline(1)), error=Throttled())
+    assert limiter.concurrency_limit == 1
+
+
+def test_success_increases_additively_up_to_maximum():
+    limiter = _limiter(initial_concurrency=2, max_concurrency=3)
+    limiter.release(limiter.acquire(1, Deadline(1)))
+    assert limiter.concurrency_limit == pytest.approx(2.5)
+    for _ in range(10):
+        limiter.release(limiter.acquire(1, Deadline(1)))
+    assert limiter.concurrency_limit == 3
+
+
+def test_slow_success_counts_as_overload():
+    limiter = _limiter(initial_concurrency=8, latency_target=0.01)
+    permit = limiter.acquire(1, Deadline(1))
+    time.sleep(0.02)
+    limiter.release(permit)
+    assert limiter.concurrency_limit == 4
+
+
+def test_acquire_async_waits_without_blocking_the_loop():
+    limiter = _limiter(initial_concurrency=1, max_concurrency=1)
+    
+    async def main():
+        permit = await limiter.acquire_async(1, Deadline(1))
+        waiter = asyncio.create_task(limiter.acquire_async(1, Deadline(1)))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        limiter.release(permit)
+        permit = await waiter
+        with pytest.raises(RateLimitTimeoutError):
+            await limiter.acquire_async(1, Deadline(0.05))
+        limiter.release(permit)
+    
+    asyncio.run(main())
+    assert limiter.in_flight == 0
+
+
+def test_async_request_cancelled_at_deadline_counts_as_timeout(monkeypatch, fake_backend):
+    limiter = _limiter(initial_concurrency=8)
+    monkeypatch.setattr(RateLimiter, "_registry", {fake_backend.model: limiter})
+    
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(5)
+    
+    monkeypatch.setattr(fake_backend, "achat", hang)
+    agent = AsyncAIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None),
+                         retry_policy=RetryPolicy(max_attempts=1), step_timeout=0.05)
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(agent.apply_preferences("文案", [{"description": "口语化"}]))
+    # 被取消的请求按超时交还配额，而不是当作成功
+    assert limiter.stats()["concurrency_limit"] == 4
+    assert limiter.stats()["in_flight"] == 0
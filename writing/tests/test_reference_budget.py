@@ -0,0 +1,53 @@
+from ai_agent import AIAgent
+from reference_budget import ReferenceBudget, estimate_text_tokens
+from response_cache import ResponseCache
+
+
+def test_estimate_text_tokens():
+    assert estimate_text_tokens("") == 0
+    assert estimate_text_tokens("你好世界") == 4
+    assert estimate_text_tokens("hello world") == 3
+    assert estimate_text_tokens("你好，world！") == 2 + 2 + 2
+
+
+def test_within_budget_is_returned_unchanged():
+    texts = ["第一篇参考文案。", "第二篇参考文案。"]
+    result = ReferenceBudget(max_tokens=100).fit(texts)
+    assert result.texts == texts
+    assert not result.truncated
+    assert "未超出预算" in result.summary()
+
+
+def test_over_budget_keeps_representative_paragraphs():
+    on_style = "轻盈透气的面料，贴身舒适，通勤休闲都合适。"
+    off_style = "ABCDEFG XYZ 0123456789 QWERTY"
+    texts = [
+        f"{on_style}\n{off_style}",
+        f"{on_style}\n柔软亲肤的面料，贴身舒适，四季都合适。",
+    ]
+    budget = ReferenceBudget(max_tokens=estimate_text_tokens(on_style) * 2 + 5)
+    result = budget.fit(texts)
+    
+    assert result.truncated
+    assert result.kept_tokens <= budget.max_tokens
+    # 每篇参考文案至少保留一段，风格迥异的段落被删去
+    assert len(result.texts) == 2
+    assert all(off_style not in text for text in result.texts)
+    assert (result.dropped[0]["reference"], result.dropped[0]["paragraph"]) == (1, 2)
+    assert result.to_dict()["summary"].startswith("参考文案约")
+
+
+def test_from_env_zero_disables_budget(monkeypatch):
+    monkeypatch.setenv("AI_REFERENCE_TOKEN_BUDGET", "0")
+    assert ReferenceBudget.from_env() is None
+    monkeypatch.setenv("AI_REFERENCE_TOKEN_BUDGET", "500")
+    assert ReferenceBudget.from_env().max_tokens == 500
+
+
+def test_agent_sends_only_kept_references(fake_backend):
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None),
+                    reference_budget=ReferenceBudget(max_tokens=10))
+    agent.generate_style_draft("文案", ["短小精悍的参考。\n" + "冗长无关的段落" * 5])
+    prompt = fake_backend.requests[0]["messages"][-1]["content"]
+    assert "短小精悍的参考" in prompt
+    assert "冗长无关的段落" not in prompt
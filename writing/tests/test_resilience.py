@@ -0,0 +1,104 @@
+import time
+import asyncio
+
+import pytest
+
+from resilience import (
+    Deadline,
+    RetryPolicy,
+    CircuitBreaker,
+    LLMCallError,
+    DeadlineExceededError,
+    CircuitOpenError,
+    call_with_resilience,
+    async_call_with_resilience,
+)
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def flaky(failures, error=ServerError):
+    """前failures次调用抛出error，之后返回"ok"，并记录调用次数"""
+    calls = []
+    
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) <= failures:
+            raise error("boom")
+        return "ok"
+    return call, calls
+
+
+def fast_retry(max_attempts=3):
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0.001, max_delay=0.001)
+
+
+def test_retryable_error_is_retried_until_success():
+    call, calls = flaky(2)
+    breaker = CircuitBreaker()
+    result = call_with_resilience("测试", call, Deadline(5), fast_retry(), breaker)
+    assert result == "ok"
+    assert len(calls) == 3
+    assert breaker.snapshot() == {"state": CircuitBreaker.CLOSED, "consecutive_failures": 0}
+
+
+def test_non_retryable_error_fails_immediately():
+    call, calls = flaky(5, BadRequest)
+    with pytest.raises(LLMCallError) as info:
+        call_with_resilience("测试", call, Deadline(5), fast_retry(), CircuitBreaker())
+    assert len(calls) == 1
+    assert isinstance(info.value.cause, BadRequest)
+
+
+def test_gives_up_after_max_attempts():
+    call, calls = flaky(10)
+    with pytest.raises(LLMCallError):
+        call_with_resilience("测试", call, Deadline(5), fast_retry(3), CircuitBreaker())
+    assert len(calls) == 3
+
+
+def test_expired_deadline_raises_without_calling():
+    call, calls = flaky(0)
+    deadline = Deadline(0)
+    with pytest.raises(DeadlineExceededError):
+        call_with_resilience("测试", call, deadline, fast_retry(), CircuitBreaker())
+    assert calls == []
+
+
+def test_deadline_earliest():
+    deadline = Deadline(10)
+    assert deadline.earliest(60) is deadline
+    assert deadline.earliest(1).remaining() <= 1
+
+
+def test_breaker_opens_then_half_opens_after_recovery():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+    call, calls = flaky(10)
+    with pytest.raises(LLMCallError):
+        call_with_resilience("测试", call, Deadline(5), fast_retry(2), breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience("测试", call, Deadline(5), fast_retry(2), breaker)
+    assert len(calls) == 2
+    
+    time.sleep(0.06)
+    ok, _ = flaky(0)
+    assert call_with_resilience("测试", ok, Deadline(5), fast_retry(), breaker) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_async_timeout_counts_as_failure():
+    async def slow(timeout):
+        await asyncio.sleep(1)
+    
+    breaker = CircuitBreaker()
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(async_call_with_resilience("测试", slow, Deadline(0.05), fast_retry(), breaker))
+    assert breaker.snapshot()["consecutive_failures"] == 1
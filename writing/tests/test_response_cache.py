@@ -0,0 +1,113 @@
+"""响应缓存：按请求内容寻址，内存LRU命中、磁盘持久化、过期和按总大小淘汰"""
+import os
+import time
+
+from response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "写一段苹果的文案"}]
+
+
+def test_key_depends_on_model_messages_and_params():
+    key = ResponseCache.make_key("m", MESSAGES, {"temperature": 0})
+    assert key == ResponseCache.make_key("m", [dict(MESSAGES[0])], {"temperature": 0})
+    assert key != ResponseCache.make_key("other", MESSAGES, {"temperature": 0})
+    assert key != ResponseCache.make_key("m", MESSAGES, {"temperature": 1})
+    assert key != ResponseCache.make_key("m", [{"role": "user", "content": "写一段香蕉的文案"}], {"temperature": 0})
+
+
+def test_memory_hit_and_miss(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    assert cache.get("k") is None
+    cache.set("k", "结果")
+    assert cache.get("k") == "结果"
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["writes"]) == (1, 1, 1)
+
+
+def test_disk_survives_a_new_instance(tmp_path):
+    ResponseCache(cache_dir=str(tmp_path)).set("k", "结果")
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    assert cache.get("k") == "结果"
+    assert cache.stats()["disk_hits"] == 1
+    # 之后从内存命中
+    assert cache.get("k") == "结果"
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_memory_lru_keeps_recently_used_entries():
+    cache = ResponseCache(cache_dir=None, max_memory_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_seconds=60)
+    cache.set("k", "结果")
+    cache._memory["k"] = (time.time() - 120, "结果")
+    path = os.path.join(str(tmp_path), "k.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"created_at": %f, "value": "结果"}' % (time.time() - 120))
+    assert cache.get("k") is None
+    assert ResponseCache(cache_dir=str(tmp_path), ttl_seconds=60).get("k") is None
+
+
+def test_disk_evicts_least_recently_used_when_over_budget(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), max_memory_entries=1, max_disk_bytes=250)
+    value = "字" * 20
+    now = time.time()
+    for i, key in enumerate(["a", "b"]):
+        cache.set(key, value)
+        # 每个条目约110字节，两个以内不超出250字节的上限；a最久未使用
+        os.utime(os.path.join(str(tmp_path), f"{key}.json"), (now - 20 + i, now - 20 + i))
+    cache.set("c", value)
+    remaining = sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".json"))
+    assert remaining == ["b.json", "c.json"]
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_clear(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.set("k", "结果")
+    cache.clear()
+    assert cache.get("k") is None
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".json")]
+
+
+def test_disk_index_tracks_sizes(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.set("a", "结果")
+    cache.set("b", "另一个结果")
+    sizes = sum(os.path.getsize(os.path.join(str(tmp_path), f"{key}.json")) for key in ("a", "b"))
+    stats = cache.stats()
+    assert (stats["disk_entries"], stats["disk_bytes"]) == (2, sizes)
+    
+    # 新实例启动时扫描目录重建索引
+    assert ResponseCache(cache_dir=str(tmp_path)).stats()["disk_bytes"] == sizes
+
+
+def test_disk_hit_refreshes_eviction_order(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), max_memory_entries=1, max_disk_bytes=250)
+    value = "字" * 20
+    cache.set("a", value)
+    cache.set("b", value)
+    # a只在磁盘上，读取后变为最近使用，超出上限时淘汰b
+    assert cache.get("a") == value
+    cache.set("c", value)
+    remaining = sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".json"))
+    assert remaining == ["a.json", "c.json"]
+
+
+def test_sweep_removes_expired_files(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_seconds=60, sweep_interval=1000)
+    cache.set("old", "结果")
+    cache.set("new", "结果")
+    past = time.time() - 120
+    os.utime(os.path.join(str(tmp_path), "old.json"), (past, past))
+    cache._sweep()
+    assert sorted(os.listdir(str(tmp_path))) == ["new.json"]
+    assert cache.stats()["disk_entries"] == 1
@@ -0,0 +1,165 @@
+"""规则引擎：规则识别（编译）、本地应用、生成后检查和调用大模型之前的准备"""
+import pytest
+
+from ai_agent import AIAgent
+from response_cache import ResponseCache
+from rule_engine import RuleEngine, MechanicalRule, compile_rule
+
+
+def _compile(instruction):
+    compiled = compile_rule({"id": "r1", "instruction": instruction})
+    return None if compiled is None else [(rule.kind, rule.params) for rule in compiled]
+
+
+@pytest.mark.parametrize("instruction, expected", [
+    ("不要使用感叹号", [("max_count", {"target": "感叹号", "limit": 0})]),
+    ("破折号不要超过2个", [("max_count", {"target": "破折号", "limit": 2})]),
+    ("最多用两个分号", [("max_count", {"target": "分号", "limit": 2})]),
+    ("少用破折号和感叹号", [("max_count", {"target": "破折号", "limit": 2}),
+                        ("max_count", {"target": "感叹号", "limit": 2})]),
+    ("把“咱们”改成“我们”", [("replace", {"find": "咱们", "replace": "我们"})]),
+    ("用“我们”代替“咱们”", [("replace", {"find": "咱们", "replace": "我们"})]),
+    ("不要用“非常”和“十分”这些词", [("ban", {"phrases": ["非常", "十分"]})]),
+    ("每句话不超过二十个字", [("max_sentence_chars", {"limit": 20})]),
+    ("全文不超过100字", [("max_chars", {"limit": 100})]),
+    ("必须包含“新鲜”", [("must_include", {"phrases": ["新鲜"]})]),
+    ("不要使用感叹号；统一使用全角标点", [("max_count", {"target": "感叹号", "limit": 0}),
+                                ("fullwidth_punctuation", {})]),
+])
+def test_compile_recognizes_mechanical_rules(instruction, expected):
+    assert _compile(instruction) == expected
+
+
+@pytest.mark.parametrize("instruction", [
+    "更口语化",
+    "不要使用感叹号，语气更活泼",
+    "不要使用奇怪的符号",
+    "",
+])
+def test_compile_leaves_other_rules_to_the_model(instruction):
+    assert _compile(instruction) is None
+
+
+def test_compile_keeps_rule_id_and_instruction():
+    rule = compile_rule({"id": "r9", "instruction": "不要使用感叹号"})[0]
+    assert rule.rule_id == "r9"
+    assert rule.instruction == "不要使用感叹号"
+    assert rule.to_dict() == {"type": "max_count", "target": "感叹号", "limit": 0}
+
+
+def test_compile_structured_rule():
+    compiled = compile_rule({"id": "r1", "instruction": "随便写的说明",
+                             "mechanical": [{"type": "max_count", "target": "分号", "limit": 1},
+                                            {"type": "remove_emoji"}]})
+    assert [(rule.kind, rule.params) for rule in compiled] == [
+        ("max_count", {"target": "分号", "limit": 1}),
+        ("remove_emoji", {}),
+    ]
+
+
+def test_compile_invalid_structured_rule_is_ignored():
+    assert compile_rule({"id": "r1", "mechanical": {"type": "unknown"}}) is None
+
+
+def test_unknown_kind_raises():
+    with pytest.raises(ValueError):
+        MechanicalRule("unknown")
+
+
+@pytest.mark.parametrize("instruction, text, expected", [
+    ("不要使用感叹号", "好吃！！真的！太棒了!", "好吃。真的。太棒了。"),
+    ("破折号不要超过1个", "甲——乙——丙——丁", "甲——乙，丙，丁"),
+    ("不要使用双引号", "他说“你好”，然后\"走了\"", "他说你好，然后走了"),
+    ("不要用“非常”和“十分”这些词", "非常，好吃，十分好", "好吃，好"),
+    ("把“咱们”改成“我们”", "咱们走吧，咱们", "我们走吧，我们"),
+])
+def test_apply(instruction, text, expected):
+    engine = RuleEngine()
+    assert engine.apply(compile_rule({"instruction": instruction}), text) == expected
+
+
+def test_apply_result_passes_verify():
+    engine = RuleEngine()
+    rules = compile_rule({"instruction": "少用破折号和感叹号"})
+    text = "一——二——三——四！五！六！七！"
+    assert engine.verify(rules, text)
+    assert engine.verify(rules, engine.apply(rules, text)) == []
+
+
+def test_apply_skips_check_only_rules():
+    engine = RuleEngine()
+    rules = compile_rule({"instruction": "必须包含“新鲜”"})
+    assert engine.apply(rules, "苹果好吃") == "苹果好吃"
+    violations = engine.verify(rules, "苹果好吃")
+    assert len(violations) == 1
+    assert violations[0].to_dict()["type"] == "must_include"
+
+
+def test_split_separates_mechanical_rules():
+    engine = RuleEngine()
+    mechanical_rule = {"id": "r1", "instruction": "不要使用感叹号"}
+    model_rule = {"id": "r2", "instruction": "更口语化"}
+    check_only_rule = {"id": "r3", "instruction": "全文不超过100字"}
+    mechanical, remaining = engine.split([mechanical_rule, model_rule, check_only_rule])
+    assert [rule.rule_id for rule in mechanical] == ["r1"]
+    assert remaining == [model_rule, check_only_rule]
+
+
+def test_prepare_skips_rules_the_draft_already_satisfies():
+    engine = RuleEngine()
+    rules = [{"id": "r1", "instruction": "不要使用感叹号"},
+             {"id": "r2", "instruction": "全文不超过100字"},
+             {"id": "r3", "instruction": "必须包含“新鲜”"},
+             {"id": "r4", "instruction": "更口语化"}]
+    draft, model_rules, checks = engine.prepare("苹果好吃！", rules)
+    assert draft == "苹果好吃。"
+    # 字数上限已满足，不再交给大模型，但仍在生成后检查
+    assert [rule["id"] for rule in model_rules] == ["r3", "r4"]
+    assert sorted(rule.rule_id for rule in checks) == ["r1", "r2", "r3"]
+
+
+def test_prepare_without_model_rules_skips_the_call():
+    engine = RuleEngine()
+    draft, model_rules, _ = engine.prepare("好！", [{"id": "r1", "instruction": "不要使用感叹号"}])
+    assert draft == "好。"
+    assert model_rules == []
+    assert engine.stats()["model_calls_skipped"] == 1
+
+
+def test_disabled_engine_leaves_everything_to_the_model():
+    engine = RuleEngine(enabled=False)
+    rules = [{"id": "r1", "instruction": "不要使用感叹号"}]
+    draft, model_rules, checks = engine.prepare("好！", rules)
+    assert (draft, model_rules, checks) == ("好！", rules, [])
+    assert engine.checks(rules) == []
+
+
+def test_agent_applies_mechanical_rules_locally(fake_backend):
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), rule_engine=RuleEngine())
+    assert agent.apply_restrictions("好吃！", [{"id": "r1", "instruction": "不要使用感叹号"}]) == "好吃。"
+    assert fake_backend.requests == []
+
+
+def test_agent_sends_only_remaining_rules_to_the_model(fake_backend):
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), rule_engine=RuleEngine())
+    rules = [{"id": "r1", "instruction": "不要使用感叹号"}, {"id": "r2", "instruction": "更口语化"}]
+    assert agent.apply_restrictions("好吃！", rules) == "输出"
+    prompt = fake_backend.requests[0]["messages"][-1]["content"]
+    assert "更口语化" in prompt and "不要使用感叹号" not in prompt
+    assert "好吃。" in prompt
+
+
+def test_agent_repairs_violations_left_after_generation(fake_backend):
+    fake_backend.outputs = ["苹果好吃。", '[{"find": "苹果", "replace": "新鲜苹果"}]']
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), rule_engine=RuleEngine())
+    rules = [{"id": "r1", "instruction": "必须包含“新鲜”"}]
+    assert agent.generate_final_draft("写苹果", [], [], rules) == "新鲜苹果好吃。"
+    assert len(fake_backend.requests) == 2
+    assert agent.rule_engine.stats()["repair_calls"] == 1
+
+
+def test_agent_keeps_result_when_repair_fails(fake_backend):
+    fake_backend.outputs = ["苹果好吃。", "不是替换列表"]
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), rule_engine=RuleEngine())
+    rules = [{"id": "r1", "instruction": "必须包含“新鲜”"}]
+    assert agent.generate_final_draft("写苹果", [], [], rules) == "苹果好吃。"
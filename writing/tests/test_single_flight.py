@@ -0,0 +1,206 @@
+"""请求合并：相同请求只执行一次，结果和异常共享给等待的调用，执行完成后不再合并"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ai_agent import AIAgent
+from async_ai_agent import AsyncAIAgent
+from response_cache import ResponseCache
+from single_flight import SingleFlight, FlightAbortedError
+
+
+def test_join_elects_one_leader():
+    flight = SingleFlight()
+    leader, future = flight.join("k")
+    follower, shared = flight.join("k")
+    assert leader and not follower
+    assert shared is future
+    other_leader, _ = flight.join("other")
+    assert other_leader
+    
+    flight.finish("k", future, "结果")
+    assert flight.wait(shared) == "结果"
+    # 完成后移除，之后的相同请求重新执行
+    assert flight.join("k")[0]
+
+
+def test_leader_error_is_shared():
+    flight = SingleFlight()
+    _, future = flight.join("k")
+    _, shared = flight.join("k")
+    flight.finish("k", future, error=ValueError("失败"))
+    with pytest.raises(ValueError):
+        flight.wait(shared)
+    assert flight.stats()["shared_errors"] == 1
+
+
+def test_wait_timeout():
+    flight = SingleFlight()
+    _, future = flight.join("k")
+    with pytest.raises(TimeoutError):
+        flight.wait(future, timeout=0.01)
+
+
+def test_threads_coalesce_into_one_call():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Barrier(8)
+    
+    def request():
+        started.wait()
+        leader, future = flight.join("k")
+        if not leader:
+            return flight.wait(future, timeout=5)
+        calls.append(1)
+        threading.Event().wait(0.1)
+        flight.finish("k", future, "结果")
+        return "结果"
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: request(), range(8)))
+    assert results == ["结果"] * 8
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 7, 0)
+
+
+def _counting_call(calls, result="结果", delay=0.05, error=None):
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return call
+
+
+def test_do_async_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+    
+    async def main():
+        return await asyncio.gather(*[flight.do_async("k", _counting_call(calls)) for _ in range(5)])
+    
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("结果", False)] + [("结果", True)] * 4
+
+
+def test_do_async_without_key_or_disabled_runs_every_call():
+    calls = []
+    
+    async def main(flight, key):
+        await asyncio.gather(*[flight.do_async(key, _counting_call(calls)) for _ in range(3)])
+    
+    asyncio.run(main(SingleFlight(), None))
+    asyncio.run(main(SingleFlight(enabled=False), "k"))
+    assert len(calls) == 6
+
+
+def test_do_async_shares_errors():
+    flight = SingleFlight()
+    calls = []
+    
+    async def main():
+        return await asyncio.gather(*[flight.do_async("k", _counting_call(calls, error=ValueError("失败")))
+                                      for _ in range(3)], return_exceptions=True)
+    
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_leader_aborts_followers():
+    flight = SingleFlight()
+    
+    async def main():
+        leader = asyncio.create_task(flight.do_async("k", _counting_call([], delay=1)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do_async("k", _counting_call([])))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(FlightAbortedError):
+            await follower
+    
+    asyncio.run(main())
+
+
+def test_follower_timeout_does_not_affect_leader():
+    flight = SingleFlight()
+    
+    async def main():
+        leader = asyncio.create_task(flight.do_async("k", _counting_call([], delay=0.1)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do_async("k", _counting_call([]), timeout=0.01)
+        return await leader
+    
+    assert asyncio.run(main()) == ("结果", False)
+
+
+def _slow_agent(agent_class, backend, monkeypatch, delay=0.1):
+    """每次请求耗时delay秒，保证并发的调用在第一个请求结束前都已发出"""
+    chat = backend.chat
+    
+    def slow_chat(messages, timeout, **kwargs):
+        threading.Event().wait(delay)
+        return chat(messages, timeout, **kwargs)
+    
+    async def slow_achat(messages, timeout, **kwargs):
+        await asyncio.sleep(delay)
+        return chat(messages, timeout, **kwargs)
+    
+    monkeypatch.setattr(backend, "chat", slow_chat)
+    monkeypatch.setattr(backend, "achat", slow_achat)
+    return agent_class(backend=backend, cache=ResponseCache(cache_dir=None), single_flight=SingleFlight())
+
+
+def test_agent_threads_share_one_model_call(fake_backend, monkeypatch):
+    agent = _slow_agent(AIAgent, fake_backend, monkeypatch)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: agent.generate_style_draft("文案", ["参考"]), range(4)))
+    assert results == ["输出"] * 4
+    assert len(fake_backend.requests) == 1
+    assert agent.single_flight.stats()["coalesced"] == 3
+
+
+def test_stream_follower_gets_the_full_result(fake_backend, monkeypatch):
+    fake_backend.outputs = ["完整的输出文本"]
+    agent = _slow_agent(AIAgent, fake_backend, monkeypatch)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda _: "".join(agent.stream_style_draft("文案", ["参考"])), range(2)))
+    assert results == ["完整的输出文本"] * 2
+    assert len(fake_backend.requests) == 1
+
+
+def test_async_agent_coalesces_concurrent_calls(fake_backend, monkeypatch):
+    agent = _slow_agent(AsyncAIAgent, fake_backend, monkeypatch)
+    
+    async def main():
+        return await asyncio.gather(*[agent.generate_style_draft("文案", ["参考"]) for _ in range(4)])
+    
+    assert asyncio.run(main()) == ["输出"] * 4
+    assert len(fake_backend.requests) == 1
+
+
+def test_use_cache_false_is_not_coalesced(fake_backend, monkeypatch):
+    agent = _slow_agent(AIAgent, fake_backend, monkeypatch)
+    # 要求重新生成的请求各自调用模型，不共享进行中的相同请求的结果
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda _: agent.generate_style_draft("文案", ["参考"], use_cache=False), range(3)))
+    assert results == ["输出"] * 3
+    assert len(fake_backend.requests) == 3
+    assert agent.single_flight.stats()["coalesced"] == 0
+
+
+def test_async_use_cache_false_is_not_coalesced(fake_backend, monkeypatch):
+    agent = _slow_agent(AsyncAIAgent, fake_backend, monkeypatch)
+    
+    async def main():
+        return await asyncio.gather(*[agent.generate_style_draft("文案", ["参考"], use_cache=False)
+                                      for _ in range(3)])
+    
+    assert asyncio.run(main()) == ["输出"] * 3
+    assert len(fake_backend.requests) == 3
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+from data_manager import DataManager
+from metrics import MetricsRegistry
+from speculation import Speculator, predict_selection
+
+
+PREFERENCES = [{"id": "p1", "description": "简洁"}, {"id": "p2", "description": "口语化"}]
+
+
+class FakeAgent:
+    """应用偏好时返回带标记的文案；release之前阻塞，用于模拟仍在执行的推测"""
+    
+    def __init__(self, blocked=False):
+        self.metrics = MetricsRegistry()
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+    
+    def apply_preferences(self, draft, selected_preferences):
+        self.calls.append([p["id"] for p in selected_preferences])
+        self.started.set()
+        self.release.wait(5)
+        self.metrics.record("preferences", prompt_tokens=10, completion_tokens=5)
+        if draft == "bad":
+            raise RuntimeError("boom")
+        return f"{draft}+{'+'.join(p['id'] for p in selected_preferences)}"
+    
+    apply_restrictions = apply_preferences
+
+
+def test_predict_selection():
+    assert predict_selection(PREFERENCES, ["p2", "gone"]) == [PREFERENCES[1]]
+    assert predict_selection(PREFERENCES, []) == PREFERENCES
+    assert predict_selection(PREFERENCES, ["gone"]) == PREFERENCES
+
+
+def test_matching_selection_returns_speculative_result():
+    speculator = Speculator(FakeAgent())
+    assert speculator.speculate("preferences", "初稿", PREFERENCES)
+    assert not speculator.speculate("preferences", "初稿", list(reversed(PREFERENCES)))
+    
+    assert speculator.take("preferences", "初稿", list(reversed(PREFERENCES)), timeout=5) == "初稿+p1+p2"
+    assert speculator.take("preferences", "初稿", PREFERENCES) is None
+    stats = speculator.stats()
+    assert stats["started"] == 1
+    assert stats["hits"] == 1
+    assert stats["hit_rate"] == 1.0
+
+
+def test_different_selection_is_a_miss():
+    agent = FakeAgent(blocked=True)
+    speculator = Speculator(agent, max_workers=1)
+    speculator.speculate("preferences", "初稿一", PREFERENCES)
+    speculator.speculate("rules", "初稿二", PREFERENCES)
+    assert agent.started.wait(5)
+    
+    # 第二个推测还在排队，选择不一致时直接取消
+    assert speculator.take("rules", "初稿二", PREFERENCES[:1]) is None
+    agent.release.set()
+    assert speculator.take("preferences", "初稿一", PREFERENCES[:1]) is None
+    
+    stats = speculator.stats()
+    assert stats["misses"] == 2
+    assert stats["cancelled"] == 1
+    assert stats["pending"] == 0
+    assert agent.calls == [["p1", "p2"]]
+
+
+def test_speculative_calls_are_counted_in_the_consuming_session():
+    agent = FakeAgent()
+    speculator = Speculator(agent)
+    # 推测在后台线程中执行，调用记录在取结果时并入当前请求的会话
+    speculator.speculate("preferences", "初稿", PREFERENCES)
+    with agent.metrics.session() as session:
+        assert speculator.take("preferences", "初稿", PREFERENCES, timeout=5) == "初稿+p1+p2"
+    assert session.summary()["prompt_tokens"] == 10
+    assert agent.metrics.snapshot()["steps"]["preferences"]["calls"] == 1
+
+
+def _wait_for_tokens(session, expected):
+    for _ in range(200):
+        if session.summary()["prompt_tokens"] == expected:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_late_speculative_calls_are_counted_after_a_mismatch():
+    agent = FakeAgent(blocked=True)
+    speculator = Speculator(agent)
+    speculator.speculate("preferences", "初稿", PREFERENCES)
+    assert agent.started.wait(5)
+    with agent.metrics.session() as session:
+        # 推测已在执行，无法取消；执行完后的调用仍并入本次会话
+        assert speculator.take("preferences", "初稿", PREFERENCES[:1]) is None
+    assert session.summary()["prompt_tokens"] == 0
+    agent.release.set()
+    assert _wait_for_tokens(session, 10)
+
+
+def test_late_speculative_calls_are_counted_after_a_timeout():
+    agent = FakeAgent(blocked=True)
+    speculator = Speculator(agent)
+    speculator.speculate("preferences", "初稿", PREFERENCES)
+    with agent.metrics.session() as session:
+        assert speculator.take("preferences", "初稿", PREFERENCES, timeout=0.01) is None
+    agent.release.set()
+    assert _wait_for_tokens(session, 10)
+    assert speculator.stats()["misses"] == 1
+
+
+def test_failed_speculation_falls_back_to_caller():
+    speculator = Speculator(FakeAgent())
+    speculator.speculate("preferences", "bad", PREFERENCES)
+    assert speculator.take("preferences", "bad", PREFERENCES, timeout=5) is None
+    assert speculator.stats()["misses"] == 1
+
+
+def test_last_selection_is_stored_in_its_own_file(tmp_path):
+    profile = tmp_path / "user_profile.json"
+    manager = DataManager(str(profile))
+    profile_before = profile.read_text(encoding="utf-8")
+    assert manager.get_last_selection() == {"preference_ids": [], "rule_ids": []}
+    
+    manager.save_last_selection(preference_ids=["p1"])
+    manager.save_last_selection(rule_ids=["r2"])
+    
+    assert manager.get_last_selection() == {"preference_ids": ["p1"], "rule_ids": ["r2"]}
+    assert json.loads((tmp_path / "last_selection.json").read_text(encoding="utf-8")) == {
+        "preference_ids": ["p1"], "rule_ids": ["r2"]}
+    assert profile.read_text(encoding="utf-8") == profile_before
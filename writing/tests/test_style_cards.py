@@ -0,0 +1,66 @@
+import os
+
+from ai_agent import AIAgent
+from response_cache import ResponseCache
+from style_cards import StyleCardStore
+
+
+REFERENCES = ["第一篇参考文案。", "  第二篇参考文案。\n"]
+
+
+def test_reference_hash_ignores_order_and_whitespace():
+    assert StyleCardStore.reference_hash(REFERENCES) == StyleCardStore.reference_hash(
+        ["第二篇参考文案。", "第一篇参考文案。", "   "])
+    assert StyleCardStore.reference_hash(REFERENCES) != StyleCardStore.reference_hash(["第一篇参考文案。"])
+
+
+def test_save_get_delete_persist_across_instances(tmp_path):
+    path = str(tmp_path / "cards" / "style_cards.json")
+    store = StyleCardStore(path)
+    assert store.get(REFERENCES) is None
+    
+    reference_hash = store.save(REFERENCES, "短句，口语化")
+    reopened = StyleCardStore(path)
+    assert reopened.get(REFERENCES) == "短句，口语化"
+    assert reopened.list_cards()[0]["name"] == "第一篇参考文案。"
+    
+    assert reopened.delete(reference_hash)
+    assert not reopened.delete(reference_hash)
+    assert StyleCardStore(path).get(REFERENCES) is None
+
+
+def test_stores_sharing_a_file_merge_and_reload(tmp_path):
+    path = str(tmp_path / "style_cards.json")
+    first = StyleCardStore(path)
+    second = StyleCardStore(path)
+    
+    # 两个进程各自保存，后保存的一方先合并文件中已有的卡片，不会覆盖掉对方的
+    first.save(REFERENCES, "短句")
+    second.save(["另一组参考文案"], "长句")
+    assert StyleCardStore(path).get(REFERENCES) == "短句"
+    
+    # 未找到时重新读入文件，能看到其他进程新保存的卡片
+    assert first.get(["另一组参考文案"]) == "长句"
+    
+    # 文件被修改过时重新读入，已有的卡片也会更新
+    second.save(REFERENCES, "短句，口语化")
+    assert first.get(REFERENCES) == "短句，口语化"
+    assert len(first.list_cards()) == 2
+    assert os.listdir(tmp_path) == ["style_cards.json"]
+
+
+def test_style_draft_uses_card_instead_of_references(tmp_path, fake_backend):
+    store = StyleCardStore(str(tmp_path / "style_cards.json"))
+    agent = AIAgent(backend=fake_backend, cache=ResponseCache(cache_dir=None), style_cards=store)
+    
+    agent.generate_style_draft("文案", REFERENCES)
+    assert "第一篇参考文案" in fake_backend.requests[-1]["messages"][-1]["content"]
+    
+    fake_backend.outputs = ["输出", "卡片：短句，口语化"]
+    assert agent.distill_style_card(REFERENCES) == "卡片：短句，口语化"
+    assert store.get(REFERENCES) == "卡片：短句，口语化"
+    
+    agent.generate_style_draft("文案", REFERENCES)
+    prompt = fake_backend.requests[-1]["messages"][-1]["content"]
+    assert "卡片：短句，口语化" in prompt
+    assert "第一篇参考文案" not in prompt
@@ -0,0 +1,155 @@
+"""文本差异：改动片段带上下文并合并相邻改动，大幅重写时不压缩；带状编辑距离与朴素Levenshtein一致"""
+import random
+
+import pytest
+
+from prompts import build_learn_preferences_messages
+from text_diff import TextDiff, changed_chars, diff_hunks, compact_diff, edit_distance, strip_formatting
+
+
+def naive_levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _random_pairs(count, alphabet, max_length, seed):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        a = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length)))
+        # 一半是在a上做少量修改（局部修改，有公共前后缀），一半是无关的两段文本
+        if rng.random() < 0.5:
+            b = list(a)
+            for _ in range(rng.randint(0, 4)):
+                position = rng.randint(0, len(b))
+                action = rng.choice(("insert", "delete", "replace"))
+                if action == "insert":
+                    b.insert(position, rng.choice(alphabet))
+                elif b and position < len(b):
+                    if action == "delete":
+                        del b[position]
+                    else:
+                        b[position] = rng.choice(alphabet)
+            b = "".join(b)
+        else:
+            b = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length)))
+        pairs.append((a, b))
+    return pairs
+
+
+PAIRS = _random_pairs(300, "ab", 12, seed=1) + _random_pairs(300, "苹果香蕉的了。，", 30, seed=2)
+
+
+def test_changed_chars():
+    assert changed_chars("苹果很甜", "苹果很甜") == 0
+    assert changed_chars("我很喜欢吃苹果。", "我非常喜欢吃香蕉。") == 4
+    assert changed_chars("abc", "") == 3
+
+
+def test_no_changes_no_hunks():
+    assert diff_hunks("一模一样", "一模一样") == []
+
+
+def test_hunks_carry_context():
+    original = "甲" * 30 + "苹果" + "乙" * 30
+    modified = "甲" * 30 + "香蕉" + "乙" * 30
+    assert diff_hunks(original, modified, context=3) == [{"original": "甲甲甲苹果乙乙乙", "modified": "甲甲甲香蕉乙乙乙"}]
+
+
+def test_hunks_merge_nearby_changes():
+    original = "一二三四五六七八九十"
+    modified = "一2三四5六七八九十"
+    assert diff_hunks(original, modified, context=2) == [{"original": "一二三四五六七", "modified": "一2三四5六七"}]
+
+
+def test_distant_changes_are_separate_hunks():
+    original = "一" + "中" * 20 + "二"
+    modified = "1" + "中" * 20 + "2"
+    assert diff_hunks(original, modified, context=2) == [
+        {"original": "一中中", "modified": "1中中"},
+        {"original": "中中二", "modified": "中中2"},
+    ]
+
+
+def test_compact_diff_rejects_heavy_rewrites():
+    original = "今天天气很好，我们去公园散步吧。" * 10
+    assert compact_diff(original, original.replace("公园", "河边", 1)) is not None
+    assert compact_diff(original, "完全不同的一段话") is None
+    assert compact_diff("", "新写的") is None
+
+
+def test_learn_preferences_prompt_sends_only_hunks():
+    original = "今天天气很好，我们去公园散步吧。" * 10
+    modified = original.replace("公园", "河边", 1)
+    prompt = build_learn_preferences_messages(original, modified)[-1]["content"]
+    assert "原片段：" in prompt
+    assert original not in prompt
+    
+    full = build_learn_preferences_messages(original, modified, use_diff=False)[-1]["content"]
+    assert original in full
+
+
+@pytest.mark.parametrize("a, b", [
+    ("", ""), ("", "abc"), ("abc", ""), ("kitten", "sitting"), ("flaw", "lawn"),
+    ("苹果很甜", "苹果很甜"), ("我很喜欢吃苹果。", "我非常喜欢吃香蕉。"), ("abcdef", "fedcba"),
+])
+def test_edit_distance_known_pairs(a, b):
+    assert edit_distance(a, b) == naive_levenshtein(a, b)
+
+
+def test_edit_distance_matches_naive():
+    for a, b in PAIRS:
+        assert edit_distance(a, b) == naive_levenshtein(a, b), (a, b)
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 2, 3, 5, 8])
+def test_banded_edit_distance_matches_naive(max_distance):
+    # 不超过上限时与完整计算一致，超过时返回max_distance + 1
+    for a, b in PAIRS:
+        expected = naive_levenshtein(a, b)
+        assert edit_distance(a, b, max_distance) == (expected if expected <= max_distance else max_distance + 1), \
+            (a, b)
+
+
+def test_edit_distance_is_symmetric():
+    for a, b in PAIRS[:100]:
+        assert edit_distance(a, b) == edit_distance(b, a)
+
+
+@pytest.mark.parametrize("limit", [0, 1, 3, 6, 10])
+def test_within_distance_never_accepts_more_than_limit(limit):
+    for a, b in PAIRS:
+        distance = naive_levenshtein(a, b)
+        within = TextDiff(a, b).within_distance(limit)
+        if within:
+            assert distance <= limit, (a, b)
+        if distance > limit:
+            assert not within, (a, b)
+
+
+def test_within_distance_local_edits():
+    original = "今天天气很好，我们去公园散步吧。" * 20
+    modified = original.replace("公园", "河边", 1)
+    diff = TextDiff(original, modified)
+    assert diff.within_distance(2)
+    assert not diff.within_distance(1)
+
+
+def test_text_diff_bounds_edit_distance():
+    for a, b in PAIRS:
+        diff = TextDiff(a, b)
+        assert diff.length_gap() <= naive_levenshtein(a, b) <= diff.changed_chars(), (a, b)
+
+
+def test_changed_chars_is_an_upper_bound():
+    for a, b in PAIRS:
+        assert naive_levenshtein(a, b) <= changed_chars(a, b), (a, b)
+
+
+def test_strip_formatting():
+    assert strip_formatting("你好，世界！ Hello, world.") == "你好世界Helloworld"
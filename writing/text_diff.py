@@ -0,0 +1,177 @@
+"""
+文本差异模块 - 字符级对比（中文没有词边界，按字比较），提取带少量上下文的改动片段，供学习偏好时只发送改动部分
+"""
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+
+# 改动的字符数超过原文的这个比例时视为大幅重写，学习时仍发送完整原文
+HEAVY_REWRITE_RATIO = 0.5
+
+
+class TextDiff:
+    """
+    两段文本的字符级差异
+    SequenceMatcher的opcodes只计算一次，改动字符数、改动片段和"编辑距离是否超过上限"的判断都基于同一份结果
+    """
+    
+    def __init__(self, original: str, modified: str):
+        self.original = original
+        self.modified = modified
+        self._opcodes = None
+        self._changed_chars = None
+    
+    @property
+    def opcodes(self) -> List[Tuple[str, int, int, int, int]]:
+        if self._opcodes is None:
+            # autojunk会把长文本中的高频字（如"的"、标点）当作噪声跳过，中文文案需要关闭
+            self._opcodes = SequenceMatcher(None, self.original, self.modified, autojunk=False).get_opcodes()
+        return self._opcodes
+    
+    def changed_chars(self) -> int:
+        """改动涉及的字符数（删除、插入、替换两侧中较长的一侧），是编辑距离的上界"""
+        if self._changed_chars is None:
+            self._changed_chars = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in self.opcodes if tag != "equal")
+        return self._changed_chars
+    
+    def length_gap(self) -> int:
+        """长度差，是改动字符数和编辑距离的下界，不需要对比即可得到"""
+        return abs(len(self.original) - len(self.modified))
+    
+    def within_distance(self, limit: int) -> bool:
+        """
+        编辑距离是否不超过limit
+        先用下界（长度差、字符频次差）排除，再用上界（改动字符数）确认；都判断不了时，
+        在同一份opcodes上逐段计算各改动块的编辑距离之和（不再对全文做编辑距离），超出limit即停止
+        """
+        if self.original == self.modified:
+            return True
+        if self.length_gap() > limit:
+            return False
+        original_counts, modified_counts = Counter(self.original), Counter(self.modified)
+        if max(sum((original_counts - modified_counts).values()),
+               sum((modified_counts - original_counts).values())) > limit:
+            return False
+        if self.changed_chars() <= limit:
+            return True
+        budget = limit
+        for tag, i1, i2, j1, j2 in self.opcodes:
+            if tag == "equal":
+                continue
+            if tag == "replace":
+                budget -= edit_distance(self.original[i1:i2], self.modified[j1:j2], budget)
+            else:
+                budget -= max(i2 - i1, j2 - j1)
+            if budget < 0:
+                return False
+        return True
+    
+    def hunks(self, context: int = 20) -> List[Dict[str, str]]:
+        """
+        改动片段列表，每段包含改动前后的文本（各带前后context个字的上下文）
+        相邻改动的上下文重叠时合并为一段
+        """
+        changes = [op for op in self.opcodes if op[0] != "equal"]
+        if not changes:
+            return []
+        
+        # 按上下文范围合并相邻改动：[原文起, 原文止, 改后起, 改后止]
+        groups = []
+        for _, i1, i2, j1, j2 in changes:
+            if groups and i1 - groups[-1][1] <= 2 * context:
+                groups[-1][1] = i2
+                groups[-1][3] = j2
+            else:
+                groups.append([i1, i2, j1, j2])
+        
+        hunks = []
+        for i1, i2, j1, j2 in groups:
+            before = min(context, i1, j1)
+            after = min(context, len(self.original) - i2, len(self.modified) - j2)
+            hunks.append({
+                "original": self.original[i1 - before:i2 + after],
+                "modified": self.modified[j1 - before:j2 + after],
+            })
+        return hunks
+    
+    def compact(self, context: int = 20,
+                max_change_ratio: float = HEAVY_REWRITE_RATIO) -> Optional[List[Dict[str, str]]]:
+        """
+        轻度修改时返回改动片段；大幅重写（改动超过max_change_ratio）或片段总长不比全文短时返回None，
+        由调用方改用完整原文。长度差已超出比例时不做对比
+        """
+        limit = len(self.original) * max_change_ratio
+        if not self.original or self.length_gap() > limit or self.changed_chars() > limit:
+            return None
+        hunks = self.hunks(context)
+        compact_length = sum(len(h["original"]) + len(h["modified"]) for h in hunks)
+        if compact_length >= len(self.original) + len(self.modified):
+            return None
+        return hunks
+
+
+@lru_cache(maxsize=16)
+def text_diff(original: str, modified: str) -> TextDiff:
+    """同一对文本的差异在学习前的检查和构建学习提示词之间复用，只对比一次"""
+    return TextDiff(original, modified)
+
+
+def changed_chars(original: str, modified: str) -> int:
+    """改动涉及的字符数（删除、插入、替换两侧中较长的一侧）"""
+    return text_diff(original, modified).changed_chars()
+
+
+def diff_hunks(original: str, modified: str, context: int = 20) -> List[Dict[str, str]]:
+    """字符级差异的改动片段，见TextDiff.hunks"""
+    return text_diff(original, modified).hunks(context)
+
+
+def compact_diff(original: str, modified: str, context: int = 20,
+                 max_change_ratio: float = HEAVY_REWRITE_RATIO) -> Optional[List[Dict[str, str]]]:
+    """轻度修改时返回改动片段，大幅重写时返回None，见TextDiff.compact"""
+    return text_diff(original, modified).compact(context, max_change_ratio)
+
+
+def edit_distance(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """
+    字符级编辑距离（Levenshtein）
+    先去掉相同的前后缀；指定max_distance时只计算对角线附近的带状区域，超过上限即返回max_distance + 1
+    """
+    if a == b:
+        return 0
+    # 先去掉相同的前缀和后缀，局部修改时只需计算改动附近的一小段
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(a), len(b)) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    a, b = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is None:
+        max_distance = len(a)
+    if len(a) - len(b) > max_distance:
+        return max_distance + 1
+    
+    over = max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        low = max(1, i - max_distance)
+        high = min(len(b), i + max_distance)
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= max_distance else over
+        for j in range(low, high + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[max(0, low - 1):high + 1]) > max_distance:
+            return over
+        previous = current
+    return min(previous[len(b)], over)
+
+
+def strip_formatting(text: str) -> str:
+    """去掉空白和标点，只保留文字内容"""
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith(("P", "S")))
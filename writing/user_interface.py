@@ -4,6 +4,7 @@
 import questionary
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
 from rich.text import Text
 from typing import List, Dict, Any, Optional
 
@@ -177,6 +178,33 @@ class UserInterface:
         else:
             self.console.print("[yellow]本次会话未学习到新的偏好或规则。[/yellow]")
     
+    def display_reference_budget(self, budget: Dict[str, Any]):
+        """提示参考文案超出预算时删去的段落"""
+        self.console.print(f"[yellow]{budget['summary']}：[/yellow]")
+        for item in budget["dropped"]:
+            self.console.print(f"  - 参考文案{item['reference']}第{item['paragraph']}段：{item['preview']}…")
+        self.console.print()
+    
+    def display_metrics(self, summary: Dict[str, Any]):
+        """显示本次会话各步骤的token用量和耗时"""
+        if not summary["steps"]:
+            return
+        
+        table = Table(title="本次会话调用统计")
+        table.add_column("步骤")
+        table.add_column("调用次数", justify="right")
+        table.add_column("缓存命中", justify="right")
+        table.add_column("输入token", justify="right")
+        table.add_column("输出token", justify="right")
+        table.add_column("耗时(秒)", justify="right")
+        for step, stats in summary["steps"].items():
+            table.add_row(step, str(stats["calls"]), str(stats["cached"]), str(stats["prompt_tokens"]),
+                          str(stats["completion_tokens"]), f"{stats['wall_time']:.2f}")
+        table.add_row("合计", "", "", str(summary["prompt_tokens"]), str(summary["completion_tokens"]),
+                      f"{summary['wall_time']:.2f}", style="bold")
+        self.console.print(table)
+        self.console.print()
+    
     def display_final_result(self, final_draft: str):
         """显示最终结果"""
         panel = Panel(
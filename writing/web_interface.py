@@ -4,20 +4,52 @@ Web界面版本 - 在浏览器中使用文案风格个性化AI Agent
 """
 import os
 import json
-from flask import Flask, render_template_string, request, jsonify
+import functools
+import threading
+from collections import OrderedDict
+from flask import Flask, render_template_string, request, jsonify, Response, stream_with_context
 from data_manager import DataManager
-from ai_agent import AIAgent
+from ai_agent import AIAgent, EditSession
 from deduplication import DeduplicationEngine
+from resilience import Deadline
+from speculation import Speculator, predict_selection
+from learning import LearningGate, learn_and_merge, register_learning_job
+from job_queue import JobQueue
+from http_pool import HTTPPool
 
 # 设置环境变量
 os.environ["VOLCANO_API_KEY"] = "your_volcano_api_key_here"
 
 app = Flask(__name__)
 
+# debug模式的自动重载会先启动一个只负责监视文件变化的父进程（WERKZEUG_RUN_MAIN未设置），
+# 后台线程只在实际处理请求的进程中启动；被其他服务器（如gunicorn）导入时总是启动
+_serving_process = __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
 # 初始化组件
 data_manager = DataManager()
 ai_agent = AIAgent()
+if _serving_process:
+    ai_agent.warm_up()
 deduplication_engine = DeduplicationEngine()
+speculator = Speculator.from_env(ai_agent)
+
+# 持久化任务队列：学习和可选的后台生成，工作进程重启后未完成的任务会继续执行
+job_queue = JobQueue.default()
+register_learning_job(job_queue, ai_agent, data_manager, deduplication_engine)
+job_queue.register('generate_draft', lambda payload: {
+    'draft': ai_agent.generate_style_draft(payload['user_input'], payload['references']),
+    'reference_budget': _reference_report(payload['references']),
+})
+job_queue.register('generate_final', lambda payload: {
+    'draft': ai_agent.generate_final_draft(
+        payload['user_input'], payload['references'],
+        payload.get('preferences', []), payload.get('rules', [])
+    ),
+    'reference_budget': _reference_report(payload['references']),
+})
+if _serving_process:
+    job_queue.start()
 
 # HTML模板
 HTML_TEMPLATE = """
@@ -345,6 +377,16 @@ HTML_TEMPLATE = """
             font-size: 14px;
         }
         
+        .notice {
+            color: #b45309;
+            background: linear-gradient(135deg, #fffbeb, #fef3c7);
+            padding: 16px;
+            border-radius: 12px;
+            margin: 15px 0;
+            border-left: 4px solid #d97706;
+            font-size: 14px;
+        }
+        
         .edit-options {
             display: flex;
             gap: 15px;
@@ -482,6 +524,8 @@ HTML_TEMPLATE = """
             </div>
             
             <button onclick="generateDraft()" id="generateBtn">生成风格化初稿</button>
+            <button onclick="generateFinalDraft()" id="oneShotBtn" title="使用下方已勾选的偏好和规则，一次请求直接生成终稿">⚡ 一步生成终稿</button>
+            <button onclick="saveStyleCard()" id="styleCardBtn" title="把这组参考文案提炼为风格卡片，之后使用同一组参考文案时不再发送完整原文">🎴 保存为风格卡片</button>
             <div id="draftResult"></div>
         </div>
 
@@ -570,6 +614,12 @@ HTML_TEMPLATE = """
         let aiFinalDraft = '';
         let userFinalDraft = '';
         let userInstructions = [];
+        let editSessionId = newEditSessionId();
+
+        // 每得到一版新的AI终稿就开始新的多轮修改会话，之后的AI修改只发送新的指令
+        function newEditSessionId() {
+            return Date.now().toString(36) + Math.random().toString(36).slice(2);
+        }
 
         // 更新进度条
         function updateProgress() {
@@ -679,6 +729,112 @@ HTML_TEMPLATE = """
             btn.disabled = selectedRules.length === 0;
         }
 
+        // 以SSE流式方式请求接口，每收到一段增量就回调onDelta，返回完整文本
+        async function streamDraft(url, body, onDelta, onDone) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(body)
+            });
+            // 请求参数有误时接口直接返回JSON错误，不进入流式推送
+            if ((response.headers.get('Content-Type') || '').includes('application/json')) {
+                const result = await response.json();
+                throw new Error(result.error || '请求失败');
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder('utf-8');
+            let buffer = '';
+            let text = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const raw = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let payload = '';
+                    raw.split('\n').forEach(line => {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) payload += line.slice(6);
+                    });
+                    const data = JSON.parse(payload);
+
+                    if (event === 'delta') {
+                        text += data.text;
+                        onDelta(text);
+                    } else if (event === 'done') {
+                        if (onDone) onDone(data);
+                        return data.draft;
+                    } else if (event === 'error') {
+                        throw new Error(data.error);
+                    }
+                }
+            }
+            return text.trim();
+        }
+
+        // 参考文案超出token预算时，提示删去了哪些段落
+        function referenceBudgetNotice(budget) {
+            if (budget && budget.style_card) {
+                return '<div class="notice">🎴 已使用保存的风格卡片代替完整参考文案</div>';
+            }
+            if (!budget || !budget.truncated) return '';
+            const dropped = budget.dropped.map(item => 
+                `参考文案${item.reference}第${item.paragraph}段（${item.preview}…）`).join('、');
+            return `<div class="notice">✂️ ${budget.summary}：${dropped}</div>`;
+        }
+
+        // 用户勾选期间在后台按上一次的选择先行应用（服务端未开启推测执行时不做任何事）
+        function speculate(stage, draft) {
+            fetch('/api/speculate', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({stage: stage, draft: draft})
+            }).catch(() => {});
+        }
+
+        // 把当前参考文案提炼为风格卡片
+        async function saveStyleCard() {
+            const reference1 = document.getElementById('reference1').value;
+            const reference2 = document.getElementById('reference2').value;
+            
+            if (!reference1) {
+                alert('请至少填写一个参考文案');
+                return;
+            }
+
+            const references = [reference1];
+            if (reference2) references.push(reference2);
+
+            const btn = document.getElementById('styleCardBtn');
+            const originalText = btn.textContent;
+            btn.textContent = '🔄 提炼中...';
+            btn.disabled = true;
+
+            try {
+                const response = await fetch('/api/style-cards', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({references: references})
+                });
+                const result = await response.json();
+                if (!result.success) throw new Error(result.error);
+                document.getElementById('draftResult').innerHTML = 
+                    `<div class="success">🎴 风格卡片已保存，之后使用这组参考文案将直接使用卡片：<br>${result.card}</div>`;
+            } catch (error) {
+                document.getElementById('draftResult').innerHTML = 
+                    `<div class="error">❌ 提炼风格卡片失败：${error.message}</div>`;
+            } finally {
+                btn.textContent = originalText;
+                btn.disabled = false;
+            }
+        }
+
         // Step 1: 生成风格化初稿
         async function generateDraft() {
             const userInput = document.getElementById('userInput').value;
@@ -701,33 +857,30 @@ HTML_TEMPLATE = """
             btn.classList.add('pulse');
 
             try {
-                const response = await fetch('/api/generate-draft', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        user_input: userInput,
-                        references: references
-                    })
+                let budgetNotice = '';
+                const draft = await streamDraft('/api/stream/generate-draft', {
+                    user_input: userInput,
+                    references: references
+                }, text => {
+                    document.getElementById('draftResult').innerHTML = 
+                        `<div class="result"><strong>✨ 风格化初稿：</strong><br>${text}</div>`;
+                }, data => {
+                    budgetNotice = referenceBudgetNotice(data.reference_budget);
                 });
                 
-                const data = await response.json();
-                if (data.success) {
-                    currentDraft = data.draft;
-                    document.getElementById('draftResult').innerHTML = 
-                        `<div class="result"><strong>✨ 风格化初稿：</strong><br>${data.draft}</div>`;
-                    
-                    // 进入下一步
-                    markStepCompleted(1);
-                    currentStep = 2;
-                    activateStep(2);
-                    updateProgress();
-                } else {
-                    document.getElementById('draftResult').innerHTML = 
-                        `<div class="error">❌ 生成失败：${data.error}</div>`;
-                }
+                currentDraft = draft;
+                document.getElementById('draftResult').innerHTML = budgetNotice +
+                    `<div class="result"><strong>✨ 风格化初稿：</strong><br>${draft}</div>`;
+                speculate('preferences', draft);
+                
+                // 进入下一步
+                markStepCompleted(1);
+                currentStep = 2;
+                activateStep(2);
+                updateProgress();
             } catch (error) {
                 document.getElementById('draftResult').innerHTML = 
-                    `<div class="error">❌ 请求失败：${error.message}</div>`;
+                    `<div class="error">❌ 生成失败：${error.message}</div>`;
             } finally {
                 // 恢复按钮状态
                 btn.textContent = originalText;
@@ -736,6 +889,67 @@ HTML_TEMPLATE = """
             }
         }
 
+        // 融合模式：使用已勾选的偏好和规则，一次请求生成AI终稿
+        async function generateFinalDraft() {
+            const userInput = document.getElementById('userInput').value;
+            const reference1 = document.getElementById('reference1').value;
+            const reference2 = document.getElementById('reference2').value;
+            
+            if (!userInput || !reference1) {
+                alert('请填写原始文案和至少一个参考文案');
+                return;
+            }
+
+            const references = [reference1];
+            if (reference2) references.push(reference2);
+
+            const btn = document.getElementById('oneShotBtn');
+            const originalText = btn.textContent;
+            btn.textContent = '🔄 生成中...';
+            btn.disabled = true;
+            btn.classList.add('pulse');
+
+            try {
+                let budgetNotice = '';
+                const draft = await streamDraft('/api/stream/generate-final', {
+                    user_input: userInput,
+                    references: references,
+                    preference_indices: selectedPreferences,
+                    rule_indices: selectedRules
+                }, text => {
+                    document.getElementById('draftResult').innerHTML = 
+                        `<div class="result"><strong>⚡ AI终稿：</strong><br>${text}</div>`;
+                }, data => {
+                    budgetNotice = referenceBudgetNotice(data.reference_budget);
+                });
+                
+                aiFinalDraft = draft;
+                editSessionId = newEditSessionId();
+                currentDraft = draft;
+                document.getElementById('draftResult').innerHTML = budgetNotice +
+                    `<div class="result"><strong>⚡ AI终稿：</strong><br>${draft}</div>`;
+                document.getElementById('currentDraftText').textContent = draft;
+                document.getElementById('aiFinalDraft').textContent = draft;
+                
+                // 跳过第2、3步，直接进入编辑
+                [1, 2, 3].forEach(markStepCompleted);
+                currentStep = 4;
+                activateStep(4);
+                updateProgress();
+                
+                document.getElementById('satisfiedBtn').disabled = false;
+                document.getElementById('manualEditBtn').disabled = false;
+                document.getElementById('aiEditBtn').disabled = false;
+            } catch (error) {
+                document.getElementById('draftResult').innerHTML = 
+                    `<div class="error">❌ 生成失败：${error.message}</div>`;
+            } finally {
+                btn.textContent = originalText;
+                btn.disabled = false;
+                btn.classList.remove('pulse');
+            }
+        }
+
         // Step 2: 应用偏好
         async function applyPreferences() {
             if (!currentDraft) {
@@ -751,33 +965,27 @@ HTML_TEMPLATE = """
             btn.classList.add('pulse');
 
             try {
-                const response = await fetch('/api/apply-preferences', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        draft: currentDraft,
-                        preference_indices: selectedPreferences
-                    })
+                const draft = await streamDraft('/api/stream/apply-preferences', {
+                    draft: currentDraft,
+                    preference_indices: selectedPreferences
+                }, text => {
+                    document.getElementById('preferenceResult').innerHTML = 
+                        `<div class="result"><strong>🎯 应用偏好后：</strong><br>${text}</div>`;
                 });
                 
-                const data = await response.json();
-                if (data.success) {
-                    currentDraft = data.draft;
-                    document.getElementById('preferenceResult').innerHTML = 
-                        `<div class="result"><strong>🎯 应用偏好后：</strong><br>${data.draft}</div>`;
-                    
-                    // 进入下一步
-                    markStepCompleted(2);
-                    currentStep = 3;
-                    activateStep(3);
-                    updateProgress();
-                } else {
-                    document.getElementById('preferenceResult').innerHTML = 
-                        `<div class="error">❌ 应用失败：${data.error}</div>`;
-                }
+                currentDraft = draft;
+                document.getElementById('preferenceResult').innerHTML = 
+                    `<div class="result"><strong>🎯 应用偏好后：</strong><br>${draft}</div>`;
+                speculate('rules', draft);
+                
+                // 进入下一步
+                markStepCompleted(2);
+                currentStep = 3;
+                activateStep(3);
+                updateProgress();
             } catch (error) {
                 document.getElementById('preferenceResult').innerHTML = 
-                    `<div class="error">❌ 请求失败：${error.message}</div>`;
+                    `<div class="error">❌ 应用失败：${error.message}</div>`;
             } finally {
                 // 恢复按钮状态
                 btn.textContent = originalText;
@@ -794,43 +1002,37 @@ HTML_TEMPLATE = """
             }
 
             try {
-                const response = await fetch('/api/apply-rules', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        draft: currentDraft,
-                        rule_indices: selectedRules
-                    })
+                const draft = await streamDraft('/api/stream/apply-rules', {
+                    draft: currentDraft,
+                    rule_indices: selectedRules
+                }, text => {
+                    document.getElementById('ruleResult').innerHTML = 
+                        `<div class="result"><strong>应用规则后（AI终稿）：</strong><br>${text}</div>`;
                 });
                 
-                const data = await response.json();
-                if (data.success) {
-                    aiFinalDraft = data.draft;
-                    currentDraft = data.draft;
-                    document.getElementById('ruleResult').innerHTML = 
-                        `<div class="result"><strong>应用规则后（AI终稿）：</strong><br>${data.draft}</div>`;
-                    
-                    // 更新显示
-                    document.getElementById('currentDraftText').textContent = data.draft;
-                    document.getElementById('aiFinalDraft').textContent = data.draft;
-                    
-                    // 进入下一步
-                    markStepCompleted(3);
-                    currentStep = 4;
-                    activateStep(4);
-                    updateProgress();
-                    
-                    // 启用编辑按钮
-                    document.getElementById('satisfiedBtn').disabled = false;
-                    document.getElementById('manualEditBtn').disabled = false;
-                    document.getElementById('aiEditBtn').disabled = false;
-                } else {
-                    document.getElementById('ruleResult').innerHTML = 
-                        `<div class="error">应用失败：${data.error}</div>`;
-                }
+                aiFinalDraft = draft;
+                editSessionId = newEditSessionId();
+                currentDraft = draft;
+                document.getElementById('ruleResult').innerHTML = 
+                    `<div class="result"><strong>应用规则后（AI终稿）：</strong><br>${draft}</div>`;
+                
+                // 更新显示
+                document.getElementById('currentDraftText').textContent = draft;
+                document.getElementById('aiFinalDraft').textContent = draft;
+                
+                // 进入下一步
+                markStepCompleted(3);
+                currentStep = 4;
+                activateStep(4);
+                updateProgress();
+                
+                // 启用编辑按钮
+                document.getElementById('satisfiedBtn').disabled = false;
+                document.getElementById('manualEditBtn').disabled = false;
+                document.getElementById('aiEditBtn').disabled = false;
             } catch (error) {
                 document.getElementById('ruleResult').innerHTML = 
-                    `<div class="error">请求失败：${error.message}</div>`;
+                    `<div class="error">应用失败：${error.message}</div>`;
             }
         }
 
@@ -879,32 +1081,26 @@ HTML_TEMPLATE = """
             }
 
             try {
-                const response = await fetch('/api/ai-edit', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        draft: currentDraft,
-                        instruction: instruction
-                    })
+                const draft = await streamDraft('/api/stream/ai-edit', {
+                    draft: currentDraft,
+                    instruction: instruction,
+                    session_id: editSessionId
+                }, text => {
+                    document.getElementById('currentDraftText').textContent = text;
                 });
                 
-                const data = await response.json();
-                if (data.success) {
-                    currentDraft = data.draft;
-                    userInstructions.push(instruction);
-                    document.getElementById('currentDraftText').textContent = data.draft;
-                    document.getElementById('aiEditArea').classList.add('hidden');
-                    document.getElementById('aiInstruction').value = '';
-                    
-                    document.getElementById('editResult').innerHTML = 
-                        '<div class="success">AI修改完成</div>';
-                } else {
-                    document.getElementById('editResult').innerHTML = 
-                        `<div class="error">AI修改失败：${data.error}</div>`;
-                }
+                currentDraft = draft;
+                userInstructions.push(instruction);
+                document.getElementById('currentDraftText').textContent = draft;
+                document.getElementById('aiEditArea').classList.add('hidden');
+                document.getElementById('aiInstruction').value = '';
+                
+                document.getElementById('editResult').innerHTML = 
+                    '<div class="success">AI修改完成</div>';
             } catch (error) {
+                document.getElementById('currentDraftText').textContent = currentDraft;
                 document.getElementById('editResult').innerHTML = 
-                    `<div class="error">请求失败：${error.message}</div>`;
+                    `<div class="error">AI修改失败：${error.message}</div>`;
             }
         }
 
@@ -922,24 +1118,46 @@ HTML_TEMPLATE = """
                     body: JSON.stringify({
                         ai_final_draft: aiFinalDraft,
                         user_final_draft: userFinalDraft,
-                        user_instructions: userInstructions
+                        user_instructions: userInstructions,
+                        background: true
                     })
                 });
                 
                 const data = await response.json();
                 if (data.success) {
-                    document.getElementById('learnResult').innerHTML = 
-                        `<div class="success">学习完成！新增 ${data.new_preferences} 个偏好，${data.new_rules} 个规则</div>`;
-                    
+                    // 学习在后台进行，不必等待
                     markStepCompleted(5);
                     updateProgress();
-                    
-                    // 重新加载偏好和规则
+                    document.getElementById('learnResult').innerHTML = 
+                        '<div class="notice">🧠 正在后台学习，可以继续使用...</div>';
+                    pollLearnJob(data.job_id);
+                } else {
+                    document.getElementById('learnResult').innerHTML = 
+                        `<div class="error">学习失败：${data.error}</div>`;
+                }
+            } catch (error) {
+                document.getElementById('learnResult').innerHTML = 
+                    `<div class="error">请求失败：${error.message}</div>`;
+            }
+        }
+
+        // 轮询后台学习任务，完成后显示结果并重新加载偏好和规则
+        async function pollLearnJob(jobId) {
+            try {
+                const response = await fetch(`/api/jobs/${jobId}`);
+                const job = await response.json();
+                if (job.status === 'pending' || job.status === 'running') {
+                    setTimeout(() => pollLearnJob(jobId), 1000);
+                    return;
+                }
+                if (job.status === 'done') {
+                    document.getElementById('learnResult').innerHTML = 
+                        `<div class="success">学习完成！新增 ${job.result.new_preferences} 个偏好，${job.result.new_rules} 个规则</div>`;
                     loadPreferences();
                     loadRules();
                 } else {
                     document.getElementById('learnResult').innerHTML = 
-                        `<div class="error">学习失败：${data.error}</div>`;
+                        `<div class="error">学习失败：${job.error || '学习任务不存在'}</div>`;
                 }
             } catch (error) {
                 document.getElementById('learnResult').innerHTML = 
@@ -958,6 +1176,56 @@ HTML_TEMPLATE = """
 </html>
 """
 
+def _request_deadline():
+    """从请求头X-Request-Timeout（秒）读取本次请求的截止时间，并传递给每一步大模型调用"""
+    timeout = request.headers.get('X-Request-Timeout')
+    if not timeout:
+        return None
+    return Deadline(float(timeout))
+
+def _with_metrics(view):
+    """在本次请求内收集大模型调用指标，并附加到JSON响应的metrics字段"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with ai_agent.metrics.session() as session:
+            response = view(*args, **kwargs)
+        return jsonify({**response.get_json(), 'metrics': session.summary()})
+    return wrapper
+
+def _reference_report(references: list) -> dict:
+    """说明参考文案是如何发送给模型的：使用了风格卡片，或按预算删去了哪些段落"""
+    if ai_agent.find_style_card(references):
+        return {'style_card': True, 'truncated': False}
+    return {'style_card': False, **ai_agent.fit_references(references).to_dict()}
+
+def _record_selection(preference_ids: list = None, rule_ids: list = None):
+    """开启推测执行时记录本次的选择，作为下一次推测的依据"""
+    if speculator is not None:
+        data_manager.save_last_selection(preference_ids=preference_ids, rule_ids=rule_ids)
+
+def _speculative_result(stage: str, draft: str, selected_items: list):
+    """取推测执行的结果；未开启推测或选择与推测不一致时返回None"""
+    if speculator is None:
+        return None
+    deadline = _request_deadline()
+    return speculator.take(stage, draft, selected_items, timeout=deadline.remaining() if deadline else None)
+
+# 多轮修改会话，按前端生成的session_id保存，只保留最近使用的若干个
+MAX_EDIT_SESSIONS = 256
+_edit_sessions = OrderedDict()
+_edit_sessions_lock = threading.Lock()
+
+def _edit_session(session_id: str) -> EditSession:
+    with _edit_sessions_lock:
+        session = _edit_sessions.get(session_id)
+        if session is None:
+            session = ai_agent.start_edit_session()
+            _edit_sessions[session_id] = session
+        _edit_sessions.move_to_end(session_id)
+        while len(_edit_sessions) > MAX_EDIT_SESSIONS:
+            _edit_sessions.popitem(last=False)
+        return session
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
@@ -972,19 +1240,119 @@ def get_rules():
     rules = data_manager.get_restriction_rules()
     return jsonify({'rules': rules})
 
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    if ai_agent.cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **ai_agent.cache.stats()})
+
+@app.route('/api/hedging/stats')
+def get_hedging_stats():
+    if ai_agent.hedging is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **ai_agent.hedging.stats()})
+
+@app.route('/api/rate-limit/stats')
+def get_rate_limit_stats():
+    return jsonify(ai_agent.limiter.stats())
+
+@app.route('/api/http-pool/stats')
+def get_http_pool_stats():
+    return jsonify(HTTPPool.default().stats())
+
+@app.route('/api/single-flight/stats')
+def get_single_flight_stats():
+    return jsonify(ai_agent.single_flight.stats())
+
+@app.route('/api/model-routes')
+def get_model_routes():
+    return jsonify({'default_model': ai_agent.model, **ai_agent.router.stats()})
+
+@app.route('/api/metrics')
+def get_metrics():
+    return jsonify(ai_agent.metrics.snapshot())
+
+@app.route('/api/speculation/stats')
+def get_speculation_stats():
+    if speculator is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **speculator.stats()})
+
+@app.route('/api/style-cards')
+def get_style_cards():
+    if ai_agent.style_cards is None:
+        return jsonify({'enabled': False, 'cards': []})
+    return jsonify({'enabled': True, 'cards': ai_agent.style_cards.list_cards()})
+
+@app.route('/api/style-cards', methods=['POST'])
+@_with_metrics
+def create_style_card():
+    try:
+        data = request.json
+        card = ai_agent.distill_style_card(
+            data['references'], name=data.get('name'),
+            use_cache=data.get('use_cache', True), deadline=_request_deadline()
+        )
+        return jsonify({'success': True, 'card': card})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/style-cards/<reference_hash>', methods=['DELETE'])
+def delete_style_card(reference_hash):
+    if ai_agent.style_cards is None or not ai_agent.style_cards.delete(reference_hash):
+        return jsonify({'success': False, 'error': '风格卡片不存在'})
+    return jsonify({'success': True})
+
 @app.route('/api/generate-draft', methods=['POST'])
+@_with_metrics
 def generate_draft():
     try:
         data = request.json
         user_input = data['user_input']
         references = data['references']
         
-        draft = ai_agent.generate_style_draft(user_input, references)
-        return jsonify({'success': True, 'draft': draft})
+        if data.get('background'):
+            job_id = job_queue.submit('generate_draft', {'user_input': user_input, 'references': references})
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'})
+        
+        draft = ai_agent.generate_style_draft(
+            user_input, references,
+            use_cache=data.get('use_cache', True), deadline=_request_deadline()
+        )
+        return jsonify({'success': True, 'draft': draft, 'reference_budget': _reference_report(references)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/generate-final', methods=['POST'])
+@_with_metrics
+def generate_final():
+    try:
+        data = request.json
+        user_input = data['user_input']
+        references = data['references']
+        
+        preferences = data_manager.get_user_preferences()
+        rules = data_manager.get_restriction_rules()
+        selected_preferences = [preferences[i] for i in data.get('preference_indices', [])]
+        selected_rules = [rules[i] for i in data.get('rule_indices', [])]
+        
+        if data.get('background'):
+            job_id = job_queue.submit('generate_final', {
+                'user_input': user_input, 'references': references,
+                'preferences': selected_preferences, 'rules': selected_rules,
+            })
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'})
+        
+        draft = ai_agent.generate_final_draft(
+            user_input, references, selected_preferences, selected_rules,
+            use_cache=data.get('use_cache', True), deadline=_request_deadline()
+        )
+        return jsonify({'success': True, 'draft': draft, 'reference_budget': _reference_report(references)})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/apply-preferences', methods=['POST'])
+@_with_metrics
 def apply_preferences():
     try:
         data = request.json
@@ -993,13 +1361,20 @@ def apply_preferences():
         
         preferences = data_manager.get_user_preferences()
         selected_preferences = [preferences[i] for i in preference_indices]
-        
-        modified_draft = ai_agent.apply_preferences(draft, selected_preferences)
+        _record_selection(preference_ids=[p["id"] for p in selected_preferences])
+        
+        modified_draft = _speculative_result('preferences', draft, selected_preferences)
+        if modified_draft is None:
+            modified_draft = ai_agent.apply_preferences(
+                draft, selected_preferences,
+                use_cache=data.get('use_cache', True), deadline=_request_deadline()
+            )
         return jsonify({'success': True, 'draft': modified_draft})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/apply-rules', methods=['POST'])
+@_with_metrics
 def apply_rules():
     try:
         data = request.json
@@ -1008,62 +1383,237 @@ def apply_rules():
         
         rules = data_manager.get_restriction_rules()
         selected_rules = [rules[i] for i in rule_indices]
-        
-        modified_draft = ai_agent.apply_restrictions(draft, selected_rules)
+        _record_selection(rule_ids=[r["id"] for r in selected_rules])
+        
+        modified_draft = _speculative_result('rules', draft, selected_rules)
+        if modified_draft is None:
+            modified_draft = ai_agent.apply_restrictions(
+                draft, selected_rules,
+                use_cache=data.get('use_cache', True), deadline=_request_deadline()
+            )
         return jsonify({'success': True, 'draft': modified_draft})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/ai-edit', methods=['POST'])
+@_with_metrics
 def ai_edit():
     try:
         data = request.json
         draft = data['draft']
         instruction = data['instruction']
         
-        modified_draft = ai_agent.modify_with_instruction(draft, instruction)
+        # 带session_id时在多轮修改会话中进行，每轮只发送新的指令
+        if data.get('session_id'):
+            modified_draft = _edit_session(data['session_id']).edit(draft, instruction, deadline=_request_deadline())
+        else:
+            modified_draft = ai_agent.modify_with_instruction(
+                draft, instruction,
+                use_cache=data.get('use_cache', True), deadline=_request_deadline()
+            )
         return jsonify({'success': True, 'draft': modified_draft})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def _sse_event(event: str, payload: dict) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _sse_response(deltas, extra: dict = None):
+    """
+    将增量文本生成器包装为SSE响应
+    每个增量以delta事件推送，结束时以done事件推送完整文本，出错时推送error事件；
+    done和error事件都附带本次请求的调用指标，extra中的字段会一并放入done事件。
+    各stream接口在创建响应前解析参数，这一阶段出错时与其他接口一样返回JSON错误
+    """
+    def generate():
+        parts = []
+        with ai_agent.metrics.session() as session:
+            try:
+                for delta in deltas:
+                    parts.append(delta)
+                    yield _sse_event('delta', {'text': delta})
+            except Exception as e:
+                yield _sse_event('error', {'error': str(e), 'metrics': session.summary()})
+                return
+        yield _sse_event('done', {'draft': "".join(parts).strip(), 'metrics': session.summary(), **(extra or {})})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/stream/generate-draft', methods=['POST'])
+def stream_generate_draft():
+    try:
+        data = request.json
+        return _sse_response(ai_agent.stream_style_draft(
+            data['user_input'], data['references'], use_cache=data.get('use_cache', True),
+            deadline=_request_deadline()
+        ), extra={'reference_budget': _reference_report(data['references'])})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stream/generate-final', methods=['POST'])
+def stream_generate_final():
+    try:
+        data = request.json
+        preferences = data_manager.get_user_preferences()
+        rules = data_manager.get_restriction_rules()
+        selected_preferences = [preferences[i] for i in data.get('preference_indices', [])]
+        selected_rules = [rules[i] for i in data.get('rule_indices', [])]
+        return _sse_response(ai_agent.stream_final_draft(
+            data['user_input'], data['references'], selected_preferences, selected_rules,
+            use_cache=data.get('use_cache', True), deadline=_request_deadline()
+        ), extra={'reference_budget': _reference_report(data['references'])})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stream/apply-preferences', methods=['POST'])
+def stream_apply_preferences():
+    try:
+        data = request.json
+        preferences = data_manager.get_user_preferences()
+        selected_preferences = [preferences[i] for i in data['preference_indices']]
+        _record_selection(preference_ids=[p["id"] for p in selected_preferences])
+        speculative = _speculative_result('preferences', data['draft'], selected_preferences)
+        if speculative is not None:
+            return _sse_response(iter([speculative]), extra={'speculative': True})
+        return _sse_response(ai_agent.stream_preferences(
+            data['draft'], selected_preferences, use_cache=data.get('use_cache', True),
+            deadline=_request_deadline()
+        ))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stream/apply-rules', methods=['POST'])
+def stream_apply_rules():
+    try:
+        data = request.json
+        rules = data_manager.get_restriction_rules()
+        selected_rules = [rules[i] for i in data['rule_indices']]
+        _record_selection(rule_ids=[r["id"] for r in selected_rules])
+        speculative = _speculative_result('rules', data['draft'], selected_rules)
+        if speculative is not None:
+            return _sse_response(iter([speculative]), extra={'speculative': True})
+        return _sse_response(ai_agent.stream_restrictions(
+            data['draft'], selected_rules, use_cache=data.get('use_cache', True),
+            deadline=_request_deadline()
+        ))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/speculate', methods=['POST'])
+def speculate():
+    """
+    文案刚生成、用户还在勾选时调用：按上一次的选择（没有则全选）在后台先应用偏好或规则，
+    用户确认的选择与之一致时，apply接口直接返回推测结果
+    """
+    if speculator is None:
+        return jsonify({'started': False, 'enabled': False})
+    data = request.json
+    stage = data['stage']
+    last_selection = data_manager.get_last_selection()
+    if stage == 'preferences':
+        predicted = predict_selection(data_manager.get_user_preferences(), last_selection['preference_ids'])
+    else:
+        predicted = predict_selection(data_manager.get_restriction_rules(), last_selection['rule_ids'])
+    try:
+        started = speculator.speculate(stage, data['draft'], predicted)
+    except ValueError as e:
+        return jsonify({'started': False, 'error': str(e)})
+    return jsonify({'started': started, 'enabled': True})
+
+@app.route('/api/stream/ai-edit', methods=['POST'])
+def stream_ai_edit():
+    try:
+        data = request.json
+        if data.get('session_id'):
+            return _sse_response(_edit_session(data['session_id']).stream_edit(
+                data['draft'], data['instruction'], deadline=_request_deadline()
+            ))
+        return _sse_response(ai_agent.stream_instruction_edit(
+            data['draft'], data['instruction'], use_cache=data.get('use_cache', True),
+            deadline=_request_deadline()
+        ))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/learn', methods=['POST'])
+@_with_metrics
 def learn_from_edit():
+    """
+    偏好学习和规则学习并发执行
+    请求中background为true时放入任务队列立即返回job_id，可通过 GET /api/jobs/<job_id> 查询结果
+    """
     try:
         data = request.json
         ai_final_draft = data['ai_final_draft']
         user_final_draft = data['user_final_draft']
         user_instructions = data.get('user_instructions', [])
         
-        # 学习偏好
-        learned_preferences = ai_agent.learn_preferences(ai_final_draft, user_final_draft)
-        existing_preferences = data_manager.get_user_preferences()
-        
-        new_preferences = 0
-        for pref in learned_preferences:
-            if deduplication_engine.deduplicate_preference(pref, existing_preferences):
-                data_manager.add_user_preference(pref)
-                new_preferences += 1
-                existing_preferences.append({"description": pref})
-        
-        # 学习规则
-        learned_rules = ai_agent.learn_rules(user_instructions)
-        existing_rules = data_manager.get_restriction_rules()
-        
-        new_rules = 0
-        for rule in learned_rules:
-            if deduplication_engine.deduplicate_rule(rule, existing_rules):
-                data_manager.add_restriction_rule(rule)
-                new_rules += 1
-                existing_rules.append({"instruction": rule})
-        
+        if data.get('background'):
+            job_id = job_queue.submit('learn', {
+                'ai_final_draft': ai_final_draft,
+                'user_final_draft': user_final_draft,
+                'user_instructions': user_instructions,
+            })
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'})
+        
+        result = learn_and_merge(
+            ai_agent, data_manager, deduplication_engine,
+            ai_final_draft, user_final_draft, user_instructions, deadline=_request_deadline()
+        )
+        return jsonify({'success': True, **result.to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/patch/stats')
+def get_patch_stats():
+    return jsonify(ai_agent.patch_mode.stats())
+
+@app.route('/api/rules/stats')
+def get_rule_engine_stats():
+    return jsonify(ai_agent.rule_engine.stats())
+
+@app.route('/api/rules/verify', methods=['POST'])
+def verify_rules():
+    """检查文案是否符合规则（不指定rule_indices时检查全部规则），只在本地检查，不调用大模型"""
+    try:
+        data = request.json
+        rules = data_manager.get_restriction_rules()
+        if 'rule_indices' in data:
+            rules = [rules[i] for i in data['rule_indices']]
+        checks = ai_agent.rule_engine.checks(rules)
+        violations = ai_agent.rule_engine.verify(checks, data['draft'])
         return jsonify({
-            'success': True, 
-            'new_preferences': new_preferences,
-            'new_rules': new_rules
+            'success': True,
+            'checked_rules': len({rule.rule_id for rule in checks}),
+            'violations': [violation.to_dict() for violation in violations],
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/learning/stats')
+def get_learning_stats():
+    return jsonify(LearningGate.default().stats())
+
+@app.route('/api/jobs')
+def list_jobs():
+    return jsonify({
+        'jobs': job_queue.list_jobs(status=request.args.get('status'), limit=int(request.args.get('limit', 50))),
+        'stats': job_queue.stats(),
+    })
+
+@app.route('/api/jobs/<job_id>')
+@app.route('/api/learn/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, **job})
+
 if __name__ == '__main__':
     print("🌐 启动Web界面...")
     print("📱 请在浏览器中访问: http://localhost:8080")